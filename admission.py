@@ -0,0 +1,58 @@
+class AdmissionRejected(Exception):
+    """
+    The request is over a limit of the admission controller.
+    reason is 'client' when its client has too many requests in flight,
+    'requests' or 'bytes' when the whole server has.
+    """
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Limits the upload requests taken in at once: requests in flight, body bytes they announced,
+    and requests in flight per client. A request over a limit is rejected at once instead of waiting,
+    so a burst of clients can not queue up work without bound.
+    Checks are a few comparisons of counters, which are only changed on the event loop.
+    A limit of 0 does not limit.
+    """
+
+    def __init__(self, max_requests=0, max_bytes=0, max_client_requests=0):
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.max_client_requests = max_client_requests
+        self.requests = 0
+        self.bytes = 0
+        # requests in flight per client, clients without any are removed.
+        self.clients = {}
+
+    def admit(self, client, size):
+        """
+        Count a request of size body bytes in, and return the ticket to release it with.
+        Raises AdmissionRejected when it is over a limit.
+        """
+        client_requests = self.clients.get(client, 0)
+        if self.max_client_requests and client_requests >= self.max_client_requests:
+            raise AdmissionRejected('client')
+        if self.max_requests and self.requests >= self.max_requests:
+            raise AdmissionRejected('requests')
+        # a body larger than max_bytes is let in alone, so it is not rejected forever.
+        if self.max_bytes and self.bytes + size > self.max_bytes and self.bytes > 0:
+            raise AdmissionRejected('bytes')
+
+        self.requests += 1
+        self.bytes += size
+        self.clients[client] = client_requests + 1
+        return client, size
+
+    def release(self, ticket):
+        client, size = ticket
+        self.requests -= 1
+        self.bytes -= size
+        client_requests = self.clients[client] - 1
+        if client_requests:
+            self.clients[client] = client_requests
+        else:
+            del self.clients[client]
@@ -1,24 +1,45 @@
-import os
-import base64
+import asyncio
+import functools
+import json
 import re
+import threading
+import time
+from email.utils import formatdate
 from uuid import UUID
-from pathlib import Path
 
 import responder
+from starlette.requests import ClientDisconnect
 
-from database import Database
+from admission import AdmissionController, AdmissionRejected
+from checksum import ALGORITHMS as CHECKSUM_ALGORITHMS, COLLISION_RESISTANT, digest_header, parse_checksum, \
+    RunningDigests
+from database import create_backend, Database
+from deleter import Deleter
+from durability import GroupCommitter
+from executor import create_executor
+from locks import create_lock_manager, LockTimeout
+from metadata import to_metadata_dict
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, PhaseTimer, Registry
+from reaper import Reaper
+from shaping import BandwidthShaper
+from recovery import UploadJournal
+from storage import create_storage
+import config
 import headers
 
 cors_params = {
     'allow_origins': '*',
-    'allow_methods': ['GET', 'POST', 'HEAD', 'OPTIONS', 'PATCH'],
+    'allow_methods': ['GET', 'POST', 'HEAD', 'OPTIONS', 'PATCH', 'DELETE'],
     'allow_headers': ['*'],
     'expose_headers': [
+        headers.TUS_CHECKSUM_ALGORITHM,
         headers.TUS_EXTENSION,
         headers.TUS_MAX_SIZE,
         headers.TUS_RESUMABLE,
         headers.TUS_VERSION,
+        headers.UPLOAD_CONCAT,
         headers.UPLOAD_DEFER_LENGTH,
+        headers.UPLOAD_EXPIRES,
         headers.UPLOAD_LENGTH,
         headers.UPLOAD_METADATA,
         headers.UPLOAD_OFFSET
@@ -26,8 +47,118 @@ cors_params = {
 }
 api = responder.API(cors=True, cors_params=cors_params, allowed_hosts=['*'])
 
+
+class IdentityDownloadMiddleware:
+    """
+    Uploaded files are sent as stored.
+    Gzip would change the length Content-Range refers to and rarely helps already compressed media.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, scope):
+        if scope['type'] == 'http' and scope['path'].startswith('/files/'):
+            accept_encoding = headers.ACCEPT_ENCODING.lower().encode()
+            scope = dict(scope)
+            scope['headers'] = [(k, v) for k, v in scope['headers'] if k != accept_encoding]
+
+        return self.app(scope)
+
+
+api.add_middleware(IdentityDownloadMiddleware)
+
+upload_storage = create_storage(config.STORAGE, config.STORAGE_ROOTS, config.STORAGE_PLACEMENT,
+                                config.STORAGE_SHARD_DEPTH, config.FD_CACHE_SIZE, config.FD_IDLE_TIMEOUT)
+journal = UploadJournal(upload_storage, config.UPLOAD_EXPIRATION, config.RECOVERY_WORKERS) \
+    if config.RECOVERY else None
+
 global db
-db = Database()
+db = Database(create_backend(config.DATABASE, config.DATABASE_PATH), journal)
+
+file_io = create_executor(config.IO_EXECUTOR, config.IO_MAX_CONCURRENCY, config.IO_MAX_WORKERS)
+upload_locks = create_lock_manager(config.LOCK_MANAGER, config.LOCK_DIRECTORY)
+if config.DEDUP and config.UPLOAD_DIGEST not in COLLISION_RESISTANT:
+    raise ValueError(f'dedup needs a collision resistant upload digest, not {config.UPLOAD_DIGEST!r}')
+running_digests = RunningDigests(config.UPLOAD_DIGEST) if config.UPLOAD_DIGEST else None
+group_committer = GroupCommitter(upload_storage, file_io, config.GROUP_COMMIT_INTERVAL, config.GROUP_COMMIT_BYTES)
+
+
+def _on_delete(id):
+    """
+    Drop what is kept for the upload besides its data, called once its data is deleted.
+    """
+    if running_digests is not None:
+        running_digests.pop(id)
+    if config.DEDUP:
+        upload_data = db.get_by_id(id)
+        if upload_data is not None and upload_data.upload_digest is not None:
+            upload_storage.release_blob(upload_data.upload_digest)
+
+
+reaper = Reaper(db, upload_storage, config.REAPER_BATCH_SIZE, on_delete=_on_delete, locks=upload_locks)
+admission = AdmissionController(config.ADMISSION_MAX_REQUESTS, config.ADMISSION_MAX_BYTES,
+                                config.ADMISSION_MAX_CLIENT_REQUESTS)
+shaper = BandwidthShaper(config.SHAPING_RATE, config.SHAPING_CLIENT_RATE, config.SHAPING_UPLOAD_RATE,
+                         config.SHAPING_BURST)
+upload_deleter = Deleter(db, upload_storage, config.DELETER_BATCH_SIZE, config.DELETER_MAX_BYTES_PER_SECOND,
+                         on_delete=_on_delete, locks=upload_locks)
+
+metrics = Registry()
+HANDLER_SECONDS = metrics.histogram('tus_handler_seconds', 'Time spent in request handlers.', ['handler'])
+PATCH_PHASE_SECONDS = metrics.histogram('tus_patch_phase_seconds', 'Time spent per PATCH request in each phase.',
+                                        ['phase'])
+RECEIVED_BYTES = metrics.counter('tus_received_bytes_total', 'Upload bytes received.')
+SENT_BYTES = metrics.counter('tus_sent_bytes_total', 'Upload bytes sent.')
+PATCHES_IN_FLIGHT = metrics.gauge('tus_patches_in_flight', 'PATCH requests being received.')
+ADMISSION_REJECTED = metrics.counter('tus_admission_rejected_total', 'Upload requests rejected over a limit.',
+                                     ['reason'])
+metrics.gauge('tus_admitted_requests', 'Upload requests in flight.', function=lambda: admission.requests)
+metrics.gauge('tus_admitted_bytes', 'Body bytes announced by upload requests in flight.',
+              function=lambda: admission.bytes)
+metrics.gauge('tus_admitted_clients', 'Clients with upload requests in flight.',
+              function=lambda: len(admission.clients))
+metrics.gauge('tus_shaped_writers', 'Upload bodies being received through the bandwidth shaper.',
+              function=lambda: shaper.writers)
+metrics.counter('tus_throttled_seconds_total', 'Time upload bodies waited for their bandwidth share.',
+                function=lambda: shaper.throttled_seconds)
+metrics.gauge('tus_uploads', 'Uploads in the database.', function=db.count)
+metrics.gauge('tus_io_queue_depth', 'File I/O calls waiting for the executor.', function=lambda: file_io.queue_depth)
+metrics.gauge('tus_io_active', 'File I/O calls running in the executor.', function=lambda: file_io.active)
+metrics.counter('tus_lock_acquired_total', 'Upload locks acquired.', function=lambda: upload_locks.acquired)
+metrics.counter('tus_lock_contended_total', 'Upload locks that had to be waited for.',
+                function=lambda: upload_locks.contended)
+metrics.counter('tus_lock_timeouts_total', 'Upload locks given up waiting for.', function=lambda: upload_locks.timeouts)
+metrics.counter('tus_lock_wait_seconds_total', 'Time spent waiting for upload locks.',
+                function=lambda: upload_locks.wait_seconds)
+metrics.gauge('tus_lock_waiting', 'Requests waiting for an upload lock.', function=lambda: upload_locks.waiting)
+metrics.counter('tus_reaped_uploads_total', 'Expired uploads removed.', function=lambda: reaper.reaped_uploads)
+metrics.counter('tus_reclaimed_bytes_total', 'Bytes of expired uploads removed.',
+                function=lambda: reaper.reclaimed_bytes)
+metrics.gauge('tus_deleter_queue_depth', 'Terminated uploads waiting to be deleted.',
+              function=lambda: upload_deleter.queue_depth)
+metrics.counter('tus_deleted_uploads_total', 'Terminated uploads deleted.',
+                function=lambda: upload_deleter.deleted_uploads)
+metrics.counter('tus_deleted_bytes_total', 'Bytes of terminated uploads deleted.',
+                function=lambda: upload_deleter.deleted_bytes)
+metrics.counter('tus_sync_batches_total', 'Group commit syncs.', function=lambda: group_committer.batches)
+metrics.counter('tus_synced_uploads_total', 'Uploads synced by group commits.',
+                function=lambda: group_committer.synced_uploads)
+metrics.counter('tus_sync_seconds_total', 'Time spent in group commit syncs.',
+                function=lambda: group_committer.sync_seconds)
+if journal is not None:
+    metrics.counter('tus_recovered_uploads_total', 'Uploads recovered from their sidecars.',
+                    function=lambda: journal.recovered_uploads)
+    metrics.gauge('tus_recovery_complete', 'Whether every sidecar was scanned.', function=lambda: int(journal.complete))
+if hasattr(upload_storage, 'deduplicated_uploads'):
+    metrics.counter('tus_deduplicated_uploads_total', 'Finished uploads sharing the content of earlier ones.',
+                    function=lambda: upload_storage.deduplicated_uploads)
+    metrics.counter('tus_deduplicated_bytes_total', 'Bytes of finished uploads sharing the content of earlier ones.',
+                    function=lambda: upload_storage.deduplicated_bytes)
+if hasattr(upload_storage, 'fds'):
+    metrics.counter('tus_fd_cache_hits_total', 'File descriptors found open.', function=lambda: upload_storage.fds.hits)
+    metrics.counter('tus_fd_cache_misses_total', 'File descriptors opened.', function=lambda: upload_storage.fds.misses)
+    metrics.gauge('tus_fd_cache_size', 'File descriptors kept open.', function=lambda: len(upload_storage.fds))
 
 CURRENT_TUS_VERSION = '1.0.0'
 SUPPORTED_VERSIONS = [
@@ -37,8 +168,85 @@ ACCEPTABLE_UPLOAD_SIZE = 1024 ** 3
 PATCH_REQ_CONTENT_TYPE = 'application/offset+octet-stream'
 AVAILABLE_EXTENSION = [
     'creation',
-    'creation-defer-length'
+    'creation-defer-length',
+    'creation-with-upload',
+    'concatenation',
+    'concatenation-unfinished',
+    'checksum',
+    'expiration',
+    'termination'
 ]
+HTTP_CHECKSUM_MISMATCH = 460
+CONCAT_URL_PATTERN = re.compile(r'/files/([^/\s]+)$', re.RegexFlag.ASCII)
+# a single byte range, multiple ranges are not supported.
+RANGE_PATTERN = re.compile(r'\s*bytes\s*=\s*(\d*)-(\d*)\s*', re.RegexFlag.ASCII)
+
+
+@api.on_event('startup')
+async def start_fd_eviction():
+    async def evict_idle_fds():
+        while True:
+            await asyncio.sleep(config.FD_IDLE_TIMEOUT)
+            await file_io.run(upload_storage.fds.evict_idle)
+
+    if hasattr(upload_storage, 'fds'):
+        asyncio.ensure_future(evict_idle_fds())
+
+
+@api.on_event('startup')
+async def start_recovery():
+    # requests are served meanwhile, the uploads they use are recovered on first access.
+    if journal is not None:
+        threading.Thread(target=db.recover, name='tus-recovery', daemon=True).start()
+
+
+@api.on_event('startup')
+async def start_reaper():
+    async def reap_expired_uploads():
+        while True:
+            await asyncio.sleep(config.REAPER_INTERVAL)
+            await file_io.run(reaper.reap)
+
+    if config.UPLOAD_EXPIRATION > 0:
+        asyncio.ensure_future(reap_expired_uploads())
+
+
+def _timed(handler):
+    """
+    Decorator observing the run time of a handler in HANDLER_SECONDS.
+    Decorators are plain names and calls, as Python before 3.9 allows no other expressions.
+    """
+    return HANDLER_SECONDS.labels(handler).time()
+
+
+def _admitted(handler):
+    """
+    Decorator letting an upload request in through the admission controller.
+    Over a limit it is answered at once, 429 when its client has too many requests in flight and
+    503 when the server has, with Retry-After.
+    """
+    @functools.wraps(handler)
+    async def admit(self, req, resp, **kwargs):
+        content_length = req.headers.get(headers.CONTENT_LENGTH)
+        # a body of unknown size takes the buffer it is read through.
+        size = int(content_length) if content_length is not None and content_length.isdecimal() \
+            else config.PATCH_BUFFER_SIZE
+        try:
+            ticket = admission.admit(req._starlette.client.host, size)
+        except AdmissionRejected as rejected:
+            ADMISSION_REJECTED.labels(rejected.reason).inc()
+            _set_common_headers(resp)
+            resp.headers[headers.RETRY_AFTER] = str(config.ADMISSION_RETRY_AFTER)
+            resp.status_code = api.status_codes.HTTP_429 if rejected.reason == 'client' \
+                else api.status_codes.HTTP_503
+            return
+
+        try:
+            await handler(self, req, resp, **kwargs)
+        finally:
+            admission.release(ticket)
+
+    return admit
 
 
 @api.route('/')
@@ -48,10 +256,18 @@ class Default:
         resp.content = url
 
 
+@api.route('/metrics')
+def serve_metrics(req, resp):
+    resp.text = metrics.render()
+    resp.headers[headers.CONTENT_TYPE] = METRICS_CONTENT_TYPE
+
+
 @api.route('/files')
 class Files:
 
-    def on_post(self, req, resp):
+    @_timed('post')
+    @_admitted
+    async def on_post(self, req, resp):
         """
         Creation extension.
         create upload resource in the Server.
@@ -61,72 +277,106 @@ class Files:
         upload_metadata = req.headers.get(headers.UPLOAD_METADATA)
         upload_concat = req.headers.get(headers.UPLOAD_CONCAT)
 
-        # Upload-Length header or Upload-Defer-Length header must be specified.
-        # And Upload-Defer-Length header must be '1' if it was specified.
-        if upload_length is None and upload_defer_length != '1':
-            resp.status_code = api.status_codes.HTTP_400
-            return
-
         if upload_metadata is not None:
             upload_metadata = to_metadata_dict(upload_metadata)
 
+        def set_creation_headers(resp, upload_data):
+            resp.headers[headers.TUS_RESUMABLE] = CURRENT_TUS_VERSION
+            resp.headers[headers.LOCATION] = f'/files/{upload_data.id}'
+            if upload_data.upload_expires is not None:
+                resp.headers[headers.UPLOAD_EXPIRES] = formatdate(upload_data.upload_expires, usegmt=True)
+            resp.status_code = api.status_codes.HTTP_201
+
         if upload_concat is not None:
-            if upload_concat != 'partial' and not upload_concat.startswith('final'):
+            if upload_concat != 'partial' and not upload_concat.startswith('final;'):
                 resp.status_code = api.status_codes.HTTP_400
                 return
 
             if upload_concat.startswith('final;'):
-                pattern = re.compile(r'\/files\/([^\/\s]+)', re.RegexFlag.ASCII)
-                ids = [
-                    re.fullmatch(pattern, url)[1] for urls in upload_concat.split(';')[1:]
-                    for url in urls[0].split(' ') if re.fullmatch(pattern, url)
-                ]
-                upload_data = [db.get_by_id(id) for id in ids]
-                if None in upload_data:
+                # final uploads are built from partial uploads and have no content of their own.
+                if req.headers.get(headers.CONTENT_TYPE) == PATCH_REQ_CONTENT_TYPE:
                     resp.status_code = api.status_codes.HTTP_400
                     return
 
-                concat_id = '_'.join(ids)
-                concat_file = Path('/tmp', concat_id)
+                ids = _parse_concat_ids(upload_concat)
+                partials = [await _find_upload(id) for id in ids] if ids else []
+                if not partials or not all(_is_partial(partial) for partial in partials):
+                    resp.status_code = api.status_codes.HTTP_400
+                    return
+
+                lengths = [partial.upload_length for partial in partials]
+                upload_length = None if None in lengths else sum(int(length) for length in lengths)
+                if upload_length is not None and upload_length > ACCEPTABLE_UPLOAD_SIZE:
+                    resp.status_code = api.status_codes.HTTP_413
+                    return
+
+                # virtual finals are served from their partial uploads and may be created before those are finished.
+                if config.CONCAT_MODE == 'virtual':
+                    upload_data = await _write_db(db.add_uploads, upload_length, metadata=upload_metadata,
+                                                  upload_concat=upload_concat, upload_parts=ids)
+                    set_creation_headers(resp, upload_data)
+                    return
+
+                # copied finals need the whole content of finished partial uploads.
+                if not all(_is_finished(partial) for partial in partials):
+                    resp.status_code = api.status_codes.HTTP_400
+                    return
+
+                upload_data = await _write_db(db.add_uploads, upload_length, metadata=upload_metadata,
+                                              upload_concat=upload_concat)
+                sources = [partial.id for partial in partials if partial.upload_offset > 0]
+
+                concat_offset = 0
 
-                def copy_file(file_path, writer, buff_size=1024 * 1024):
-                    with open(file_path, 'rb') as input:
-                        data = input.read(buff_size)
-                        if len(data) > 0:
-                            writer.write(data)
+                def progress(copied):
+                    nonlocal concat_offset
+                    db.set_upload_offset(upload_data.id, concat_offset + copied, expected=concat_offset)
+                    concat_offset += copied
 
-                mode = 'a+b'
-                with open(concat_file, mode) as output:
-                    for id in ids:
-                        merging_file = Path('/tmp', id)
-                        copy_file(merging_file, output)
+                # large finals are filled in the background, HEAD reports the progress meanwhile.
+                if upload_length > config.CONCAT_BACKGROUND_SIZE:
+                    _concatenate_in_background(sources, upload_data.id, progress)
+                else:
+                    await file_io.run(upload_storage.concatenate, sources, upload_data.id, progress)
 
-                resp.status_code = api.status_codes.HTTP_201
-                resp.headers[headers.LOCATION] = f'files/{concat_id}'
+                set_creation_headers(resp, upload_data)
                 return
 
-        def set_creation_headers(resp, upload_data):
-            resp.headers[headers.TUS_RESUMABLE] = CURRENT_TUS_VERSION
-            resp.headers[headers.LOCATION] = f'/files/{upload_data.id}'
-            resp.status_code = api.status_codes.HTTP_201
+        # Upload-Length header or Upload-Defer-Length header must be specified.
+        # And Upload-Defer-Length header must be '1' if it was specified.
+        if upload_length is None and upload_defer_length != '1':
+            resp.status_code = api.status_codes.HTTP_400
+            return
 
         if upload_length is not None:
             if not upload_length.isdecimal():
                 resp.status_code = api.status_codes.HTTP_400
                 return
 
-            if int(upload_length) <= ACCEPTABLE_UPLOAD_SIZE:
-                upload_data = db.add_uploads(upload_length, metadata=upload_metadata, upload_concat=upload_concat)
-                set_creation_headers(resp, upload_data)
-
-            else:
+            if int(upload_length) > ACCEPTABLE_UPLOAD_SIZE:
                 resp.status_code = api.status_codes.HTTP_413
+                return
+
+            upload_data = await _write_db(db.add_uploads, upload_length, metadata=upload_metadata,
+                                          upload_concat=upload_concat, upload_expires=_expires_from_now())
 
         else:
-            upload_data = db.add_uploads(upload_length=None, upload_defer_length='1',
-                                         metadata=upload_metadata, upload_concat=upload_concat)
-            set_creation_headers(resp, upload_data)
+            upload_data = await _write_db(db.add_uploads, upload_length=None, upload_defer_length='1',
+                                          metadata=upload_metadata, upload_concat=upload_concat,
+                                          upload_expires=_expires_from_now())
 
+        set_creation_headers(resp, upload_data)
+
+        # creation-with-upload extension, the body is the first chunk of the upload.
+        # When it can not be written, the error status is responded with the Location to resume from.
+        if req.headers.get(headers.CONTENT_TYPE) == PATCH_REQ_CONTENT_TYPE:
+            async with upload_locks.lock(upload_data.id, timeout=config.LOCK_TIMEOUT):
+                upload_offset = await _write_body(req, resp, upload_data)
+
+            if upload_offset is not None:
+                resp.headers[headers.UPLOAD_OFFSET] = str(upload_offset)
+
+    @_timed('options')
     def on_options(self, req, resp):
         """
         Options.
@@ -140,21 +390,90 @@ class Files:
         resp.headers[headers.TUS_VERSION] = ','.join(SUPPORTED_VERSIONS)
         resp.headers[headers.TUS_MAX_SIZE] = str(ACCEPTABLE_UPLOAD_SIZE)
         resp.headers[headers.TUS_EXTENSION] = ','.join(AVAILABLE_EXTENSION)
+        resp.headers[headers.TUS_CHECKSUM_ALGORITHM] = ','.join(CHECKSUM_ALGORITHMS)
 
         resp.status_code = api.status_codes.HTTP_200
 
 
+@api.route('/files/batch')
+class Batch:
+
+    @_timed('batch')
+    @_admitted
+    async def on_post(self, req, resp):
+        """
+        Batch creation.
+        Create several uploads in one request, from a JSON body like
+        {"uploads": [{"length": 10, "metadata": "filename d29ybGQ="}, {"defer_length": true, "concat": "partial"}]}
+        where metadata is in the form of Upload-Metadata header.
+        Responds the Locations in the order of the uploads, nothing is created when any of them is invalid.
+        """
+        _set_common_headers(resp)
+
+        content_length = req.headers.get(headers.CONTENT_LENGTH)
+        if content_length is not None and content_length.isdecimal() \
+                and int(content_length) > config.BATCH_MAX_BODY_BYTES:
+            resp.status_code = api.status_codes.HTTP_413
+            return
+
+        # a body without Content-Length is read up to the limit.
+        body = bytearray()
+        async for piece in _read_body(req, config.PATCH_BUFFER_SIZE):
+            body += piece
+            if len(body) > config.BATCH_MAX_BODY_BYTES:
+                resp.status_code = api.status_codes.HTTP_413
+                return
+
+        try:
+            uploads = json.loads(body)['uploads']
+        except (ValueError, TypeError, KeyError):
+            resp.status_code = api.status_codes.HTTP_400
+            return
+
+        if not isinstance(uploads, list) or not uploads:
+            resp.status_code = api.status_codes.HTTP_400
+            return
+
+        if len(uploads) > config.BATCH_MAX_UPLOADS:
+            resp.status_code = api.status_codes.HTTP_413
+            return
+
+        upload_expires = _expires_from_now()
+        specs = []
+        for upload in uploads:
+            spec = _parse_batch_upload(upload)
+            if spec is None:
+                resp.status_code = api.status_codes.HTTP_400
+                return
+
+            if spec['upload_length'] is not None and spec['upload_length'] > ACCEPTABLE_UPLOAD_SIZE:
+                resp.status_code = api.status_codes.HTTP_413
+                return
+
+            spec['upload_expires'] = upload_expires
+            specs.append(spec)
+
+        created = await _write_db(db.add_uploads_many, specs)
+
+        if upload_expires is not None:
+            resp.headers[headers.UPLOAD_EXPIRES] = formatdate(upload_expires, usegmt=True)
+        resp.headers[headers.CONTENT_TYPE] = 'application/json'
+        resp.content = json.dumps({'locations': [f'/files/{upload_data.id}' for upload_data in created]})
+        resp.status_code = api.status_codes.HTTP_201
+
+
 @api.route('/files/{file_id}')
 class File:
 
-    def on_head(self, req, resp, *, file_id):
+    @_timed('head')
+    async def on_head(self, req, resp, *, file_id):
         """
         Head.
         Head returns current Upload-Offset header.
         If the size of the upload is known, Server must
         include the Upload-Length header.
         """
-        upload_data = db.get_by_id(UUID(file_id))
+        upload_data = await _get_upload(file_id)
 
         _set_common_headers(resp)
 
@@ -162,9 +481,13 @@ class File:
             resp.status_code = api.status_codes.HTTP_404
             return
 
+        if upload_data.upload_parts is not None:
+            await _set_virtual_final_headers(resp, upload_data)
+            return
+
         resp.headers[headers.UPLOAD_OFFSET] = str(upload_data.upload_offset)
-        if upload_data.upload_metadata is not None:
-            resp.headers[headers.UPLOAD_METADATA] = to_metadata_header(upload_data.upload_metadata)
+        if upload_data.upload_metadata_header is not None:
+            resp.headers[headers.UPLOAD_METADATA] = upload_data.upload_metadata_header
 
         if upload_data.upload_concat is not None:
             resp.headers[headers.UPLOAD_CONCAT] = upload_data.upload_concat
@@ -174,29 +497,92 @@ class File:
         else:
             resp.headers[headers.UPLOAD_LENGTH] = str(upload_data.upload_length)
 
-    def on_get(self, req, resp, *, file_id):
+    @_timed('get')
+    async def on_get(self, req, resp, *, file_id):
         """
         Get.
         Get responses uploaded file.
         """
-        upload_data = db.get_by_id(UUID(file_id))
+        upload_data = await _get_upload(file_id)
 
         if upload_data is None:
             resp.status_code = api.status_codes.HTTP_404
             return
 
-        uploaded_file = Path('/tmp', file_id)
+        if upload_data.upload_parts is None:
+            segments = [(upload_data.id, upload_data.upload_offset)]
+        else:
+            parts = await _get_parts(upload_data)
+            if parts is None:
+                resp.status_code = api.status_codes.HTTP_410
+                return
+            if not all(_is_finished(part) for part in parts):
+                resp.status_code = api.status_codes.HTTP_409
+                return
+            segments = [(part.id, part.upload_offset) for part in parts]
+
+        size = sum(segment_size for _, segment_size in segments)
+        # uploads are append only, so the id and the offset identify the content.
+        etag = f'"{file_id}-{size}"'
 
-        with open(uploaded_file, mode='rb') as f:
-            resp.content = f.read()
+        resp.headers[headers.ACCEPT_RANGES] = 'bytes'
+        resp.headers[headers.ETAG] = etag
 
+        start, end = 0, size
+        range_header = req.headers.get(headers.RANGE)
+        if_range = req.headers.get(headers.IF_RANGE)
+        if range_header is not None and (if_range is None or if_range == etag):
+            byte_range = _parse_range(range_header, size)
+            if byte_range is False:
+                resp.headers[headers.CONTENT_RANGE] = f'bytes */{size}'
+                resp.status_code = api.status_codes.HTTP_416
+                resp.content = b''
+                return
+
+            if byte_range is not None:
+                start, end = byte_range
+                resp.headers[headers.CONTENT_RANGE] = f'bytes {start}-{end - 1}/{size}'
+                resp.status_code = api.status_codes.HTTP_206
+
+        digest = None if upload_data.upload_digest is None \
+            else digest_header(config.UPLOAD_DIGEST, upload_data.upload_digest)
+        if digest is not None:
+            resp.headers[headers.DIGEST] = digest
+
+        resp.headers[headers.CONTENT_TYPE] = 'application/octet-stream'
+        resp.headers[headers.CONTENT_LENGTH] = str(end - start)
+        if end == start:
+            resp.content = b''
+            return
+
+        resp.stream(_send_files, segments, start, end)
+
+    @_timed('delete')
+    async def on_delete(self, req, resp, *, file_id):
+        """
+        Termination extension.
+        Delete terminates the upload at once, its data is removed in the background.
+        """
+        upload_data = await _get_upload(file_id)
+
+        _set_common_headers(resp)
+
+        if upload_data is None:
+            resp.status_code = api.status_codes.HTTP_404
+            return
+
+        await _write_db(upload_deleter.delete, upload_data.id)
+        resp.status_code = api.status_codes.HTTP_204
+
+    @_timed('patch')
+    @_admitted
     async def on_patch(self, req, resp, *, file_id):
         """
         Patch.
         Patch apply the bytes at the given offset.
         Specified resource is not known, it returns 404.
         """
-        upload_data = db.get_by_id(UUID(file_id))
+        upload_data = await _get_upload(file_id)
 
         _set_common_headers(resp)
 
@@ -204,68 +590,466 @@ class File:
             resp.status_code = api.status_codes.HTTP_404
             return
 
+        # final uploads are built from partial uploads and can not be patched.
+        if upload_data.upload_concat is not None and upload_data.upload_concat.startswith('final;'):
+            resp.status_code = api.status_codes.HTTP_403
+            return
+
         # check content-type
         content_type = req.headers.get(headers.CONTENT_TYPE)
         if content_type != PATCH_REQ_CONTENT_TYPE:
             resp.status_code = api.status_codes.HTTP_415
             return
 
-        # check offset
-        req_offset = req.headers.get(headers.UPLOAD_OFFSET)
-        current_offset = upload_data.upload_offset
+        # writes to an upload are serialized, a duplicated request sees the offset left by the first one.
+        PATCHES_IN_FLIGHT.inc()
+        try:
+            async with upload_locks.lock(upload_data.id, timeout=config.LOCK_TIMEOUT):
+                upload_data = await _find_upload(upload_data.id)
+                if upload_data is None:
+                    resp.status_code = api.status_codes.HTTP_404
+                    return
 
-        # request offset and current offset is not match.
-        if req_offset != str(current_offset):
-            resp.status_code = api.status_codes.HTTP_409
-            return
+                # check offset
+                req_offset = req.headers.get(headers.UPLOAD_OFFSET)
+                current_offset = upload_data.upload_offset
 
-        # request offset is over upload length.
-        content_length = req.headers.get(headers.CONTENT_LENGTH)
-        if content_length is not None and content_length.isdecimal():
-            if upload_data.upload_defer_length != 1 \
-                    and current_offset + int(content_length) > int(upload_data.upload_length):
-                resp.status_code = api.status_codes.HTTP_400
-                return
+                # request offset and current offset is not match.
+                if req_offset != str(current_offset):
+                    resp.status_code = api.status_codes.HTTP_409
+                    return
 
-        resp.status_code = api.status_codes.HTTP_204
+                # creation-defer-length extension, the length of a deferred upload is sent with a PATCH.
+                req_length = req.headers.get(headers.UPLOAD_LENGTH)
+                if req_length is not None:
+                    if not req_length.isdecimal():
+                        resp.status_code = api.status_codes.HTTP_400
+                        return
+
+                    if upload_data.upload_length is None:
+                        if int(req_length) > ACCEPTABLE_UPLOAD_SIZE:
+                            resp.status_code = api.status_codes.HTTP_413
+                            return
+                        if int(req_length) < current_offset:
+                            resp.status_code = api.status_codes.HTTP_400
+                            return
 
-        patch_data = await req.content
-        received_file = Path('/tmp', file_id)
+                        await _write_db(db.set_upload_length, upload_data.id, int(req_length))
+                        upload_data.upload_length = int(req_length)
+                        upload_data.upload_defer_length = None
 
-        mode = 'w+b' if current_offset == 0 else 'a+b'
-        with open(received_file, mode) as output:
-            output.write(patch_data)
+                    # the length can not be changed once it is known.
+                    elif int(req_length) != int(upload_data.upload_length):
+                        resp.status_code = api.status_codes.HTTP_400
+                        return
 
-        current_offset = os.path.getsize(received_file)
-        upload_data.upload_offset = current_offset
+                # request offset is over upload length.
+                upload_length = None if upload_data.upload_length is None else int(upload_data.upload_length)
+                content_length = req.headers.get(headers.CONTENT_LENGTH)
+                if content_length is not None and content_length.isdecimal():
+                    if upload_length is not None and current_offset + int(content_length) > upload_length:
+                        resp.status_code = api.status_codes.HTTP_400
+                        return
+
+                current_offset = await _write_body(req, resp, upload_data)
+                if current_offset is None:
+                    return
+
+        except LockTimeout:
+            resp.status_code = api.status_codes.HTTP_423
+            return
+        finally:
+            PATCHES_IN_FLIGHT.dec()
 
         resp.headers[headers.UPLOAD_OFFSET] = str(current_offset)
         resp.status_code = api.status_codes.HTTP_204
 
 
-def _set_common_headers(resp):
-    resp.headers[headers.CACHE_CONTROL] = 'no-store'
-    resp.headers[headers.TUS_RESUMABLE] = CURRENT_TUS_VERSION
+async def _write_body(req, resp, upload_data):
+    """
+    Write the request body to the upload at its current offset.
+    The body is written as it arrives, so an interrupted request keeps the bytes already received.
+    With Upload-Checksum the offset only moves once the whole body is verified,
+    with a durability other than 'none' once the body is durable.
+    Returns the new offset, or None after setting the error status.
+    The caller must hold the lock of the upload.
+    """
+    current_offset = upload_data.upload_offset
+    upload_length = None if upload_data.upload_length is None else int(upload_data.upload_length)
+
+    checksum = None
+    checksum_header = req.headers.get(headers.UPLOAD_CHECKSUM)
+    if checksum_header is not None:
+        checksum = parse_checksum(checksum_header)
+        if checksum is None:
+            resp.status_code = api.status_codes.HTTP_400
+            return None
+
+    digest = None if running_digests is None else running_digests.get(upload_data.id, current_offset)
+    hashers = [] if digest is None else [digest]
+    if checksum is not None:
+        chunk_hasher = CHECKSUM_ALGORITHMS[checksum[0]]()
+        # the running digest must not see a chunk that fails verification.
+        hashers = [chunk_hasher] + [hasher.copy() for hasher in hashers]
+
+    write_offset = current_offset
+    error_status = None
+    interrupted = False
+    timer = PhaseTimer(PATCH_PHASE_SECONDS)
+    writer = shaper.writer(upload_data.id, _client_key(req, upload_data))
+    try:
+        try:
+            async for patch_data in _read_body(req, config.PATCH_BUFFER_SIZE):
+                timer.mark('read')
+                RECEIVED_BYTES.inc(len(patch_data))
+                # the next piece is not read before this one is let through.
+                await writer.throttle(len(patch_data))
+                timer.mark('throttle')
+                if upload_length is not None and write_offset + len(patch_data) > upload_length:
+                    error_status = api.status_codes.HTTP_400
+                    break
+
+                # terminated while receiving.
+                if upload_deleter.is_pending(upload_data.id):
+                    resp.status_code = api.status_codes.HTTP_404
+                    return None
+
+                write_offset = await file_io.run(_write_piece, upload_data.id, write_offset, patch_data, hashers)
+                timer.mark('write')
+                if checksum is None and config.DURABILITY == 'none':
+                    current_offset = await _commit_offset(resp, upload_data, current_offset, write_offset, digest)
+                    timer.mark('commit')
+                    if current_offset is None:
+                        return None
+
+            timer.mark('read')
+        except ClientDisconnect:
+            interrupted = True
+
+        # a chunk with checksum is kept only when it was received whole and verified.
+        if checksum is not None:
+            if error_status is None and not interrupted and chunk_hasher.digest() != checksum[1]:
+                error_status = HTTP_CHECKSUM_MISMATCH
+            if error_status is not None or interrupted:
+                # dropped from the data too, as the offset is recovered from its size after a restart.
+                if write_offset != current_offset:
+                    await file_io.run(upload_storage.truncate, upload_data.id, current_offset)
+                if error_status is not None:
+                    resp.status_code = error_status
+                return None
+            digest = hashers[1] if digest is not None else None
+
+        # the bytes received before an error are kept, once they are durable.
+        if write_offset != current_offset:
+            await _sync(upload_data.id, write_offset - current_offset)
+            timer.mark('sync')
+            current_offset = await _commit_offset(resp, upload_data, current_offset, write_offset, digest)
+            timer.mark('commit')
+            if current_offset is None:
+                return None
+
+        if error_status is not None:
+            resp.status_code = error_status
+            return None
+        if interrupted:
+            return None
+
+    finally:
+        writer.close()
+        timer.observe()
+
+    if digest is not None and current_offset == upload_length:
+        running_digests.pop(upload_data.id)
+        await _write_db(db.set_upload_digest, upload_data.id, digest.hexdigest())
+        if config.DEDUP:
+            await file_io.run(upload_storage.deduplicate, upload_data.id, digest.hexdigest())
+
+    # finished uploads do not expire, unfinished ones get a new period.
+    if current_offset == upload_length:
+        if upload_data.upload_expires is not None:
+            await _write_db(db.set_upload_expires, upload_data.id, None)
+    else:
+        upload_expires = _expires_from_now()
+        if upload_expires is not None:
+            await _write_db(db.set_upload_expires, upload_data.id, upload_expires)
+            resp.headers[headers.UPLOAD_EXPIRES] = formatdate(upload_expires, usegmt=True)
+
+    return current_offset
+
+
+def _client_key(req, upload_data):
+    """
+    The client the upload is shaped by, its address or the value of config.SHAPING_CLIENT_KEY in its metadata.
+    """
+    if config.SHAPING_CLIENT_KEY:
+        value = (upload_data.upload_metadata or {}).get(config.SHAPING_CLIENT_KEY)
+        if value is not None:
+            return value
+    return req._starlette.client.host
+
+
+async def _sync(file_id, written):
+    """
+    Make the data written to the upload durable as config.DURABILITY asks:
+    'none' leaves it to the page cache, 'chunk' syncs the upload, 'group' syncs it in a batch with other uploads.
+    """
+    if config.DURABILITY == 'chunk':
+        await file_io.run(upload_storage.sync, [file_id])
+    elif config.DURABILITY == 'group':
+        await group_committer.sync(file_id, written)
+
 
+def _write_piece(file_id, offset, data, hashers):
+    """
+    Write a piece of the body and feed it to the hashers, in the file I/O executor.
+    """
+    offset = upload_storage.write(file_id, offset, data)
+    for hasher in hashers:
+        hasher.update(data)
+    return offset
 
-def to_metadata_header(metadata):
-    def encode_to_b64(decoded):
-        return base64.standard_b64encode(decoded.encode()).decode()
 
-    return ','.join([f'{k} {encode_to_b64(v)}' for k, v in metadata.items()])
+async def _commit_offset(resp, upload_data, current_offset, new_offset, digest):
+    """
+    Move the stored offset of the upload, and the running digest with it.
+    Returns the new offset, or None after setting 409 when another process has moved the offset meanwhile.
+    """
+    if not await _write_db(db.set_upload_offset, upload_data.id, new_offset, expected=current_offset):
+        resp.status_code = api.status_codes.HTTP_409
+        return None
 
+    if digest is not None:
+        running_digests.put(upload_data.id, new_offset, digest)
+    return new_offset
 
-def to_metadata_dict(metadata_header):
-    def decode_from_b64(encoded):
-        return base64.standard_b64decode(encoded.encode()).decode()
 
-    def decoded_kv(encoded_kv):
-        decoded = encoded_kv.split(' ')
-        return (decoded[0], decode_from_b64(decoded[1]))
+async def _read_body(req, buffer_size):
+    """
+    Read the request body in pieces of at most buffer_size bytes.
+    Small messages are merged and large messages are split,
+    so at most buffer_size bytes of body are kept in memory.
+    """
+    buffer = bytearray()
+    async for chunk in req._starlette.stream():
+        view = memoryview(chunk)
+        while len(buffer) + len(view) >= buffer_size:
+            taken = buffer_size - len(buffer)
+            buffer += view[:taken]
+            view = view[taken:]
+            yield bytes(buffer)
+            buffer.clear()
 
-    return dict(
-        [decoded_kv(kv) for kv in metadata_header.split(',') if len(kv.split(' ')) == 2]
-    )
+        buffer += view
+
+    if buffer:
+        yield bytes(buffer)
+
+
+async def _send_files(segments, start, end):
+    """
+    Send bytes [start, end) of the uploads concatenated in order, in pieces of DOWNLOAD_CHUNK_SIZE.
+    segments is a list of (upload id, size).
+    """
+    segment_start = 0
+    for file_id, size in segments:
+        segment_end = segment_start + size
+        if segment_end > start and segment_start < end:
+            async for data in _send_file(file_id, max(start - segment_start, 0), min(end, segment_end) - segment_start):
+                yield data
+
+        segment_start = segment_end
+
+
+async def _send_file(file_id, start, end):
+    """
+    Send bytes [start, end) of the upload in pieces of DOWNLOAD_CHUNK_SIZE.
+    """
+    offset = start
+    while offset < end:
+        data = await file_io.run(upload_storage.read, file_id, offset, min(end - offset, config.DOWNLOAD_CHUNK_SIZE))
+        if not data:
+            break
+
+        offset += len(data)
+        SENT_BYTES.inc(len(data))
+        yield data
+
+
+def _parse_range(range_header, size):
+    """
+    Parse a single byte range of Range header to [start, end).
+    Returns None when the header should be ignored, False when the range is not satisfiable.
+    """
+    matched = RANGE_PATTERN.fullmatch(range_header)
+    if matched is None or not (matched[1] or matched[2]):
+        return None
+
+    first, last = matched[1], matched[2]
+
+    # no range of an empty upload is satisfiable.
+    if size == 0:
+        return False
+
+    if not first:
+        # suffix range, the last N bytes.
+        length = int(last)
+        if length == 0:
+            return False
+        return (max(size - length, 0), size)
+
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+
+    end = size if not last else min(int(last) + 1, size)
+    return (start, end)
+
+
+_concatenate_in_background = api.background.task(upload_storage.concatenate)
+
+
+async def _get_upload(file_id):
+    """
+    Returns upload data of the id in the URL, or None if there is no such upload, it has expired or was terminated.
+    """
+    try:
+        id = UUID(file_id)
+    except ValueError:
+        return None
+
+    if upload_deleter.is_pending(id):
+        return None
+
+    upload_data = await _find_upload(id)
+
+    if upload_data is not None and upload_data.upload_expires is not None \
+            and upload_data.upload_expires <= time.time():
+        return None
+
+    return upload_data
+
+
+async def _find_upload(id):
+    """
+    db.get_by_id, reading the sidecar of an upload to recover in the file I/O executor.
+    """
+    upload_data = db.get_by_id(id, recover=False)
+    if upload_data is None and db.recovering:
+        upload_data = await file_io.run(db.get_by_id, id)
+    return upload_data
+
+
+async def _write_db(function, *args, **kwargs):
+    """
+    Call function, which writes the database, in the file I/O executor when writes block.
+    """
+    if not db.blocking:
+        return function(*args, **kwargs)
+    return await file_io.run(function, *args, **kwargs)
+
+
+def _parse_batch_upload(upload):
+    """
+    Arguments of add_uploads for an upload of the batch creation, or None when it is invalid.
+    Final uploads are not created in batches.
+    """
+    if not isinstance(upload, dict):
+        return None
+
+    upload_length = upload.get('length')
+    defer_length = upload.get('defer_length', False)
+    metadata = upload.get('metadata')
+    upload_concat = upload.get('concat')
+
+    if upload_length is None:
+        if defer_length is not True:
+            return None
+    elif type(upload_length) is not int or upload_length < 0 or defer_length:
+        return None
+
+    if metadata is not None:
+        if not isinstance(metadata, str):
+            return None
+        metadata = to_metadata_dict(metadata)
+
+    if upload_concat not in (None, 'partial'):
+        return None
+
+    return {
+        'upload_length': upload_length,
+        'upload_defer_length': '1' if upload_length is None else None,
+        'metadata': metadata,
+        'upload_concat': upload_concat,
+    }
+
+
+def _expires_from_now():
+    return time.time() + config.UPLOAD_EXPIRATION if config.UPLOAD_EXPIRATION > 0 else None
+
+
+def _parse_concat_ids(upload_concat):
+    """
+    Parse upload ids from the URLs in 'final;<url> <url> ...' Upload-Concat header.
+    Returns None if any URL is not an upload URL.
+    """
+    ids = []
+    for url in upload_concat[len('final;'):].split():
+        matched = CONCAT_URL_PATTERN.search(url)
+        if matched is None:
+            return None
+        try:
+            ids.append(UUID(matched[1]))
+        except ValueError:
+            return None
+
+    return ids
+
+
+def _is_partial(upload_data):
+    return upload_data is not None and upload_data.upload_concat == 'partial'
+
+
+def _is_finished(upload_data):
+    return upload_data.upload_length is not None and upload_data.upload_offset == int(upload_data.upload_length)
+
+
+async def _get_parts(upload_data):
+    """
+    Returns partial uploads of a virtual final upload in order, or None if any of them is gone.
+    """
+    parts = [await _find_upload(id) for id in upload_data.upload_parts]
+    return None if None in parts else parts
+
+
+async def _set_virtual_final_headers(resp, upload_data):
+    """
+    Set HEAD headers of a virtual final upload from the state of its partial uploads.
+    Upload-Offset is only sent once every partial upload is finished.
+    """
+    parts = await _get_parts(upload_data)
+    if parts is None:
+        resp.status_code = api.status_codes.HTTP_410
+        return
+
+    if upload_data.upload_metadata_header is not None:
+        resp.headers[headers.UPLOAD_METADATA] = upload_data.upload_metadata_header
+    resp.headers[headers.UPLOAD_CONCAT] = upload_data.upload_concat
+
+    lengths = [part.upload_length for part in parts]
+    if None not in lengths:
+        upload_length = sum(int(length) for length in lengths)
+        resp.headers[headers.UPLOAD_LENGTH] = str(upload_length)
+        if all(_is_finished(part) for part in parts):
+            resp.headers[headers.UPLOAD_OFFSET] = str(upload_length)
+
+
+def _set_common_headers(resp):
+    # tus responses have no body, responder would send a JSON null which 204 responses must not carry.
+    resp.content = b''
+    resp.headers[headers.CACHE_CONTROL] = 'no-store'
+    resp.headers[headers.TUS_RESUMABLE] = CURRENT_TUS_VERSION
 
 
 if __name__ == '__main__':
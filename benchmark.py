@@ -0,0 +1,602 @@
+"""
+Benchmark of the tus server.
+Drives the app in-process through ASGI, or over a local socket against a server subprocess,
+and writes throughput, latency percentiles and peak RSS per scenario to a JSON file.
+
+    python benchmark.py --transport socket --concurrency 32 --output results.json
+    python benchmark.py --baseline results.json --max-regression 0.1
+    python benchmark.py --scenarios patch_small,patch_large --durability none,chunk,group
+    python benchmark.py --transport socket --scenarios mixed --shaping-rate 104857600
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+PATCH_HEADERS = {
+    'Content-Type': 'application/offset+octet-stream',
+    'Tus-Resumable': '1.0.0'
+}
+
+
+class InProcessClient:
+    """
+    Calls the ASGI app directly, without sockets or HTTP parsing.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method, path, headers=None, body=b''):
+        scope = {
+            'type': 'http',
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'root_path': '',
+            'query_string': b'',
+            'headers': [(b'host', b'testserver')] + [
+                (k.lower().encode(), v.encode()) for k, v in _with_length(headers, body).items()
+            ],
+            'client': ('127.0.0.1', 50000),
+            'server': ('testserver', 80),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        response = {'status': None, 'headers': {}, 'body': bytearray()}
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = {k.decode().lower(): v.decode() for k, v in message['headers']}
+            elif message['type'] == 'http.response.body':
+                response['body'] += message.get('body', b'')
+
+        await self.app(scope)(receive, send)
+        return response['status'], response['headers'], bytes(response['body'])
+
+    async def close(self):
+        pass
+
+
+class SocketClient:
+    """
+    HTTP/1.1 over keep-alive connections, one per concurrent worker.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._idle = []
+
+    async def request(self, method, path, headers=None, body=b''):
+        if self._idle:
+            reader, writer = self._idle.pop()
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}']
+        lines += [f'{k}: {v}' for k, v in _with_length(headers, body).items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode().partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if method == 'HEAD' or status in (204, 304):
+            response_body = b''
+        elif response_headers.get('transfer-encoding') == 'chunked':
+            response_body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                response_body += chunk[:-2]
+        else:
+            response_body = await reader.readexactly(int(response_headers.get('content-length', 0)))
+
+        if response_headers.get('connection') == 'close':
+            writer.close()
+        else:
+            self._idle.append((reader, writer))
+        return status, response_headers, bytes(response_body)
+
+    async def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+
+def _with_length(headers, body):
+    headers = dict(headers or {})
+    headers.setdefault('Content-Length', str(len(body)))
+    return headers
+
+
+async def create_upload(client, length, upload_concat=None):
+    headers = {'Upload-Length': str(length), 'Tus-Resumable': '1.0.0'}
+    if upload_concat is not None:
+        headers['Upload-Concat'] = upload_concat
+    status, response_headers, _ = await client.request('POST', '/files', headers)
+    _expect(status, 201)
+    return response_headers['location']
+
+
+async def patch_upload(client, location, data, chunk_size):
+    for offset in range(0, len(data), chunk_size):
+        chunk = data[offset:offset + chunk_size]
+        status, _, _ = await client.request('PATCH', location, {**PATCH_HEADERS, 'Upload-Offset': str(offset)}, chunk)
+        _expect(status, 204)
+
+
+def _expect(status, expected):
+    if status != expected:
+        raise RuntimeError(f'expected status {expected}, got {status}')
+
+
+class Scenario:
+    """
+    A benchmarked operation.
+    setup prepares shared state once, run performs the i-th operation and returns the bytes it moved.
+    """
+    name = None
+
+    def __init__(self, options):
+        self.options = options
+
+    async def setup(self, client):
+        pass
+
+    async def run(self, client, i):
+        raise NotImplementedError
+
+    async def teardown(self, client):
+        pass
+
+
+class Creation(Scenario):
+    name = 'creation'
+
+    async def run(self, client, i):
+        await create_upload(client, 1024)
+        return 0
+
+
+class BatchCreation(Scenario):
+    """
+    Uploads created by batches of --batch-size.
+    """
+    name = 'batch_creation'
+
+    async def run(self, client, i):
+        body = json.dumps({'uploads': [{'length': 1024}] * self.options.batch_size}).encode()
+        headers = {'Content-Type': 'application/json', 'Tus-Resumable': '1.0.0'}
+        status, _, _ = await client.request('POST', '/files/batch', headers, body)
+        _expect(status, 201)
+        return 0
+
+
+class CreationWithUpload(Scenario):
+    """
+    Small files sent in the creation request.
+    """
+    name = 'creation_with_upload'
+
+    async def run(self, client, i):
+        data = os.urandom(self.options.small_chunk * 16)
+        headers = {**PATCH_HEADERS, 'Upload-Length': str(len(data))}
+        status, _, _ = await client.request('POST', '/files', headers, data)
+        _expect(status, 201)
+        return len(data)
+
+
+class SmallPatch(Scenario):
+    """
+    An upload sent in many small PATCH requests, as clients on poor networks do.
+    """
+    name = 'patch_small'
+
+    async def run(self, client, i):
+        data = os.urandom(self.options.small_chunk * 16)
+        location = await create_upload(client, len(data))
+        await patch_upload(client, location, data, self.options.small_chunk)
+        return len(data)
+
+
+class LargePatch(Scenario):
+    name = 'patch_large'
+
+    async def run(self, client, i):
+        data = os.urandom(self.options.large_chunk)
+        location = await create_upload(client, len(data))
+        await patch_upload(client, location, data, len(data))
+        return len(data)
+
+
+class HeadPolling(Scenario):
+    name = 'head'
+
+    async def setup(self, client):
+        self.location = await create_upload(client, 1024)
+
+    async def run(self, client, i):
+        status, _, _ = await client.request('HEAD', self.location, {'Tus-Resumable': '1.0.0'})
+        _expect(status, 200)
+        return 0
+
+
+class Concatenation(Scenario):
+    name = 'concatenation'
+
+    async def setup(self, client):
+        self.partials = []
+        for _ in range(4):
+            data = os.urandom(self.options.small_chunk * 16)
+            location = await create_upload(client, len(data), upload_concat='partial')
+            await patch_upload(client, location, data, len(data))
+            self.partials.append(location)
+
+    async def run(self, client, i):
+        headers = {'Upload-Concat': 'final;' + ' '.join(self.partials), 'Tus-Resumable': '1.0.0'}
+        status, _, _ = await client.request('POST', '/files', headers)
+        _expect(status, 201)
+        return 0
+
+
+class Download(Scenario):
+    name = 'download'
+
+    async def setup(self, client):
+        self.data = os.urandom(self.options.large_chunk)
+        self.location = await create_upload(client, len(self.data))
+        await patch_upload(client, self.location, self.data, len(self.data))
+
+    async def run(self, client, i):
+        status, _, body = await client.request('GET', self.location)
+        _expect(status, 200)
+        return len(body)
+
+
+class MixedLoad(Scenario):
+    """
+    Small uploads sent while --background-writers clients send --large-chunk uploads without pause.
+    Latencies are of the small uploads, to see how much the large ones hold them up.
+    """
+    name = 'mixed'
+
+    async def setup(self, client):
+        self.running = True
+        self.background = [asyncio.ensure_future(self._send_large(client))
+                           for _ in range(self.options.background_writers)]
+
+    async def _send_large(self, client):
+        data = os.urandom(self.options.large_chunk)
+        while self.running:
+            location = await create_upload(client, len(data))
+            await patch_upload(client, location, data, len(data))
+
+    async def run(self, client, i):
+        data = os.urandom(self.options.small_chunk)
+        location = await create_upload(client, len(data))
+        await patch_upload(client, location, data, len(data))
+        return len(data)
+
+    async def teardown(self, client):
+        self.running = False
+        await asyncio.gather(*self.background)
+
+
+SCENARIOS = {scenario.name: scenario for scenario in [
+    Creation, BatchCreation, CreationWithUpload, SmallPatch, LargePatch, HeadPolling, Concatenation, Download,
+    MixedLoad
+]}
+
+
+async def run_scenario(client, scenario, requests, concurrency):
+    """
+    Run requests operations of the scenario on concurrency workers.
+    """
+    await scenario.setup(client)
+
+    latencies = []
+    transferred = 0
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal transferred, errors
+        for i in remaining:
+            started = time.perf_counter()
+            try:
+                transferred += await scenario.run(client, i)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        seconds = time.perf_counter() - started
+    finally:
+        await scenario.teardown(client)
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'seconds': seconds,
+        'throughput_ops': requests / seconds,
+        'throughput_mib': transferred / seconds / 1024 ** 2,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+async def run_benchmark(client, options):
+    results = {}
+    for name in options.scenarios:
+        results[name] = await run_scenario(client, SCENARIOS[name](options), options.requests, options.concurrency)
+    await client.close()
+    return results
+
+
+def benchmark_in_process(options, durability):
+    import api
+
+    previous, api.config.DURABILITY = api.config.DURABILITY, durability
+    try:
+        results = asyncio.run(run_benchmark(InProcessClient(api.api), options))
+    finally:
+        api.config.DURABILITY = previous
+    # ru_maxrss is in KiB on Linux.
+    return results, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def benchmark_socket(options, durability):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    if options.workers > 1:
+        # workers of server.py share the uploads through a database and lock files.
+        state = tempfile.mkdtemp(prefix='tus-benchmark-state-')
+        command = [sys.executable, 'server.py']
+        env = {
+            **os.environ,
+            'TUS_SERVER_PORT': str(port),
+            'TUS_SERVER_WORKERS': str(options.workers),
+            'TUS_DATABASE_PATH': os.path.join(state, 'tus.sqlite3'),
+            'TUS_LOCK_MANAGER': 'file',
+            'TUS_LOCK_DIRECTORY': os.path.join(state, 'locks'),
+        }
+    else:
+        command = [sys.executable, '-c',
+                   f'import uvicorn, api; uvicorn.run(api.api, host="127.0.0.1", port={port}, log_level="warning")']
+        env = dict(os.environ)
+    env['TUS_DURABILITY'] = durability
+
+    server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    try:
+        _wait_for_port(port, server)
+        results = asyncio.run(run_benchmark(SocketClient('127.0.0.1', port), options))
+        # with several workers, the sum over the processes.
+        return results, sum(_peak_rss(pid) for pid in [server.pid] + _children(server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def _wait_for_port(port, server, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('server exited at startup')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('server did not start listening')
+
+
+def _children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as children:
+        return [int(child) for child in children.read().split()]
+
+
+def _peak_rss(pid):
+    """
+    Peak resident set size of a process in KiB.
+    """
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return 0
+
+
+def benchmark_index(uploads):
+    """
+    Memory per upload and lookup time of the in-memory database backends holding uploads uploads.
+    Ids are made before measuring, so they are not counted.
+    """
+    from database import create_backend, UploadData
+
+    ids = [uuid.uuid4() for _ in range(uploads)]
+    lookups = ids[::max(len(ids) // 100000, 1)]
+    results = {}
+    for kind in ['memory', 'compact']:
+        gc.collect()
+        tracemalloc.start()
+        backend = create_backend(kind)
+        for i, id in enumerate(ids):
+            upload_data = UploadData(upload_length=1024 * 1024, metadata={'filename': f'file-{i}.bin'},
+                                     upload_expires=time.time() + 86400)
+            upload_data.id = id
+            backend.insert(upload_data)
+        gc.collect()
+        allocated = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        started = time.perf_counter()
+        for id in lookups:
+            backend.get(id)
+        lookup_seconds = (time.perf_counter() - started) / len(lookups)
+
+        results[kind] = {
+            'uploads': uploads,
+            'bytes_per_upload': allocated / uploads,
+            'lookup_us': lookup_seconds * 1e6,
+        }
+        del backend
+
+    return results
+
+
+def compare(results, baseline, max_regression):
+    """
+    Regressions of results against a baseline, as messages.
+    A scenario regresses when any of its requests failed, or when its throughput drops or its p99 latency grows
+    by more than max_regression.
+    """
+    regressions = []
+    for name, result in results['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        # failed requests are not measured, so they can make a scenario look faster.
+        if result.get('errors'):
+            previous_errors = 0 if previous is None else previous.get('errors', 0)
+            regressions.append(f'{name}: {result["errors"]} errors, {previous_errors} in the baseline')
+        if previous is None:
+            continue
+        if result['throughput_ops'] < previous['throughput_ops'] * (1 - max_regression):
+            regressions.append(
+                f'{name}: throughput {previous["throughput_ops"]:.1f} -> {result["throughput_ops"]:.1f} ops/s'
+            )
+        if result['p99_ms'] > previous['p99_ms'] * (1 + max_regression):
+            regressions.append(f'{name}: p99 {previous["p99_ms"]:.2f} -> {result["p99_ms"]:.2f} ms')
+    for kind, result in results.get('index', {}).items():
+        previous = baseline.get('index', {}).get(kind)
+        if previous is not None and result['bytes_per_upload'] > previous['bytes_per_upload'] * (1 + max_regression):
+            regressions.append(
+                f'{kind} index: {previous["bytes_per_upload"]:.0f} -> {result["bytes_per_upload"]:.0f} bytes per upload'
+            )
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transport', choices=['inprocess', 'socket'], default='inprocess')
+    parser.add_argument('--scenarios', type=lambda value: value.split(',') if value else [], default=list(SCENARIOS),
+                        help='comma separated, of ' + ','.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=1, help='server.py worker processes of the socket transport')
+    parser.add_argument('--requests', type=int, default=200, help='operations per scenario')
+    parser.add_argument('--batch-size', type=int, default=100, help='uploads per batch creation')
+    parser.add_argument('--small-chunk', type=int, default=4 * 1024)
+    parser.add_argument('--large-chunk', type=int, default=8 * 1024 ** 2)
+    parser.add_argument('--background-writers', type=int, default=4, help='clients sending large uploads in mixed')
+    parser.add_argument('--shaping-rate', type=int,
+                        help='total bytes per second upload bodies are received at, TUS_SHAPING_RATE of the server')
+    parser.add_argument('--durability', type=lambda value: value.split(','), default=['none'],
+                        help='comma separated durability modes to run the scenarios with, of none,chunk,group')
+    parser.add_argument('--index-uploads', type=int, default=0,
+                        help='also measure memory per upload of the in-memory database backends with this many uploads')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--baseline', help='results to compare with, exits with 1 on regression')
+    parser.add_argument('--max-regression', type=float, default=0.1)
+    options = parser.parse_args(argv)
+
+    unknown = set(options.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+    unknown = set(options.durability) - {'none', 'chunk', 'group'}
+    if unknown:
+        parser.error(f'unknown durability modes: {", ".join(sorted(unknown))}')
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+
+    # uploads of the benchmark are kept apart, the server subprocess inherits the environment.
+    os.environ.setdefault('TUS_STORAGE_ROOTS', tempfile.mkdtemp(prefix='tus-benchmark-'))
+    if options.shaping_rate is not None:
+        os.environ['TUS_SHAPING_RATE'] = str(options.shaping_rate)
+
+    benchmark = benchmark_socket if options.transport == 'socket' else benchmark_in_process
+    scenarios = {}
+    peak_rss = 0
+    for durability in options.durability:
+        results, rss = benchmark(options, durability)
+        peak_rss = max(peak_rss, rss)
+        # with several modes, scenarios are told apart by their mode, as in patch_small[group].
+        if len(options.durability) > 1:
+            results = {f'{name}[{durability}]': result for name, result in results.items()}
+        scenarios.update(results)
+
+    results = {
+        'transport': options.transport,
+        'concurrency': options.concurrency,
+        'workers': options.workers,
+        'durability': options.durability,
+        'shaping_rate': options.shaping_rate,
+        'requests': options.requests,
+        'python': platform.python_version(),
+        'timestamp': time.time(),
+        'peak_rss_kib': peak_rss,
+        'scenarios': scenarios,
+    }
+    if options.index_uploads:
+        results['index'] = benchmark_index(options.index_uploads)
+    with open(options.output, 'w') as output:
+        json.dump(results, output, indent=2)
+
+    for name, result in scenarios.items():
+        print(f'{name:<24} {result["throughput_ops"]:>10.1f} ops/s {result["throughput_mib"]:>8.1f} MiB/s '
+              f'p50 {result["p50_ms"]:>8.2f} ms p99 {result["p99_ms"]:>8.2f} ms errors {result["errors"]}')
+    print(f'peak rss {peak_rss} KiB')
+    for kind, result in results.get('index', {}).items():
+        print(f'{kind:<16} index {result["bytes_per_upload"]:>8.1f} bytes per upload, '
+              f'lookup {result["lookup_us"]:.2f} us')
+
+    if options.baseline:
+        with open(options.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), options.max_regression)
+        for regression in regressions:
+            print('regression', regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import base64
+import binascii
+import hashlib
+import zlib
+
+
+class Crc32:
+    """
+    hashlib style wrapper of zlib.crc32.
+    """
+    name = 'crc32'
+
+    def __init__(self, value=0):
+        self.value = value
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def digest(self):
+        return self.value.to_bytes(4, 'big')
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+    def copy(self):
+        return Crc32(self.value)
+
+
+ALGORITHMS = {
+    'sha1': hashlib.sha1,
+    'md5': hashlib.md5,
+    'crc32': Crc32,
+}
+
+# whole-file digests two contents are not found to share by chance or by a crafted upload, as dedup needs.
+COLLISION_RESISTANT = {'sha256', 'sha384', 'sha512', 'sha3_256', 'sha3_384', 'sha3_512', 'blake2b', 'blake2s'}
+
+# names of the Digest response header (RFC 3230) of whole-file digests.
+DIGEST_NAMES = {
+    'sha1': 'SHA',
+    'md5': 'MD5',
+    'sha256': 'SHA-256',
+    'sha512': 'SHA-512',
+}
+
+
+def new_hasher(algorithm):
+    if algorithm in ALGORITHMS:
+        return ALGORITHMS[algorithm]()
+    return hashlib.new(algorithm)
+
+
+def parse_checksum(checksum_header):
+    """
+    Parse '<algorithm> <base64 digest>' of Upload-Checksum header.
+    Returns (algorithm, digest), or None if the header is invalid or the algorithm is not supported.
+    """
+    algorithm, _, encoded = checksum_header.strip().partition(' ')
+    if algorithm not in ALGORITHMS or not encoded:
+        return None
+
+    try:
+        return algorithm, base64.b64decode(encoded, validate=True)
+    except binascii.Error:
+        return None
+
+
+def digest_header(algorithm, hexdigest):
+    """
+    Value of Digest response header of a whole-file digest, or None if the algorithm has no name in it.
+    """
+    name = DIGEST_NAMES.get(algorithm)
+    if name is None:
+        return None
+    return f'{name}={base64.b64encode(bytes.fromhex(hexdigest)).decode()}'
+
+
+class RunningDigests:
+    """
+    Whole-file digests of uploads in progress in this process, updated as data is written.
+    A digest is only continued from the offset it was computed up to;
+    when an upload moves on elsewhere (another worker, a restart) its digest is dropped.
+    """
+
+    def __init__(self, algorithm):
+        self.algorithm = algorithm
+        self._digests = {}
+
+    def get(self, id, offset):
+        """
+        Returns a hasher for data from offset on, or None if the digest up to offset is not known.
+        """
+        if offset == 0:
+            return new_hasher(self.algorithm)
+
+        running = self._digests.get(id)
+        if running is None or running[0] != offset:
+            self._digests.pop(id, None)
+            return None
+
+        return running[1]
+
+    def put(self, id, offset, hasher):
+        self._digests[id] = (offset, hasher)
+
+    def pop(self, id):
+        return self._digests.pop(id, None)
@@ -0,0 +1,90 @@
+import errno
+import os
+
+COPY_STEP_SIZE = 16 * 1024 * 1024
+
+# errors meaning the kernel can not copy between these files, not that the copy failed.
+_UNSUPPORTED_ERRNOS = {errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.EOPNOTSUPP, errno.EBADF}
+
+
+def concatenate(sources, target, progress=None, step_size=COPY_STEP_SIZE):
+    """
+    Concatenate source files into target file.
+    Data is copied in the kernel where possible, progress is called with the number of bytes copied per step.
+    """
+    with open(target, 'wb') as output:
+        for source in sources:
+            with open(source, 'rb') as input:
+                size = os.fstat(input.fileno()).st_size
+                copy_file(input.fileno(), output.fileno(), size, progress, step_size)
+
+
+def copy_file(in_fd, out_fd, size, progress=None, step_size=COPY_STEP_SIZE):
+    """
+    Copy size bytes from the current position of in_fd to the current position of out_fd.
+    Tries copy_file_range, then sendfile, then falls back to read and write.
+    """
+    start = os.lseek(out_fd, 0, os.SEEK_CUR)
+    for copier in (_copy_file_range, _sendfile, _read_write):
+        try:
+            copied = copier(in_fd, out_fd, size, progress, step_size)
+        except OSError as e:
+            # fall back only when the copier was refused before it wrote anything.
+            if e.errno not in _UNSUPPORTED_ERRNOS or os.lseek(out_fd, 0, os.SEEK_CUR) != start:
+                raise
+            continue
+
+        if copied is not None:
+            return copied
+
+
+def _copy_loop(copy_step, size, progress, step_size):
+    copied = 0
+    while copied < size:
+        n = copy_step(min(step_size, size - copied))
+        if n == 0:
+            break
+
+        copied += n
+        if progress is not None:
+            progress(n)
+
+    return copied
+
+
+def _copy_file_range(in_fd, out_fd, size, progress, step_size):
+    if not hasattr(os, 'copy_file_range'):
+        return None
+
+    return _copy_loop(lambda count: os.copy_file_range(in_fd, out_fd, count), size, progress, step_size)
+
+
+def _sendfile(in_fd, out_fd, size, progress, step_size):
+    if not hasattr(os, 'sendfile'):
+        return None
+
+    # sendfile takes an explicit input offset, positions are kept in sync by hand.
+    in_offset = os.lseek(in_fd, 0, os.SEEK_CUR)
+
+    def step(count):
+        nonlocal in_offset
+        n = os.sendfile(out_fd, in_fd, in_offset, count)
+        in_offset += n
+        return n
+
+    copied = _copy_loop(step, size, progress, step_size)
+    os.lseek(in_fd, in_offset, os.SEEK_SET)
+    return copied
+
+
+def _read_write(in_fd, out_fd, size, progress, step_size):
+    buffer_size = min(step_size, 1024 * 1024)
+
+    def step(count):
+        data = os.read(in_fd, min(count, buffer_size))
+        view = memoryview(data)
+        while view:
+            view = view[os.write(out_fd, view):]
+        return len(data)
+
+    return _copy_loop(step, size, progress, step_size)
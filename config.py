@@ -0,0 +1,122 @@
+import os
+
+# SQLite database file upload data is kept in.
+DATABASE_PATH = os.environ.get('TUS_DATABASE_PATH')
+# Where upload data is kept: 'sqlite' (the DATABASE_PATH file), 'compact' (packed records in memory of the process)
+# or 'memory' (objects in memory of the process). 'sqlite' when DATABASE_PATH is set, 'memory' otherwise.
+# 'compact' takes a fraction of the memory per upload for millions of uploads, but lookups cost about three times
+# as much, so it is only used when asked for.
+DATABASE = os.environ.get('TUS_DATABASE', 'sqlite' if DATABASE_PATH else 'memory')
+
+# Whether uploads are recovered after a restart from sidecars kept next to their data.
+# On by default unless the database is 'sqlite', which outlives the process itself.
+RECOVERY = os.environ.get('TUS_RECOVERY', '0' if DATABASE == 'sqlite' else '1') == '1'
+# Number of threads reading sidecars when recovering at startup.
+RECOVERY_WORKERS = int(os.environ.get('TUS_RECOVERY_WORKERS', 8))
+
+# Maximum number of PATCH body bytes held in memory per request.
+# The body is written to the upload file whenever this many bytes are buffered.
+PATCH_BUFFER_SIZE = int(os.environ.get('TUS_PATCH_BUFFER_SIZE', 256 * 1024))
+
+# How blocking file operations are run: 'thread' (worker thread pool) or 'inline' (on the event loop).
+IO_EXECUTOR = os.environ.get('TUS_IO_EXECUTOR', 'thread')
+# Number of file operations allowed to run at once. Further operations wait in the queue.
+IO_MAX_CONCURRENCY = int(os.environ.get('TUS_IO_MAX_CONCURRENCY', 64))
+# Number of worker threads of the 'thread' executor.
+IO_MAX_WORKERS = int(os.environ.get('TUS_IO_MAX_WORKERS', 16))
+
+# Size of the pieces a download is read from disk and sent to the client in.
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('TUS_DOWNLOAD_CHUNK_SIZE', 256 * 1024))
+
+# Finals larger than this (in bytes) are answered at once and concatenated in the background.
+CONCAT_BACKGROUND_SIZE = int(os.environ.get('TUS_CONCAT_BACKGROUND_SIZE', 64 * 1024 * 1024))
+
+# How final uploads are built: 'virtual' serves them from the partial uploads,
+# 'copy' concatenates finished partial uploads into a new file.
+CONCAT_MODE = os.environ.get('TUS_CONCAT_MODE', 'virtual')
+
+# Per-upload locks serializing PATCH requests: 'memory' (this process) or 'file' (flock, shared by processes).
+LOCK_MANAGER = os.environ.get('TUS_LOCK_MANAGER', 'memory')
+# Directory of the lock files of the 'file' lock manager.
+LOCK_DIRECTORY = os.environ.get('TUS_LOCK_DIRECTORY', '/tmp/tus-locks')
+# Seconds a PATCH waits for the lock of its upload before answering 423.
+LOCK_TIMEOUT = float(os.environ.get('TUS_LOCK_TIMEOUT', 10))
+
+# When PATCH data is made durable before its offset is acknowledged: 'none' (left to the page cache),
+# 'chunk' (the upload is synced at the end of every PATCH) or 'group' (uploads are synced in batches).
+DURABILITY = os.environ.get('TUS_DURABILITY', 'none')
+# Seconds a group commit batch collects uploads before they are synced.
+GROUP_COMMIT_INTERVAL = float(os.environ.get('TUS_GROUP_COMMIT_INTERVAL', 0.005))
+# Bytes written to a group commit batch which make it synced at once.
+GROUP_COMMIT_BYTES = int(os.environ.get('TUS_GROUP_COMMIT_BYTES', 8 * 1024 * 1024))
+
+# Upload requests (POST and PATCH) handled at once, further ones are answered 503. 0 does not limit them.
+ADMISSION_MAX_REQUESTS = int(os.environ.get('TUS_ADMISSION_MAX_REQUESTS', 1024))
+# Body bytes announced by upload requests handled at once, further ones are answered 503.
+# A body without Content-Length counts as PATCH_BUFFER_SIZE. 0 does not limit them.
+ADMISSION_MAX_BYTES = int(os.environ.get('TUS_ADMISSION_MAX_BYTES', 1024 ** 3))
+# Upload requests a client address may have in flight, further ones are answered 429. 0 does not limit them.
+ADMISSION_MAX_CLIENT_REQUESTS = int(os.environ.get('TUS_ADMISSION_MAX_CLIENT_REQUESTS', 64))
+# Seconds rejected requests are asked to wait before they are retried, sent as Retry-After.
+ADMISSION_RETRY_AFTER = int(os.environ.get('TUS_ADMISSION_RETRY_AFTER', 1))
+
+# Bytes per second upload bodies are received at in total, per client and per upload. 0 does not limit them.
+# Uploads share the total rate fairly, those sending small pieces do not wait behind those sending large ones.
+SHAPING_RATE = int(os.environ.get('TUS_SHAPING_RATE', 0))
+SHAPING_CLIENT_RATE = int(os.environ.get('TUS_SHAPING_CLIENT_RATE', 0))
+SHAPING_UPLOAD_RATE = int(os.environ.get('TUS_SHAPING_UPLOAD_RATE', 0))
+# Bytes received at once before a rate applies.
+SHAPING_BURST = int(os.environ.get('TUS_SHAPING_BURST', 1024 * 1024))
+# Upload metadata key telling clients apart for the per-client rate, e.g. a tenant. Empty uses the client address.
+SHAPING_CLIENT_KEY = os.environ.get('TUS_SHAPING_CLIENT_KEY', '')
+
+# Number of uploads a batch creation request may create.
+BATCH_MAX_UPLOADS = int(os.environ.get('TUS_BATCH_MAX_UPLOADS', 1000))
+# Bytes of JSON body a batch creation request may send, larger ones are answered 413 before they are read whole.
+BATCH_MAX_BODY_BYTES = int(os.environ.get('TUS_BATCH_MAX_BODY_BYTES', 4 * 1024 * 1024))
+
+# Number of file descriptors of active uploads kept open between PATCH requests.
+FD_CACHE_SIZE = int(os.environ.get('TUS_FD_CACHE_SIZE', 256))
+# Seconds an unused cached file descriptor is kept open.
+FD_IDLE_TIMEOUT = float(os.environ.get('TUS_FD_IDLE_TIMEOUT', 30))
+
+# Where upload data is kept: 'local' (files on local filesystems) or 'object' (local object storage mock).
+STORAGE = os.environ.get('TUS_STORAGE', 'local')
+# Comma separated storage roots with optional weights, e.g. '/mnt/a:2,/mnt/b:1'.
+STORAGE_ROOTS = os.environ.get('TUS_STORAGE_ROOTS', '/tmp/tus-uploads')
+# How new uploads are spread over the roots: 'weight' or 'free-space'.
+STORAGE_PLACEMENT = os.environ.get('TUS_STORAGE_PLACEMENT', 'weight')
+# Number of directory levels named after leading characters of the upload id.
+STORAGE_SHARD_DEPTH = int(os.environ.get('TUS_STORAGE_SHARD_DEPTH', 2))
+
+# Algorithm of the whole-file digest kept while uploads are written. Empty disables it.
+UPLOAD_DIGEST = os.environ.get('TUS_UPLOAD_DIGEST', 'sha256')
+
+# Whether finished uploads of the same content share one copy of it, found by their UPLOAD_DIGEST.
+# Only 'local' storage shares content, between uploads of the same root. Needs UPLOAD_DIGEST sha256 or stronger.
+DEDUP = os.environ.get('TUS_DEDUP', '0') == '1'
+
+# Seconds an unfinished upload is kept after its creation or its last PATCH. 0 keeps uploads forever.
+UPLOAD_EXPIRATION = int(os.environ.get('TUS_UPLOAD_EXPIRATION', 24 * 60 * 60))
+# Seconds between runs of the reaper deleting expired uploads.
+REAPER_INTERVAL = float(os.environ.get('TUS_REAPER_INTERVAL', 60))
+# Number of expired uploads the reaper deletes per batch.
+REAPER_BATCH_SIZE = int(os.environ.get('TUS_REAPER_BATCH_SIZE', 1000))
+
+# Number of terminated uploads removed together by the background deleter.
+DELETER_BATCH_SIZE = int(os.environ.get('TUS_DELETER_BATCH_SIZE', 100))
+# Bytes per second the background deleter may remove. 0 does not limit it.
+DELETER_MAX_BYTES_PER_SECOND = int(os.environ.get('TUS_DELETER_MAX_BYTES_PER_SECOND', 256 * 1024 * 1024))
+
+# Address and port server.py listens on.
+SERVER_HOST = os.environ.get('TUS_SERVER_HOST', '127.0.0.1')
+SERVER_PORT = int(os.environ.get('TUS_SERVER_PORT', 5000))
+# Number of worker processes of server.py. When not set, one per core if the workers can share state
+# (the sqlite database and the file lock manager), otherwise one.
+SERVER_WORKERS = int(os.environ.get('TUS_SERVER_WORKERS', 0)) \
+    or ((os.cpu_count() or 1) if DATABASE == 'sqlite' and LOCK_MANAGER == 'file' else 1)
+# Whether every worker listens on its own SO_REUSEPORT socket, so the kernel spreads connections over them.
+# Otherwise the workers accept from one shared socket.
+SERVER_REUSE_PORT = os.environ.get('TUS_SERVER_REUSE_PORT', '1') == '1'
+# Seconds workers get to finish in-flight requests at shutdown before they are killed.
+SERVER_SHUTDOWN_TIMEOUT = float(os.environ.get('TUS_SERVER_SHUTDOWN_TIMEOUT', 30))
@@ -1,4 +1,14 @@
-from uuid import uuid4
+import heapq
+import json
+import math
+import sqlite3
+import struct
+import threading
+import time
+from array import array
+from uuid import UUID, uuid4
+
+from metadata import to_metadata_dict, to_metadata_header
 
 
 class UploadData:
@@ -7,34 +17,712 @@ class UploadData:
         "upload_offset",
         "upload_length",
         "upload_defer_length",
-        "upload_metadata",
-        "upload_concat"
+        "upload_metadata_header",
+        "_upload_metadata",
+        "upload_concat",
+        "upload_parts",
+        "upload_digest",
+        "upload_expires"
     ]
 
-    def __init__(self, upload_length=None, upload_defer_length=None, metadata={}, upload_concat=None):
-        self.id = uuid4()
+    def __init__(self, upload_length=None, upload_defer_length=None, metadata=None, upload_concat=None,
+                 upload_parts=None, upload_expires=None, metadata_header=None, id=None):
+        self.id = uuid4() if id is None else id
         self.upload_offset = 0
         self.upload_length = upload_length
         self.upload_defer_length = upload_defer_length
-        self.upload_metadata = metadata
+        # metadata is kept in the form of Upload-Metadata header too, so HEAD responses do not encode it.
+        # Given only the header, the dict is decoded when it is first used.
+        if metadata_header is None and metadata is not None:
+            metadata_header = to_metadata_header(metadata)
+        self.upload_metadata_header = metadata_header
+        self._upload_metadata = metadata
         self.upload_concat = upload_concat
+        # ids of the partial uploads a virtual final upload is served from.
+        self.upload_parts = upload_parts
+        # whole-file digest, known once the upload is finished.
+        self.upload_digest = None
+        # unix time the unfinished upload expires at.
+        self.upload_expires = upload_expires
 
+    @property
+    def upload_metadata(self):
+        if self._upload_metadata is None and self.upload_metadata_header is not None:
+            self._upload_metadata = to_metadata_dict(self.upload_metadata_header)
+        return self._upload_metadata
 
-class Database:
+
+class MemoryBackend:
+    """
+    Keeps upload data in a dict of this process.
+    Expiration times are indexed by a heap, entries made stale by later changes are skipped when popped.
+    """
 
     def __init__(self):
         self.uploads = {}
+        self._expirations = []
+        self._lock = threading.Lock()
 
-    def add_uploads(self, upload_length=None, upload_defer_length=None, metadata={}, upload_concat=None):
-        upload_data = UploadData(upload_length, upload_defer_length, metadata, upload_concat)
-        self.uploads[upload_data.id] = upload_data
+    def insert(self, upload_data):
+        self.insert_many([upload_data])
 
-        return upload_data
+    def insert_many(self, uploads):
+        with self._lock:
+            for upload_data in uploads:
+                self.uploads[upload_data.id] = upload_data
+                if upload_data.upload_expires is not None:
+                    heapq.heappush(self._expirations, (upload_data.upload_expires, upload_data.id))
 
-    def get_by_id(self, id):
+    def get(self, id):
         return self.uploads.get(id)
 
     def set_upload_length(self, id, upload_length):
         data = self.uploads.get(id)
         data.upload_length = upload_length
         data.upload_defer_length = None
+
+    def set_upload_digest(self, id, upload_digest):
+        self.uploads.get(id).upload_digest = upload_digest
+
+    def set_upload_expires(self, id, upload_expires):
+        with self._lock:
+            data = self.uploads.get(id)
+            if data is None:
+                return
+            data.upload_expires = upload_expires
+            if upload_expires is not None:
+                heapq.heappush(self._expirations, (upload_expires, id))
+
+    def compare_and_set_offset(self, id, expected, upload_offset):
+        with self._lock:
+            data = self.uploads.get(id)
+            if data is None or data.upload_offset != expected:
+                return False
+
+            data.upload_offset = upload_offset
+            return True
+
+    def expired(self, now, limit):
+        ids = []
+        with self._lock:
+            while self._expirations and self._expirations[0][0] <= now and len(ids) < limit:
+                expires, id = heapq.heappop(self._expirations)
+                data = self.uploads.get(id)
+                if data is not None and data.upload_expires == expires and id not in ids:
+                    ids.append(id)
+
+            # still indexed until deleted.
+            for id in ids:
+                heapq.heappush(self._expirations, (self.uploads[id].upload_expires, id))
+
+        return ids
+
+    def delete(self, ids):
+        for id in ids:
+            self.uploads.pop(id, None)
+
+    def count(self):
+        return len(self.uploads)
+
+
+class CompactBackend:
+    """
+    Keeps upload data of this process in fixed-width records packed in one bytearray,
+    found through an open addressing hash table of record numbers keyed by the 16 bytes of the upload id.
+    Strings (metadata header, concat, parts, digest) are kept out of line,
+    and expiration times are indexed by a heap in two arrays.
+    With a short metadata header, an upload takes about a third of the memory it takes in MemoryBackend,
+    see benchmark.py --index-uploads.
+    """
+
+    # id, offset, length (-1 when deferred), expires (NaN when not expiring),
+    # references of metadata header, concat, parts and digest (0 when None), flags.
+    RECORD = struct.Struct('<16sQqdIIIIB')
+    OFFSET = struct.Struct('<Q')
+    OFFSET_POSITION = 16
+    EXPIRES = struct.Struct('<d')
+    EXPIRES_POSITION = 32
+    USED = 1
+    DEFER_LENGTH = 2
+    # markers of hash table slots without a record.
+    EMPTY = -1
+    DELETED = -2
+    MIN_SLOTS = 1024
+
+    def __init__(self):
+        self._records = bytearray()
+        self._free_records = array('q')
+        self._slots = array('q', [self.EMPTY]) * self.MIN_SLOTS
+        # slots taken by a record or a deletion marker.
+        self._taken_slots = 0
+        self._count = 0
+        # metadata headers, parts and digests are mostly unique, concat values are mostly 'partial'.
+        self._strings = _Strings()
+        self._shared_strings = _Strings(shared=True)
+        self._expirations = _ExpirationHeap()
+        self._lock = threading.Lock()
+
+    def _find(self, key):
+        """
+        Hash table slot and record number of the key.
+        Without a record of the key, the record number is None and the slot is where to insert it.
+        """
+        mask = len(self._slots) - 1
+        i = hash(key) & mask
+        free = None
+        size = self.RECORD.size
+        while True:
+            record = self._slots[i]
+            if record == self.EMPTY:
+                return (i if free is None else free), None
+            if record == self.DELETED:
+                if free is None:
+                    free = i
+            elif self._records[record * size:record * size + 16] == key:
+                return i, record
+            i = (i + 1) & mask
+
+    def _resize(self):
+        # deletion markers are dropped, and the table is kept at most half full.
+        slots = self.MIN_SLOTS
+        while slots < (self._count + 1) * 2:
+            slots *= 2
+
+        records = [record for record in self._slots if record >= 0]
+        self._slots = array('q', [self.EMPTY]) * slots
+        self._taken_slots = len(records)
+        size = self.RECORD.size
+        for record in records:
+            slot, _ = self._find(bytes(self._records[record * size:record * size + 16]))
+            self._slots[slot] = record
+
+    def insert(self, upload_data):
+        self.insert_many([upload_data])
+
+    def insert_many(self, uploads):
+        with self._lock:
+            for upload_data in uploads:
+                self._insert(upload_data)
+
+    def _insert(self, upload_data):
+        key = upload_data.id.bytes
+        slot, record = self._find(key)
+        if record is not None:
+            self._release(record)
+        else:
+            if self._free_records:
+                record = self._free_records.pop()
+            else:
+                record = len(self._records) // self.RECORD.size
+                self._records.extend(bytes(self.RECORD.size))
+            if self._slots[slot] == self.EMPTY:
+                self._taken_slots += 1
+            self._slots[slot] = record
+            self._count += 1
+
+        parts = None if upload_data.upload_parts is None else ' '.join(id.hex for id in upload_data.upload_parts)
+        expires = math.nan if upload_data.upload_expires is None else upload_data.upload_expires
+        flags = self.USED | (self.DEFER_LENGTH if upload_data.upload_defer_length is not None else 0)
+        upload_length = -1 if upload_data.upload_length is None else int(upload_data.upload_length)
+        strings = self._strings
+        self.RECORD.pack_into(
+            self._records, record * self.RECORD.size,
+            key, upload_data.upload_offset, upload_length, expires,
+            strings.add(upload_data.upload_metadata_header), self._shared_strings.add(upload_data.upload_concat),
+            strings.add(parts), strings.add(upload_data.upload_digest), flags
+        )
+        if upload_data.upload_expires is not None:
+            self._expirations.push(expires, record)
+
+        if self._taken_slots * 4 > len(self._slots) * 3:
+            self._resize()
+
+    def _release(self, record):
+        _, _, _, _, metadata, concat, parts, digest, _ = \
+            self.RECORD.unpack_from(self._records, record * self.RECORD.size)
+        for ref in (metadata, parts, digest):
+            self._strings.release(ref)
+        self._shared_strings.release(concat)
+
+    def get(self, id):
+        with self._lock:
+            _, record = self._find(id.bytes)
+            if record is None:
+                return None
+            _, upload_offset, upload_length, expires, metadata, concat, parts, digest, flags = \
+                self.RECORD.unpack_from(self._records, record * self.RECORD.size)
+            strings = self._strings
+            metadata_header, upload_concat = strings.get(metadata), self._shared_strings.get(concat)
+            parts, upload_digest = strings.get(parts), strings.get(digest)
+
+        upload_data = UploadData(
+            None if upload_length < 0 else upload_length,
+            1 if flags & self.DEFER_LENGTH else None,
+            None, upload_concat,
+            None if parts is None else [UUID(hex=part) for part in parts.split()],
+            None if math.isnan(expires) else expires,
+            metadata_header, id
+        )
+        upload_data.upload_offset = upload_offset
+        upload_data.upload_digest = upload_digest
+        return upload_data
+
+    def set_upload_length(self, id, upload_length):
+        with self._lock:
+            _, record = self._find(id.bytes)
+            if record is None:
+                return
+            values = list(self.RECORD.unpack_from(self._records, record * self.RECORD.size))
+            values[2] = int(upload_length)
+            values[8] &= ~self.DEFER_LENGTH
+            self.RECORD.pack_into(self._records, record * self.RECORD.size, *values)
+
+    def set_upload_digest(self, id, upload_digest):
+        with self._lock:
+            _, record = self._find(id.bytes)
+            if record is None:
+                return
+            values = list(self.RECORD.unpack_from(self._records, record * self.RECORD.size))
+            self._strings.release(values[7])
+            values[7] = self._strings.add(upload_digest)
+            self.RECORD.pack_into(self._records, record * self.RECORD.size, *values)
+
+    def set_upload_expires(self, id, upload_expires):
+        with self._lock:
+            _, record = self._find(id.bytes)
+            if record is None:
+                return
+            expires = math.nan if upload_expires is None else upload_expires
+            self.EXPIRES.pack_into(self._records, record * self.RECORD.size + self.EXPIRES_POSITION, expires)
+            if upload_expires is not None:
+                self._expirations.push(expires, record)
+
+    def compare_and_set_offset(self, id, expected, upload_offset):
+        with self._lock:
+            _, record = self._find(id.bytes)
+            if record is None:
+                return False
+            position = record * self.RECORD.size + self.OFFSET_POSITION
+            if self.OFFSET.unpack_from(self._records, position)[0] != expected:
+                return False
+
+            self.OFFSET.pack_into(self._records, position, upload_offset)
+            return True
+
+    def expired(self, now, limit):
+        ids = []
+        found = set()
+        valid = []
+        size = self.RECORD.size
+        with self._lock:
+            while self._expirations and self._expirations.peek()[0] <= now and len(ids) < limit:
+                expires, record = self._expirations.pop()
+                key = bytes(self._records[record * size:record * size + 16])
+                _, _, _, record_expires, _, _, _, _, flags = self.RECORD.unpack_from(self._records, record * size)
+                # entries of changed expiration times and of removed or reused records are stale.
+                if flags & self.USED and record_expires == expires and key not in found:
+                    found.add(key)
+                    ids.append(UUID(bytes=key))
+                    valid.append((expires, record))
+
+            # still indexed until deleted.
+            for expires, record in valid:
+                self._expirations.push(expires, record)
+
+            if len(self._expirations) > 2 * self._count + self.MIN_SLOTS:
+                self._rebuild_expirations()
+
+        return ids
+
+    def _rebuild_expirations(self):
+        # drop the stale entries piled up by changed expiration times.
+        size = self.RECORD.size
+        self._expirations = _ExpirationHeap()
+        for record in self._slots:
+            if record >= 0:
+                expires = self.EXPIRES.unpack_from(self._records, record * size + self.EXPIRES_POSITION)[0]
+                if not math.isnan(expires):
+                    self._expirations.push(expires, record)
+
+    def delete(self, ids):
+        with self._lock:
+            for id in ids:
+                slot, record = self._find(id.bytes)
+                if record is None:
+                    continue
+                self._release(record)
+                self._records[record * self.RECORD.size:(record + 1) * self.RECORD.size] = bytes(self.RECORD.size)
+                self._slots[slot] = self.DELETED
+                self._free_records.append(record)
+                self._count -= 1
+
+    def count(self):
+        return self._count
+
+
+class _Strings:
+    """
+    Strings referenced by number from records, reference 0 is None.
+    Shared strings are kept once however many records refer to them, which pays for values repeated a lot
+    (like Upload-Concat 'partial'), other strings are kept once per reference without a lookup table.
+    """
+
+    def __init__(self, shared=False):
+        self._values = [None]
+        self._free = array('q')
+        self._refs = {} if shared else None
+        self._counts = array('q', [0]) if shared else None
+
+    def add(self, value):
+        if value is None:
+            return 0
+
+        if self._refs is not None:
+            ref = self._refs.get(value)
+            if ref is not None:
+                self._counts[ref] += 1
+                return ref
+
+        if self._free:
+            ref = self._free.pop()
+            self._values[ref] = value
+        else:
+            ref = len(self._values)
+            self._values.append(value)
+            if self._counts is not None:
+                self._counts.append(0)
+
+        if self._refs is not None:
+            self._refs[value] = ref
+            self._counts[ref] = 1
+        return ref
+
+    def get(self, ref):
+        return self._values[ref]
+
+    def release(self, ref):
+        if ref == 0:
+            return
+
+        if self._refs is not None:
+            self._counts[ref] -= 1
+            if self._counts[ref] > 0:
+                return
+            del self._refs[self._values[ref]]
+
+        self._values[ref] = None
+        self._free.append(ref)
+
+
+class _ExpirationHeap:
+    """
+    Min-heap of (expires, record number) kept in two arrays instead of a list of tuples.
+    """
+
+    def __init__(self):
+        self._times = array('d')
+        self._records = array('q')
+
+    def __len__(self):
+        return len(self._times)
+
+    def push(self, expires, record):
+        self._times.append(expires)
+        self._records.append(record)
+        self._sift_up(len(self._times) - 1)
+
+    def peek(self):
+        return self._times[0], self._records[0]
+
+    def pop(self):
+        top = self.peek()
+        last_time, last_record = self._times.pop(), self._records.pop()
+        if self._times:
+            self._times[0], self._records[0] = last_time, last_record
+            self._sift_down(0)
+        return top
+
+    def _swap(self, i, j):
+        self._times[i], self._times[j] = self._times[j], self._times[i]
+        self._records[i], self._records[j] = self._records[j], self._records[i]
+
+    def _sift_up(self, i):
+        while i > 0:
+            parent = (i - 1) // 2
+            if self._times[parent] <= self._times[i]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        size = len(self._times)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < size and self._times[child] < self._times[smallest]:
+                    smallest = child
+            if smallest == i:
+                return
+            self._swap(i, smallest)
+            i = smallest
+
+
+class SQLiteBackend:
+    """
+    Keeps upload data in a SQLite database in WAL mode,
+    so several worker processes can share it and it survives restarts.
+    Every thread uses its own connection.
+    """
+
+    SCHEMA = [
+        '''
+        CREATE TABLE IF NOT EXISTS uploads (
+            id BLOB PRIMARY KEY,
+            upload_offset INTEGER NOT NULL,
+            upload_length INTEGER,
+            upload_defer_length INTEGER,
+            upload_metadata_header TEXT,
+            upload_concat TEXT,
+            upload_parts TEXT,
+            upload_digest TEXT,
+            upload_expires REAL
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS uploads_expires ON uploads (upload_expires)
+            WHERE upload_expires IS NOT NULL
+        '''
+    ]
+    COLUMNS = ('upload_offset, upload_length, upload_defer_length, upload_metadata_header, upload_concat, upload_parts,'
+               ' upload_digest, upload_expires')
+    INSERT = f'INSERT INTO uploads (id, {COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+    # SQLite limits the number of parameters of a statement.
+    MAX_PARAMETERS = 500
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        for statement in self.SCHEMA:
+            self._connection().execute(statement)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+
+        return connection
+
+    def insert(self, upload_data):
+        self._connection().execute(self.INSERT, self._row(upload_data))
+
+    def insert_many(self, uploads):
+        # one transaction, so the batch is written with a single commit.
+        connection = self._connection()
+        connection.execute('BEGIN')
+        try:
+            connection.executemany(self.INSERT, [self._row(upload_data) for upload_data in uploads])
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    @staticmethod
+    def _row(upload_data):
+        parts = None if upload_data.upload_parts is None else json.dumps([id.hex for id in upload_data.upload_parts])
+        return (upload_data.id.bytes, upload_data.upload_offset, upload_data.upload_length,
+                upload_data.upload_defer_length, upload_data.upload_metadata_header, upload_data.upload_concat, parts,
+                upload_data.upload_digest, upload_data.upload_expires)
+
+    def get(self, id):
+        row = self._connection().execute(f'SELECT {self.COLUMNS} FROM uploads WHERE id = ?', (id.bytes,)).fetchone()
+        if row is None:
+            return None
+
+        upload_offset, upload_length, upload_defer_length, metadata_header, upload_concat, parts, \
+            upload_digest, upload_expires = row
+        upload_data = UploadData(
+            upload_length, upload_defer_length, None, upload_concat,
+            None if parts is None else [UUID(hex=part) for part in json.loads(parts)],
+            upload_expires, metadata_header, id
+        )
+        upload_data.upload_offset = upload_offset
+        upload_data.upload_digest = upload_digest
+        return upload_data
+
+    def set_upload_length(self, id, upload_length):
+        self._connection().execute(
+            'UPDATE uploads SET upload_length = ?, upload_defer_length = NULL WHERE id = ?',
+            (upload_length, id.bytes)
+        )
+
+    def set_upload_digest(self, id, upload_digest):
+        self._connection().execute('UPDATE uploads SET upload_digest = ? WHERE id = ?', (upload_digest, id.bytes))
+
+    def set_upload_expires(self, id, upload_expires):
+        self._connection().execute('UPDATE uploads SET upload_expires = ? WHERE id = ?', (upload_expires, id.bytes))
+
+    def compare_and_set_offset(self, id, expected, upload_offset):
+        cursor = self._connection().execute(
+            'UPDATE uploads SET upload_offset = ? WHERE id = ? AND upload_offset = ?',
+            (upload_offset, id.bytes, expected)
+        )
+        return cursor.rowcount == 1
+
+    def expired(self, now, limit):
+        rows = self._connection().execute(
+            'SELECT id FROM uploads WHERE upload_expires <= ? ORDER BY upload_expires LIMIT ?',
+            (now, limit)
+        )
+        return [UUID(bytes=row[0]) for row in rows]
+
+    def delete(self, ids):
+        ids = [id.bytes for id in ids]
+        for i in range(0, len(ids), self.MAX_PARAMETERS):
+            batch = ids[i:i + self.MAX_PARAMETERS]
+            self._connection().execute(
+                f'DELETE FROM uploads WHERE id IN ({", ".join("?" * len(batch))})',
+                batch
+            )
+
+    def count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM uploads').fetchone()[0]
+
+
+class Database:
+    """
+    Upload data kept in a backend.
+    With a journal, every upload also has a sidecar in the storage, and uploads of an earlier process are recovered
+    from the sidecars: each on its first use, and all of them by recover(), which runs alongside requests at startup.
+    """
+
+    def __init__(self, backend=None, journal=None):
+        self.backend = MemoryBackend() if backend is None else backend
+        self.journal = journal
+        self._recover_lock = threading.Lock()
+
+    @property
+    def uploads(self):
+        return self.backend
+
+    def add_uploads(self, upload_length=None, upload_defer_length=None, metadata=None, upload_concat=None,
+                    upload_parts=None, upload_expires=None):
+        upload_data = UploadData(upload_length, upload_defer_length, metadata, upload_concat, upload_parts,
+                                 upload_expires)
+        self.backend.insert(upload_data)
+        if self.journal is not None:
+            self.journal.save(upload_data)
+
+        return upload_data
+
+    def add_uploads_many(self, specs):
+        """
+        Create uploads from a list of dicts of add_uploads arguments, stored with a single bulk insert.
+        """
+        uploads = [UploadData(**spec) for spec in specs]
+        self.backend.insert_many(uploads)
+        if self.journal is not None:
+            for upload_data in uploads:
+                self.journal.save(upload_data)
+
+        return uploads
+
+    @property
+    def blocking(self):
+        """
+        Whether writes may block, as they write sidecars of the journal or wait for other processes sharing SQLite.
+        """
+        return self.journal is not None or isinstance(self.backend, SQLiteBackend)
+
+    @property
+    def recovering(self):
+        """
+        Whether an upload missing from the backend may still be recovered from its sidecar.
+        """
+        return self.journal is not None and not self.journal.complete
+
+    def get_by_id(self, id, recover=True):
+        """
+        The upload of the id, or None. Unless recover is False, a missing upload is looked for in the journal,
+        which reads its sidecar.
+        """
+        upload_data = self.backend.get(id)
+        if upload_data is None and recover and self.recovering:
+            upload_data = self._recover([self.journal.load(id)]).get(id)
+        return upload_data
+
+    def recover(self):
+        """
+        Recover every upload of the journal missing from the backend. Returns the number of uploads recovered.
+        """
+        recovered = 0
+        for uploads in self.journal.scan():
+            recovered += len(self._recover(uploads))
+        self.journal.complete = True
+        return recovered
+
+    def _recover(self, uploads):
+        """
+        Insert the uploads missing from the backend, and return them by id.
+        An upload found meanwhile is kept, as requests may have changed it since.
+        """
+        with self._recover_lock:
+            missing = {upload_data.id: upload_data for upload_data in uploads
+                       if upload_data is not None and self.backend.get(upload_data.id) is None}
+            self.backend.insert_many(list(missing.values()))
+        self.journal.recovered_uploads += len(missing)
+        return missing
+
+    def set_upload_length(self, id, upload_length):
+        self.backend.set_upload_length(id, upload_length)
+        self._save(id)
+
+    def set_upload_digest(self, id, upload_digest):
+        self.backend.set_upload_digest(id, upload_digest)
+        self._save(id)
+
+    def set_upload_expires(self, id, upload_expires):
+        self.backend.set_upload_expires(id, upload_expires)
+        # extensions by PATCH requests are recovered from the data, only finishing and termination are journaled.
+        if upload_expires is None or upload_expires <= time.time():
+            self._save(id)
+
+    def _save(self, id):
+        if self.journal is not None:
+            upload_data = self.backend.get(id)
+            if upload_data is not None:
+                self.journal.save(upload_data)
+
+    def set_upload_offset(self, id, upload_offset, expected):
+        """
+        Set upload offset only if the stored offset is still expected.
+        Returns False when another request has changed it meanwhile.
+        """
+        return self.backend.compare_and_set_offset(id, expected, upload_offset)
+
+    def get_expired(self, now, limit):
+        """
+        Ids of at most limit uploads expired at now, the earliest first.
+        """
+        return self.backend.expired(now, limit)
+
+    def delete_uploads(self, ids):
+        self.backend.delete(ids)
+
+    def count(self):
+        return self.backend.count()
+
+
+def create_backend(kind, path=None):
+    if kind == 'memory':
+        return MemoryBackend()
+    if kind == 'compact':
+        return CompactBackend()
+    if kind == 'sqlite':
+        return SQLiteBackend(path)
+
+    raise ValueError(f'unknown database: {kind}')
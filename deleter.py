@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import deque
+
+
+class Deleter:
+    """
+    Removes terminated uploads in a background thread.
+    Queued uploads are removed in batches, data first and then metadata in one call,
+    and the thread sleeps as needed to keep removed bytes under max_bytes_per_second,
+    so mass terminations do not take the disk away from active uploads.
+    Until then the upload ids stay in pending and requests treat them as gone.
+    Queued uploads are expired at once too, so other worker processes sharing the database treat them as gone,
+    and an upload left queued at shutdown is removed by the reaper later.
+    With locks, an upload is only removed under its lock, one still being written to is put back in the queue.
+    """
+
+    def __init__(self, db, storage, batch_size=100, max_bytes_per_second=0, linger=0.05, on_delete=None,
+                 locks=None):
+        self.db = db
+        self.storage = storage
+        self.batch_size = batch_size
+        self.max_bytes_per_second = max_bytes_per_second
+        self.linger = linger
+        self.on_delete = on_delete
+        self.locks = locks
+        self.pending = set()
+        self.deleted_uploads = 0
+        self.deleted_bytes = 0
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def delete(self, id):
+        """
+        Queue the upload for removal and return at once.
+        """
+        self.db.set_upload_expires(id, 0)
+        with self._condition:
+            if id in self.pending:
+                return
+            self.pending.add(id)
+            self._queue.append(id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='tus-deleter', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def is_pending(self, id):
+        return id in self.pending
+
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+            # let more terminations arrive, so they are removed together.
+            time.sleep(self.linger)
+            self.delete_batch()
+
+    def delete_batch(self):
+        """
+        Remove up to batch_size queued uploads. Returns the number of uploads removed.
+        """
+        with self._condition:
+            ids = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+        if not ids:
+            return 0
+
+        started = time.monotonic()
+        deleted_bytes = 0
+        busy = [] if self.locks is None else [id for id in ids if not self.locks.try_lock(id)]
+        if busy:
+            ids = [id for id in ids if id not in busy]
+        try:
+            for id in ids:
+                deleted_bytes += self.storage.delete(id)
+                if self.on_delete is not None:
+                    self.on_delete(id)
+            self.db.delete_uploads(ids)
+        finally:
+            if self.locks is not None:
+                for id in ids:
+                    self.locks.unlock(id, remove=True)
+
+        with self._condition:
+            self.pending.difference_update(ids)
+            self._queue.extend(busy)
+        self.deleted_uploads += len(ids)
+        self.deleted_bytes += deleted_bytes
+
+        if self.max_bytes_per_second > 0:
+            time.sleep(max(deleted_bytes / self.max_bytes_per_second - (time.monotonic() - started), 0))
+
+        return len(ids)
+
+    def flush(self):
+        """
+        Remove every queued upload in the calling thread.
+        """
+        while self.delete_batch():
+            pass
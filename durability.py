@@ -0,0 +1,62 @@
+import asyncio
+
+
+class GroupCommitter:
+    """
+    Makes written data durable for many uploads with one sync call.
+    Uploads waiting for durability are collected into a batch which is synced
+    interval seconds after its first upload joined it, or at once when max_bytes were written to it.
+    """
+
+    def __init__(self, storage, executor, interval=0.005, max_bytes=8 * 1024 * 1024):
+        self.storage = storage
+        self.executor = executor
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.batches = 0
+        self.synced_uploads = 0
+        self.sync_seconds = 0.0
+        self._batch = None
+        self._bytes = 0
+        self._timer = None
+
+    async def sync(self, file_id, written):
+        """
+        Wait until the data written to the upload is durable.
+        written is the number of bytes written since the previous sync of the upload.
+        """
+        if self._batch is None:
+            self._batch = (set(), asyncio.get_event_loop().create_future())
+            self._timer = asyncio.get_event_loop().call_later(self.interval, self._commit)
+
+        file_ids, done = self._batch
+        file_ids.add(file_id)
+        self._bytes += written
+        if self._bytes >= self.max_bytes:
+            self._commit()
+
+        # shielded, so a cancelled request does not cancel the sync of the others.
+        await asyncio.shield(done)
+
+    def _commit(self):
+        file_ids, done = self._batch
+        self._timer.cancel()
+        self._batch = None
+        self._timer = None
+        self._bytes = 0
+        asyncio.ensure_future(self._sync(file_ids, done))
+
+    async def _sync(self, file_ids, done):
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        try:
+            await self.executor.run(self.storage.sync, list(file_ids))
+        except Exception as e:
+            done.set_exception(e)
+            return
+        finally:
+            self.batches += 1
+            self.synced_uploads += len(file_ids)
+            self.sync_seconds += loop.time() - started
+
+        done.set_result(None)
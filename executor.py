@@ -0,0 +1,75 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class IOExecutor:
+    """
+    Runs blocking file operations on behalf of the event loop.
+    At most max_concurrency operations run at once, the rest wait in the queue.
+    """
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.queue_depth = 0
+        self.active = 0
+        self._semaphore = None
+
+    async def run(self, func, *args, **kwargs):
+        # created lazily, so the semaphore belongs to the loop serving requests.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        self.queue_depth += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queue_depth -= 1
+
+        self.active += 1
+        try:
+            return await self._execute(functools.partial(func, *args, **kwargs))
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    async def _execute(self, call):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class ThreadPoolIOExecutor(IOExecutor):
+    """
+    Runs file operations in a pool of worker threads.
+    """
+
+    def __init__(self, max_concurrency, max_workers):
+        super().__init__(max_concurrency)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tus-io')
+
+    async def _execute(self, call):
+        return await asyncio.get_event_loop().run_in_executor(self.pool, call)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+
+class InlineIOExecutor(IOExecutor):
+    """
+    Runs file operations directly on the event loop.
+    Only suitable for storage that never blocks, like tmpfs.
+    """
+
+    async def _execute(self, call):
+        return call()
+
+
+def create_executor(kind, max_concurrency, max_workers):
+    if kind == 'thread':
+        return ThreadPoolIOExecutor(max_concurrency, max_workers)
+    if kind == 'inline':
+        return InlineIOExecutor(max_concurrency)
+
+    raise ValueError(f'unknown io executor: {kind}')
@@ -3,11 +3,22 @@ UPLOAD_OFFSET = 'Upload-Offset'
 UPLOAD_DEFER_LENGTH = 'Upload-Defer-Length'
 UPLOAD_METADATA = 'Upload-Metadata'
 UPLOAD_CONCAT = 'Upload-Concat'
+UPLOAD_CHECKSUM = 'Upload-Checksum'
+UPLOAD_EXPIRES = 'Upload-Expires'
 TUS_RESUMABLE = 'Tus-Resumable'
 TUS_VERSION = 'Tus-Version'
 TUS_MAX_SIZE = 'Tus-Max-Size'
 TUS_EXTENSION = 'Tus-Extension'
+TUS_CHECKSUM_ALGORITHM = 'Tus-Checksum-Algorithm'
 LOCATION = 'Location'
 CACHE_CONTROL = 'Cache-Control'
+RETRY_AFTER = 'Retry-After'
 CONTENT_TYPE = 'Content-Type'
 CONTENT_LENGTH = 'Content-Length'
+ACCEPT_ENCODING = 'Accept-Encoding'
+ACCEPT_RANGES = 'Accept-Ranges'
+CONTENT_RANGE = 'Content-Range'
+RANGE = 'Range'
+IF_RANGE = 'If-Range'
+ETAG = 'ETag'
+DIGEST = 'Digest'
@@ -0,0 +1,239 @@
+import asyncio
+import contextlib
+import fcntl
+import os
+import threading
+import time
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class LockManager:
+    """
+    Hands out one lock per upload, so writes to an upload are serialized
+    while writes to other uploads go on without waiting.
+    Locks only exist while somebody holds or waits for them.
+    Threads removing uploads take them with try_lock(), which never waits.
+    """
+
+    POLL_INTERVAL = 0.005
+    MAX_POLL_INTERVAL = 0.1
+
+    def __init__(self):
+        self._locks = {}
+        # uploads locked by try_lock(), guarded by _mutex together with _locks.
+        self._claimed = {}
+        self._mutex = threading.Lock()
+        self.acquired = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.waiting = 0
+        self.wait_seconds = 0.0
+
+    @contextlib.asynccontextmanager
+    async def lock(self, id, timeout=None):
+        """
+        Hold the lock of the upload for the duration of the block.
+        Raises LockTimeout when it can not be acquired within timeout seconds.
+        """
+        with self._mutex:
+            entry = self._locks.get(id)
+            if entry is None:
+                entry = self._locks[id] = [asyncio.Lock(), 0]
+            entry[1] += 1
+
+        try:
+            await self._acquire(id, entry[0], timeout)
+            try:
+                yield
+            finally:
+                self._release(id, entry[0])
+        finally:
+            with self._mutex:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[id]
+
+    def try_lock(self, id):
+        """
+        Lock the upload from any thread without waiting, until unlock(id).
+        Returns False when somebody holds or waits for its lock.
+        """
+        with self._mutex:
+            if id in self._locks or id in self._claimed:
+                return False
+            self._claimed[id] = None
+        return True
+
+    def unlock(self, id, remove=False):
+        """
+        Unlock an upload locked by try_lock(), with remove once the upload is deleted.
+        """
+        with self._mutex:
+            del self._claimed[id]
+
+    async def _acquire(self, id, local_lock, timeout):
+        started = time.monotonic()
+        if not local_lock.locked():
+            await local_lock.acquire()
+            self.acquired += 1
+        else:
+            self.contended += 1
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(local_lock.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise LockTimeout(id)
+            finally:
+                self.waiting -= 1
+                self.wait_seconds += time.monotonic() - started
+
+            self.acquired += 1
+
+        # taken by try_lock() before anybody asked for it here, which is held briefly.
+        interval = self.POLL_INTERVAL
+        while id in self._claimed:
+            if timeout is not None and time.monotonic() - started >= timeout:
+                self.timeouts += 1
+                local_lock.release()
+                raise LockTimeout(id)
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+
+    def _release(self, id, local_lock):
+        local_lock.release()
+
+
+class FileLockManager(LockManager):
+    """
+    Lock manager shared by every process using the same lock directory.
+    Within a process the per-upload asyncio lock is taken first,
+    then an exclusive flock on the upload's lock file, polled without blocking the event loop.
+    Lock files are sharded into directories by the leading characters of the upload id,
+    and removed with their upload. A lock taken on a file removed meanwhile is taken again on its replacement.
+    """
+
+    def __init__(self, directory, shard_width=2):
+        super().__init__()
+        self.directory = directory
+        self.shard_width = shard_width
+        self._files = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, id):
+        id = str(id)
+        return os.path.join(self.directory, id[:self.shard_width], f'{id}.lock')
+
+    def _open(self, id):
+        path = self._path(id)
+        try:
+            return os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            return os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def _is_current(self, id, fd):
+        try:
+            return os.stat(self._path(id)).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            return False
+
+    async def _acquire(self, id, local_lock, timeout):
+        started = time.monotonic()
+        await super()._acquire(id, local_lock, timeout)
+
+        fd = None
+        interval = self.POLL_INTERVAL
+        contended = False
+        flock_started = time.monotonic()
+        try:
+            fd = self._open(id)
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    if self._is_current(id, fd):
+                        break
+                    os.close(fd)
+                    fd = None
+                    fd = self._open(id)
+                    continue
+                except BlockingIOError:
+                    pass
+
+                if not contended:
+                    contended = True
+                    self.contended += 1
+                    self.waiting += 1
+
+                if timeout is not None and time.monotonic() - started >= timeout:
+                    self.timeouts += 1
+                    raise LockTimeout(id)
+
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+
+        except BaseException:
+            if fd is not None:
+                os.close(fd)
+            local_lock.release()
+            raise
+
+        finally:
+            if contended:
+                self.waiting -= 1
+                self.wait_seconds += time.monotonic() - flock_started
+
+        self._files[id] = fd
+
+    def try_lock(self, id):
+        if not super().try_lock(id):
+            return False
+
+        while True:
+            fd = self._open(id)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                super().unlock(id)
+                return False
+            if self._is_current(id, fd):
+                break
+            os.close(fd)
+
+        with self._mutex:
+            self._claimed[id] = fd
+        return True
+
+    def unlock(self, id, remove=False):
+        fd = self._claimed[id]
+        try:
+            if remove:
+                try:
+                    os.unlink(self._path(id))
+                except FileNotFoundError:
+                    pass
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+            super().unlock(id)
+
+    def _release(self, id, local_lock):
+        fd = self._files.pop(id)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+            local_lock.release()
+
+
+def create_lock_manager(kind, directory=None):
+    if kind == 'memory':
+        return LockManager()
+    if kind == 'file':
+        return FileLockManager(directory)
+
+    raise ValueError(f'unknown lock manager: {kind}')
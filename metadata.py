@@ -0,0 +1,32 @@
+import base64
+import binascii
+import re
+
+# a key and its base64 encoded value, keys have no spaces and commas.
+PAIR_PATTERN = re.compile(r'([^\s,]+) ([A-Za-z0-9+/]*={0,2})', re.RegexFlag.ASCII)
+
+
+def to_metadata_header(metadata):
+    """
+    Upload-Metadata header of a metadata dict.
+    """
+    return ','.join([f'{k} {base64.standard_b64encode(v.encode()).decode()}' for k, v in metadata.items()])
+
+
+def to_metadata_dict(metadata_header):
+    """
+    Metadata dict of Upload-Metadata header.
+    Pairs without a value or with a value which is not base64 encoded UTF-8 are ignored.
+    """
+    metadata = {}
+    for pair in metadata_header.split(','):
+        matched = PAIR_PATTERN.fullmatch(pair.lstrip())
+        if matched is None:
+            continue
+
+        try:
+            metadata[matched[1]] = base64.b64decode(matched[2], validate=True).decode()
+        except (binascii.Error, UnicodeDecodeError):
+            continue
+
+    return metadata
@@ -0,0 +1,51 @@
+import time
+
+
+class Reaper:
+    """
+    Deletes expired uploads in batches.
+    Expired uploads are found through the expiration index of the database, not by scanning every upload.
+    Data is deleted before metadata, so an interrupted run leaves nothing unreachable behind.
+    With locks, an upload is only deleted under its lock, one still being written to is left for a later run.
+    """
+
+    def __init__(self, db, storage, batch_size=1000, on_delete=None, locks=None):
+        self.db = db
+        self.storage = storage
+        self.batch_size = batch_size
+        self.on_delete = on_delete
+        self.locks = locks
+        self.runs = 0
+        self.reaped_uploads = 0
+        self.reclaimed_bytes = 0
+
+    def reap(self, now=None):
+        """
+        Delete every upload expired at now.
+        Returns the number of uploads and bytes reclaimed by this run.
+        """
+        now = time.time() if now is None else now
+        uploads = reclaimed_bytes = 0
+        while True:
+            expired = self.db.get_expired(now, self.batch_size)
+            ids = expired if self.locks is None else [id for id in expired if self.locks.try_lock(id)]
+            try:
+                for id in ids:
+                    reclaimed_bytes += self.storage.delete(id)
+                    if self.on_delete is not None:
+                        self.on_delete(id)
+                self.db.delete_uploads(ids)
+            finally:
+                if self.locks is not None:
+                    for id in ids:
+                        self.locks.unlock(id, remove=True)
+
+            uploads += len(ids)
+            # locked uploads are found again by the next query, a batch of only those ends the run.
+            if len(expired) < self.batch_size or not ids:
+                break
+
+        self.runs += 1
+        self.reaped_uploads += uploads
+        self.reclaimed_bytes += reclaimed_bytes
+        return uploads, reclaimed_bytes
@@ -0,0 +1,86 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from uuid import UUID
+
+from database import UploadData
+
+
+class UploadJournal:
+    """
+    Keeps a sidecar of each upload next to its data in the storage, from which the upload is recovered after a restart.
+    The sidecar holds what is set at creation or changes rarely: length, metadata header, concat, parts, digest
+    and expiration. The offset is recovered from the size of the data, and an expiration extended by PATCH requests
+    from the time the data was last written, so writing data never rewrites the sidecar.
+    """
+
+    def __init__(self, storage, expiration=0, workers=8, batch_size=1000):
+        """
+        expiration is the seconds an unfinished upload is kept after its last PATCH, 0 when uploads do not expire.
+        """
+        self.storage = storage
+        self.expiration = expiration
+        self.workers = workers
+        self.batch_size = batch_size
+        # set once every sidecar was scanned, uploads missing from the database are gone then.
+        self.complete = False
+        self.recovered_uploads = 0
+        self.scan_seconds = 0.0
+
+    def save(self, upload_data):
+        info = {
+            'length': upload_data.upload_length,
+            'defer_length': upload_data.upload_defer_length,
+            'metadata': upload_data.upload_metadata_header,
+            'concat': upload_data.upload_concat,
+            'parts': None if upload_data.upload_parts is None else [id.hex for id in upload_data.upload_parts],
+            'digest': upload_data.upload_digest,
+            'expires': upload_data.upload_expires,
+        }
+        info = {key: value for key, value in info.items() if value is not None}
+        self.storage.write_info(upload_data.id, json.dumps(info, separators=(',', ':')).encode())
+
+    def load(self, id):
+        """
+        The upload recovered from its sidecar and data, or None if it has no readable sidecar.
+        """
+        info = self.storage.read_info(id)
+        if info is None:
+            return None
+        try:
+            info = json.loads(info)
+        except ValueError:
+            # a damaged sidecar loses its upload rather than failing the recovery of the others.
+            return None
+        parts = info.get('parts')
+        upload_data = UploadData(info.get('length'), info.get('defer_length'), upload_concat=info.get('concat'),
+                                 upload_parts=None if parts is None else [UUID(hex=part) for part in parts],
+                                 upload_expires=info.get('expires'), metadata_header=info.get('metadata'),
+                                 id=id)
+        upload_data.upload_digest = info.get('digest')
+
+        stat = self.storage.stat(id)
+        if stat is not None:
+            size, modified = stat
+            length = upload_data.upload_length
+            upload_data.upload_offset = size if length is None else min(size, int(length))
+            if upload_data.upload_expires and self.expiration > 0:
+                upload_data.upload_expires = max(upload_data.upload_expires, modified + self.expiration)
+
+        return upload_data
+
+    def scan(self):
+        """
+        Iterate over lists of the uploads of every sidecar, loaded by a pool of threads.
+        """
+        started = time.monotonic()
+        ids = (UUID(id) for id in self.storage.info_ids())
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='tus-recovery') as pool:
+            while True:
+                batch = list(islice(ids, self.batch_size))
+                if not batch:
+                    break
+                yield [upload_data for upload_data in pool.map(self.load, batch) if upload_data is not None]
+
+        self.scan_seconds = time.monotonic() - started
@@ -0,0 +1,143 @@
+"""
+Production entry point.
+Runs config.SERVER_WORKERS worker processes serving the app on one port.
+Workers share upload data through the SQLite database and upload locks through lock files,
+so more than one worker needs TUS_DATABASE_PATH and TUS_LOCK_MANAGER=file.
+SIGTERM or SIGINT stops accepting connections and lets in-flight requests finish.
+"""
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import sys
+import time
+
+from uvicorn.config import Config
+from uvicorn.main import Server
+
+import config
+from checksum import COLLISION_RESISTANT
+
+logger = logging.getLogger('tus.server')
+
+
+def create_socket(host, port, reuse_port, listen=True):
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    if listen:
+        sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock, host, port, reuse_port):
+    """
+    Serve the app in a worker process, on the shared socket or on a socket of its own.
+    """
+    # out of the process group of the supervisor, so a Ctrl+C on the terminal only reaches the supervisor,
+    # which stops the workers itself.
+    os.setpgrp()
+    if sock is None:
+        sock = create_socket(host, port, reuse_port=True)
+
+    # imported after the fork, so every worker has its own connections, threads and event loop.
+    import api
+
+    server = WorkerServer(Config(api.api, log_level='warning'))
+    server.run(sockets=[sock])
+
+
+class WorkerServer(Server):
+    """
+    Server of a worker, which lets in-flight requests finish however often it is asked to stop.
+    A worker may be signalled both by a service manager stopping every process of the service and by the supervisor,
+    and uvicorn would cut requests short on the second signal. The supervisor kills workers not stopped in time.
+    """
+
+    def handle_exit(self, sig, frame):
+        if not self.should_exit:
+            super().handle_exit(sig, frame)
+
+
+class Supervisor:
+    """
+    Starts the workers, starts them again when they die, and stops them on SIGTERM or SIGINT.
+    """
+
+    def __init__(self, workers, host, port, reuse_port, shutdown_timeout):
+        self.workers = workers
+        self.reuse_port = reuse_port and hasattr(socket, 'SO_REUSEPORT')
+        self.shutdown_timeout = shutdown_timeout
+        # with SO_REUSEPORT, this socket is bound but not listening:
+        # it reserves the port for the worker sockets and receives no connections itself.
+        self.socket = create_socket(host, port, self.reuse_port, listen=not self.reuse_port)
+        self.host, self.port = self.socket.getsockname()[:2]
+        self.processes = []
+        self.stopping = False
+        self._context = multiprocessing.get_context('fork')
+
+    def spawn(self):
+        process = self._context.Process(
+            target=run_worker,
+            args=(None if self.reuse_port else self.socket, self.host, self.port, self.reuse_port),
+            daemon=False
+        )
+        process.start()
+        return process
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.processes = [self.spawn() for _ in range(self.workers)]
+        logger.warning('serving on %s:%d with %d workers', self.host, self.port, self.workers)
+
+        while not self.stopping:
+            multiprocessing.connection.wait([process.sentinel for process in self.processes], timeout=0.5)
+            for i, process in enumerate(self.processes):
+                if not process.is_alive() and not self.stopping:
+                    logger.warning('worker %d exited with %s, starting it again', process.pid, process.exitcode)
+                    self.processes[i] = self.spawn()
+
+        self.shutdown()
+
+    def shutdown(self):
+        for process in self.processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in self.processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning('worker %d did not stop in time, killing it', process.pid)
+                process.kill()
+                process.join()
+
+        self.socket.close()
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(name)s %(message)s')
+
+    if config.SERVER_WORKERS > 1 and (config.DATABASE != 'sqlite' or config.LOCK_MANAGER != 'file'):
+        sys.exit('more than one worker needs shared state: set TUS_DATABASE_PATH and TUS_LOCK_MANAGER=file')
+    # checked here as well as in api, so workers failing to start are not started again and again.
+    if config.DEDUP and config.UPLOAD_DIGEST not in COLLISION_RESISTANT:
+        sys.exit('TUS_DEDUP=1 needs a collision resistant TUS_UPLOAD_DIGEST, such as sha256 or sha512')
+
+    Supervisor(config.SERVER_WORKERS, config.SERVER_HOST, config.SERVER_PORT, config.SERVER_REUSE_PORT,
+               config.SERVER_SHUTDOWN_TIMEOUT).run()
+
+
+if __name__ == '__main__':
+    main()
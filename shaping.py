@@ -0,0 +1,181 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class TokenBucket:
+    """
+    Bytes per second with bursts of up to burst bytes.
+    Taking more tokens than there are leaves a debt, which later takers wait for.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, size, now):
+        """
+        Seconds until size tokens can be taken, pieces larger than burst wait for a full bucket.
+        """
+        self._refill(now)
+        return max((min(size, self.burst) - self.tokens) / self.rate, 0.0)
+
+    def take(self, size, now):
+        """
+        Take size tokens and return the seconds until the debt left behind is paid.
+        """
+        self._refill(now)
+        self.tokens -= size
+        return max(-self.tokens / self.rate, 0.0)
+
+
+class FairScheduler:
+    """
+    Shares a token bucket among flows by start-time fair queueing.
+    Each request is tagged with the virtual time its flow finishes sending it at,
+    and waiting requests are granted in tag order, so a flow of small pieces is not stuck
+    behind the pieces of flows sending large ones, and busy flows share the rate evenly.
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.virtual_time = 0.0
+        # finish tag of the last request of each flow.
+        self._finish = {}
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._dispatcher = None
+        self._arrived = None
+
+    @property
+    def waiting(self):
+        return len(self._waiting)
+
+    async def acquire(self, flow, size):
+        now = time.monotonic()
+        start = max(self.virtual_time, self._finish.get(flow, 0.0))
+        self._finish[flow] = start + size
+        if not self._waiting and self.bucket.delay(size, now) == 0:
+            self.bucket.take(size, now)
+            self.virtual_time = start
+            return
+
+        granted = asyncio.get_event_loop().create_future()
+        entry = (start + size, next(self._sequence), start, size, granted)
+        heapq.heappush(self._waiting, entry)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._arrived = asyncio.Event()
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        elif self._waiting[0] is entry:
+            # the dispatcher waits for the tokens of the previous head.
+            self._arrived.set()
+        await granted
+
+    def remove(self, flow):
+        self._finish.pop(flow, None)
+
+    async def _dispatch(self):
+        while self._waiting:
+            _, _, start, size, granted = self._waiting[0]
+            if granted.cancelled():
+                heapq.heappop(self._waiting)
+                continue
+
+            now = time.monotonic()
+            delay = self.bucket.delay(size, now)
+            if delay > 0:
+                # woken up early when a request tagged earlier arrives.
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._waiting)
+            self.bucket.take(size, now)
+            self.virtual_time = start
+            granted.set_result(None)
+
+
+class BandwidthShaper:
+    """
+    Limits the rate upload bodies are received at, per upload, per client and in total.
+    Writers wait for the buckets of their upload and client first, then for their fair share of the total rate.
+    Bodies are read piece by piece, so waiting before the next piece slows down reading from the socket
+    and no more than one piece is held per request.
+    A rate of 0 does not limit.
+    """
+
+    def __init__(self, rate=0, client_rate=0, upload_rate=0, burst=1024 * 1024):
+        self.client_rate = client_rate
+        self.upload_rate = upload_rate
+        self.burst = burst
+        self.scheduler = FairScheduler(TokenBucket(rate, burst)) if rate > 0 else None
+        # [bucket, writers] of uploads and clients with writers.
+        self._uploads = {}
+        self._clients = {}
+        self.writers = 0
+        self.throttled_seconds = 0.0
+
+    def writer(self, upload_id, client):
+        """
+        A writer of the upload, whose throttle() is awaited before each piece it receives.
+        It must be closed once the body is received.
+        """
+        self.writers += 1
+        return _Writer(self, upload_id, client)
+
+    def _join(self, entries, key, rate):
+        entry = entries.get(key)
+        if entry is None:
+            entry = entries[key] = [TokenBucket(rate, self.burst) if rate > 0 else None, 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _leave(self, upload_id, client):
+        self.writers -= 1
+        for entries, key in ((self._uploads, upload_id), (self._clients, client)):
+            entry = entries[key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del entries[key]
+        if self.scheduler is not None and upload_id not in self._uploads:
+            self.scheduler.remove(upload_id)
+
+
+class _Writer:
+    __slots__ = ['shaper', 'upload_id', 'client', 'buckets']
+
+    def __init__(self, shaper, upload_id, client):
+        self.shaper = shaper
+        self.upload_id = upload_id
+        self.client = client
+        buckets = (shaper._join(shaper._uploads, upload_id, shaper.upload_rate),
+                   shaper._join(shaper._clients, client, shaper.client_rate))
+        self.buckets = [bucket for bucket in buckets if bucket is not None]
+
+    def close(self):
+        self.shaper._leave(self.upload_id, self.client)
+
+    async def throttle(self, size):
+        """
+        Wait until size more bytes may be received.
+        """
+        if not self.buckets and self.shaper.scheduler is None:
+            return
+
+        started = time.monotonic()
+        delay = max([bucket.take(size, started) for bucket in self.buckets], default=0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.shaper.scheduler is not None:
+            await self.shaper.scheduler.acquire(self.upload_id, size)
+        self.shaper.throttled_seconds += time.monotonic() - started
@@ -0,0 +1,646 @@
+import filecmp
+import hashlib
+import math
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from concat import concatenate
+
+
+# directory of each root the shared content of deduplicated uploads is kept in.
+BLOB_DIRECTORY = 'blobs'
+
+
+class FileDescriptorCache:
+    """
+    LRU cache of file descriptors of active uploads.
+    Descriptors idle for longer than idle_timeout are closed, and the least recently used ones
+    are closed once more than capacity are open. Descriptors in use are never closed.
+    """
+
+    def __init__(self, capacity, idle_timeout):
+        self.capacity = capacity
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # entries closed while in use by fd, closed by their last release.
+        self._closing = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, path, create=False):
+        """
+        Descriptor of path, to be released with release(path, fd).
+        Raises FileNotFoundError if the file does not exist, unless create is set.
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                self._entries.move_to_end(path)
+                entry[1] += 1
+                self.hits += 1
+                return entry[0]
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT if create else os.O_RDWR, 0o644)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                # opened by another thread meanwhile.
+                os.close(fd)
+                entry[1] += 1
+                return entry[0]
+
+            self._entries[path] = [fd, 1, time.monotonic()]
+            self.misses += 1
+            self._evict(time.monotonic())
+            return fd
+
+    def release(self, path, fd):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == fd:
+                entry[1] -= 1
+                entry[2] = time.monotonic()
+                return
+
+            entry = self._closing.get(fd)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._closing[fd]
+        os.close(fd)
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict(time.monotonic())
+
+    def close(self, path):
+        """
+        Close the descriptor of path, once its last user releases it if it is in use.
+        The next acquire opens the file again.
+        """
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None and entry[1] > 0:
+                self._closing[entry[0]] = entry
+                return
+        if entry is not None:
+            os.close(entry[0])
+
+    def discard(self, path):
+        """
+        Close the descriptor of path unless it is in use, in which case it is closed once idle.
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[1] > 0:
+                return
+            del self._entries[path]
+        os.close(entry[0])
+
+    def close_all(self):
+        with self._lock:
+            entries, self._entries = self._entries, OrderedDict()
+        for fd, _, _ in entries.values():
+            os.close(fd)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, now):
+        # entries are in least recently used order.
+        for path, (fd, users, last_used) in list(self._entries.items()):
+            over_capacity = len(self._entries) > self.capacity
+            if not over_capacity and now - last_used < self.idle_timeout:
+                break
+            if users == 0:
+                del self._entries[path]
+                os.close(fd)
+
+
+class Storage:
+    """
+    Keeps the data of uploads.
+    Methods block and are run through the file I/O executor.
+    """
+
+    def write(self, file_id, offset, data):
+        """
+        Write data at offset and return the offset after it.
+        """
+        raise NotImplementedError
+
+    def read(self, file_id, offset, size):
+        """
+        Read at most size bytes from offset.
+        Raises FileNotFoundError if the upload has no data.
+        """
+        raise NotImplementedError
+
+    def delete(self, file_id):
+        """
+        Remove the data of the upload and return the number of bytes freed.
+        """
+        raise NotImplementedError
+
+    def path(self, file_id):
+        """
+        Local file of the upload, or None if the data is not kept in a local file.
+        """
+        return None
+
+    def truncate(self, file_id, size):
+        """
+        Drop the data after size.
+        """
+        raise NotImplementedError
+
+    def stat(self, file_id):
+        """
+        (size, unix time of the last write) of the data of the upload, or None if nothing was written.
+        """
+        raise NotImplementedError
+
+    def write_info(self, file_id, info):
+        """
+        Replace the sidecar of the upload, bytes describing it kept next to its data and deleted with it.
+        """
+        raise NotImplementedError
+
+    def read_info(self, file_id):
+        """
+        The sidecar of the upload, or None if it has none.
+        """
+        raise NotImplementedError
+
+    def info_ids(self):
+        """
+        Iterate over the ids of the uploads which have a sidecar, as strings.
+        """
+        raise NotImplementedError
+
+    def sync(self, file_ids):
+        """
+        Make the data written to the uploads so far durable.
+        """
+        raise NotImplementedError
+
+    def deduplicate(self, file_id, key):
+        """
+        Share the data of the finished upload with other uploads of the same content key, e.g. its digest.
+        Returns True if it was replaced by data stored before.
+        """
+        raise NotImplementedError
+
+    def release_blob(self, key):
+        """
+        Drop the shared data of the content key once no upload refers to it.
+        """
+        raise NotImplementedError
+
+    def close(self, file_id):
+        pass
+
+    def concatenate(self, source_ids, target_id, progress=None, step_size=1024 * 1024):
+        """
+        Write the data of the sources one after another to the target.
+        """
+        offset = 0
+        for source_id in source_ids:
+            source_offset = 0
+            while True:
+                data = self.read(source_id, source_offset, step_size)
+                if not data:
+                    break
+
+                offset = self.write(target_id, offset, data)
+                source_offset += len(data)
+                if progress is not None:
+                    progress(len(data))
+
+
+class LocalStorage(Storage):
+    """
+    Keeps each upload in a file on local filesystems.
+    Files are sharded into directories by the leading characters of the upload id,
+    and spread over several roots (mount points) either by weight or by free space.
+    Data is written at the exact offset with pwrite on cached file descriptors.
+    """
+
+    def __init__(self, roots, placement='weight', shard_depth=2, shard_width=2,
+                 fd_cache_size=256, fd_idle_timeout=30.0):
+        """
+        roots is a list of (directory, weight).
+        placement 'weight' puts new uploads on a root picked by rendezvous hashing of the upload id.
+        placement 'free-space' puts new uploads on the root with the most free space.
+        Existing uploads are found on the root holding their data or sidecar, so adding a root does not move them.
+        """
+        if placement not in ('weight', 'free-space'):
+            raise ValueError(f'unknown placement: {placement}')
+
+        self.roots = [(Path(directory), weight) for directory, weight in roots]
+        for root, _ in self.roots:
+            root.mkdir(parents=True, exist_ok=True)
+        self.placement = placement
+        self.shard_depth = shard_depth
+        self.shard_width = shard_width
+        self.fds = FileDescriptorCache(fd_cache_size, fd_idle_timeout)
+        self._placed = {}
+        # directories of files created since their last sync, their entries are not durable before the directory is.
+        # A sidecar written since then is synced with them.
+        self._created = {}
+        self._created_lock = threading.Lock()
+        self.deduplicated_uploads = 0
+        self.deduplicated_bytes = 0
+
+    def path(self, file_id):
+        file_id = str(file_id)
+        root = self._placed.get(file_id)
+        if root is None:
+            root = self._find_root(file_id)
+
+        return self._path_in(root, file_id)
+
+    def _path_in(self, root, file_id):
+        shards = [file_id[i * self.shard_width:(i + 1) * self.shard_width] for i in range(self.shard_depth)]
+        return root.joinpath(*shards, file_id)
+
+    @staticmethod
+    def _info_path(path):
+        return path.with_name(path.name + '.info')
+
+    def _find_root(self, file_id):
+        if len(self.roots) == 1:
+            return self.roots[0][0]
+
+        roots = self.roots
+        if self.placement == 'weight':
+            # the root an upload is placed on is probed first, the others only hold it if roots changed since.
+            roots = sorted(roots, key=lambda root: self._rendezvous_score(file_id, *root), reverse=True)
+
+        for root, _ in roots:
+            path = self._path_in(root, file_id)
+            if path.exists() or self._info_path(path).exists():
+                self._placed[file_id] = root
+                return root
+
+        if self.placement == 'weight':
+            root = roots[0][0]
+        else:
+            root = max(roots, key=lambda root: shutil.disk_usage(root[0]).free)[0]
+        self._placed[file_id] = root
+        return root
+
+    @staticmethod
+    def _rendezvous_score(file_id, root, weight):
+        digest = hashlib.blake2b(f'{root}/{file_id}'.encode(), digest_size=8).digest()
+        uniform = (int.from_bytes(digest, 'big') + 1) / (2 ** 64 + 1)
+        return -weight / math.log(uniform)
+
+    def _create(self, path):
+        try:
+            return self.fds.acquire(path, create=True)
+        except FileNotFoundError:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            return self.fds.acquire(path, create=True)
+
+    def write(self, file_id, offset, data):
+        """
+        Only a write at offset 0 creates the file, writing further into a missing file raises FileNotFoundError.
+        """
+        path = self.path(file_id)
+        if offset == 0:
+            with self._created_lock:
+                self._created[str(file_id)] = path.parent
+            fd = self._create(path)
+        else:
+            fd = self.fds.acquire(path)
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                offset += written
+                view = view[written:]
+        finally:
+            self.fds.release(path, fd)
+
+        return offset
+
+    def read(self, file_id, offset, size):
+        path = self.path(file_id)
+        fd = self.fds.acquire(path)
+        try:
+            return os.pread(fd, size, offset)
+        finally:
+            self.fds.release(path, fd)
+
+    def truncate(self, file_id, size):
+        os.truncate(self.path(file_id), size)
+
+    def stat(self, file_id):
+        try:
+            stat = self.path(file_id).stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    def write_info(self, file_id, info):
+        path = self.path(file_id)
+        info_path = self._info_path(path)
+        temporary = info_path.with_name(info_path.name + '.tmp')
+        try:
+            temporary.write_bytes(info)
+        except FileNotFoundError:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temporary.write_bytes(info)
+        os.replace(temporary, info_path)
+        with self._created_lock:
+            self._created[str(file_id)] = path.parent
+
+    def read_info(self, file_id):
+        try:
+            return self._info_path(self.path(file_id)).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def info_ids(self):
+        for root, _ in self.roots:
+            directories = [root]
+            for _ in range(self.shard_depth):
+                directories = [entry.path for directory in directories for entry in os.scandir(directory)
+                               if entry.is_dir()]
+            for directory in directories:
+                for entry in os.scandir(directory):
+                    if entry.name.endswith('.info'):
+                        yield entry.name[:-len('.info')]
+
+    def sync(self, file_ids):
+        directories = set()
+        for file_id in file_ids:
+            with self._created_lock:
+                directory = self._created.pop(str(file_id), None)
+            path = self.path(file_id)
+            if directory is not None:
+                directories.add(directory)
+                _fsync_path(self._info_path(path))
+
+            try:
+                fd = self.fds.acquire(path)
+            except FileNotFoundError:
+                continue
+            try:
+                os.fdatasync(fd)
+            finally:
+                self.fds.release(path, fd)
+
+        for directory in directories:
+            _fsync_path(directory)
+
+    def _blob_path(self, root, key):
+        return root / BLOB_DIRECTORY / key[:2] / key
+
+    def deduplicate(self, file_id, key):
+        """
+        Content is kept once per root in a blob file, <root>/blobs/<key[:2]>/<key>, which uploads are hard links to.
+        The link count of the blob is its reference count: the first upload of a content is linked as the blob,
+        later ones are replaced by a link to it once their bytes are found equal, so a key shared by different
+        contents keeps each upload's own data.
+        """
+        path = self.path(file_id)
+        root = next(root for root, _ in self.roots if root in path.parents)
+        blob = self._blob_path(root, key)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            try:
+                os.link(path, blob)
+                return False
+            except FileExistsError:
+                pass
+            except FileNotFoundError:
+                # nothing was written to an empty upload.
+                return False
+
+            linked = path.with_name(path.name + '.dedup')
+            try:
+                os.link(blob, linked)
+            except FileNotFoundError:
+                # released meanwhile, this upload becomes the blob.
+                continue
+            if not filecmp.cmp(path, linked, shallow=False):
+                linked.unlink()
+                return False
+            size = path.stat().st_size
+            os.replace(linked, path)
+            # a descriptor still open keeps the replaced file until it is closed.
+            self.fds.discard(path)
+            self.deduplicated_uploads += 1
+            self.deduplicated_bytes += size
+            return True
+
+    def release_blob(self, key):
+        for root, _ in self.roots:
+            blob = self._blob_path(root, key)
+            try:
+                if blob.stat().st_nlink == 1:
+                    blob.unlink()
+            except FileNotFoundError:
+                pass
+
+    def delete(self, file_id):
+        path = self.path(file_id)
+        self.fds.close(path)
+        self._placed.pop(str(file_id), None)
+        with self._created_lock:
+            self._created.pop(str(file_id), None)
+        try:
+            stat = path.stat()
+            path.unlink()
+            # data shared with other uploads is not freed.
+            size = stat.st_size if stat.st_nlink == 1 else 0
+        except FileNotFoundError:
+            size = 0
+        # the sidecar goes last, an upload is recovered from it as long as the data may be there.
+        try:
+            self._info_path(path).unlink()
+        except FileNotFoundError:
+            pass
+
+        return size
+
+    def close(self, file_id):
+        self.fds.close(self.path(file_id))
+
+    def concatenate(self, source_ids, target_id, progress=None, step_size=16 * 1024 * 1024):
+        target = self.path(target_id)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        concatenate([self.path(source_id) for source_id in source_ids], target, progress, step_size)
+
+
+class MockObjectStorage(Storage):
+    """
+    Local stand-in for S3 compatible object storage.
+    Like a multipart upload, every write stores an immutable part object under <directory>/<upload id>/,
+    and reads are served by ranges over the parts. Writing before the end drops the parts after the offset.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self._parts = {}
+        self._lock = threading.Lock()
+
+    def _load_parts(self, file_id):
+        """
+        Returns [(part path, start, size)] of the upload in order.
+        """
+        parts = self._parts.get(file_id)
+        if parts is None:
+            parts = []
+            directory = self.directory / file_id
+            if directory.exists():
+                start = 0
+                for path in sorted(directory.iterdir()):
+                    size = path.stat().st_size
+                    parts.append((path, start, size))
+                    start += size
+            self._parts[file_id] = parts
+
+        return parts
+
+    def write(self, file_id, offset, data):
+        file_id = str(file_id)
+        with self._lock:
+            parts = self._load_parts(file_id)
+            self._truncate(parts, offset)
+            end = parts[-1][1] + parts[-1][2] if parts else 0
+            if offset != end:
+                raise ValueError(f'object storage can not write at {offset}, the upload ends at {end}')
+
+            number = int(parts[-1][0].name) + 1 if parts else 0
+            path = self.directory / file_id / f'{number:010d}'
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+            parts.append((path, offset, len(data)))
+
+        return offset + len(data)
+
+    @staticmethod
+    def _truncate(parts, offset):
+        while parts and parts[-1][1] >= offset:
+            parts.pop()[0].unlink()
+
+        if parts and parts[-1][1] + parts[-1][2] > offset:
+            path, start, size = parts[-1]
+            path.write_bytes(path.read_bytes()[:offset - start])
+            parts[-1] = (path, start, offset - start)
+
+    def sync(self, file_ids):
+        # objects are durable once written, as with object stores.
+        pass
+
+    def deduplicate(self, file_id, key):
+        # parts are not shared between uploads.
+        return False
+
+    def release_blob(self, key):
+        pass
+
+    def truncate(self, file_id, size):
+        with self._lock:
+            self._truncate(self._load_parts(str(file_id)), size)
+
+    def stat(self, file_id):
+        with self._lock:
+            parts = list(self._load_parts(str(file_id)))
+        if not parts:
+            return None
+        path, start, size = parts[-1]
+        return start + size, path.stat().st_mtime
+
+    def write_info(self, file_id, info):
+        path = self.directory / f'{file_id}.info'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(info)
+
+    def read_info(self, file_id):
+        try:
+            return (self.directory / f'{file_id}.info').read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def info_ids(self):
+        if not self.directory.exists():
+            return
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.info'):
+                yield entry.name[:-len('.info')]
+
+    def read(self, file_id, offset, size):
+        with self._lock:
+            parts = list(self._load_parts(str(file_id)))
+        if not parts:
+            raise FileNotFoundError(f'upload {file_id} has no data')
+
+        pieces = []
+        for path, start, part_size in parts:
+            if start + part_size <= offset or size <= 0:
+                continue
+            with open(path, 'rb') as part:
+                part.seek(offset - start)
+                data = part.read(min(size, start + part_size - offset))
+            pieces.append(data)
+            offset += len(data)
+            size -= len(data)
+
+        return b''.join(pieces)
+
+    def delete(self, file_id):
+        file_id = str(file_id)
+        with self._lock:
+            parts = self._load_parts(file_id)
+            self._parts.pop(file_id, None)
+            size = sum(part_size for _, _, part_size in parts)
+            shutil.rmtree(self.directory / file_id, ignore_errors=True)
+            try:
+                (self.directory / f'{file_id}.info').unlink()
+            except FileNotFoundError:
+                pass
+
+        return size
+
+
+def _fsync_path(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def parse_roots(roots):
+    """
+    Parse 'directory[:weight],directory[:weight]' to a list of (directory, weight).
+    """
+    parsed = []
+    for root in roots.split(','):
+        directory, _, weight = root.strip().partition(':')
+        parsed.append((directory, float(weight) if weight else 1.0))
+    return parsed
+
+
+def create_storage(kind, roots, placement='weight', shard_depth=2, fd_cache_size=256, fd_idle_timeout=30.0):
+    if kind == 'local':
+        return LocalStorage(parse_roots(roots), placement, shard_depth,
+                            fd_cache_size=fd_cache_size, fd_idle_timeout=fd_idle_timeout)
+    if kind == 'object':
+        return MockObjectStorage(parse_roots(roots)[0][0])
+
+    raise ValueError(f'unknown storage: {kind}')
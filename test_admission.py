@@ -0,0 +1,50 @@
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def test_requests_are_admitted_within_limits_and_released():
+    admission = AdmissionController(max_requests=2, max_bytes=100, max_client_requests=2)
+
+    first = admission.admit('a', 40)
+    second = admission.admit('b', 60)
+    assert (admission.requests, admission.bytes, admission.clients) == (2, 100, {'a': 1, 'b': 1})
+
+    admission.release(first)
+    admission.release(second)
+    assert (admission.requests, admission.bytes, admission.clients) == (0, 0, {})
+
+
+@pytest.mark.parametrize('limits, requests, reason', [
+    ({'max_client_requests': 1}, [('a', 1)], 'client'),
+    ({'max_requests': 1}, [('b', 1)], 'requests'),
+    ({'max_bytes': 100}, [('b', 60)], 'bytes'),
+])
+def test_request_over_a_limit_is_rejected(limits, requests, reason):
+    admission = AdmissionController(**limits)
+    for client, size in requests:
+        admission.admit(client, size)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.admit('a', 50)
+
+    assert rejected.value.reason == reason
+    assert admission.requests == len(requests)
+
+
+def test_body_over_max_bytes_is_admitted_alone():
+    admission = AdmissionController(max_bytes=100)
+
+    ticket = admission.admit('a', 1000)
+    with pytest.raises(AdmissionRejected):
+        admission.admit('b', 1)
+    admission.release(ticket)
+
+    admission.admit('b', 1)
+
+
+def test_zero_does_not_limit():
+    admission = AdmissionController()
+
+    for _ in range(1000):
+        admission.admit('a', 1024 ** 3)
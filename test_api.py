@@ -1,11 +1,21 @@
+import asyncio
 from pathlib import Path
 import uuid
 import re
 import base64
+import hashlib
+import json
+import time
+import zlib
+from email.utils import parsedate_to_datetime
 
 
 import pytest
+import requests
 import api as service
+from checksum import RunningDigests
+from database import create_backend, Database, SQLiteBackend
+from shaping import BandwidthShaper
 
 
 @pytest.fixture
@@ -185,6 +195,60 @@ def test_creation_extension_response_413_when_upload_length_exceeds_max_size(api
     assert resp.status_code == 413
 
 
+def test_creation_with_upload_writes_body_of_creation_request(api):
+    """
+    Creation with upload writes the body of POST request and responds Upload-Offset.
+    """
+    data = b'abcd\nefgh\n'
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Length': '20',
+        'Tus-Resumable': '1.0.0'
+    }
+    resp = api.requests.post('/files', headers=headers, data=data)
+
+    assert resp.status_code == 201
+    assert resp.headers['Upload-Offset'] == '10'
+    location = resp.headers['Location']
+    assert api.requests.head(location).headers['Upload-Offset'] == '10'
+
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': '10',
+        'Tus-Resumable': '1.0.0'
+    }
+    api.requests.patch(location, headers=headers, data=data)
+    assert api.requests.get(location).content == data * 2
+
+
+def test_creation_with_upload_responds_location_when_body_is_rejected(api):
+    """
+    The upload is created when its first chunk is rejected, so it can be resumed from its Location.
+    """
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Length': '10',
+        'Upload-Checksum': f'sha1 {base64.b64encode(hashlib.sha1(b"other").digest()).decode()}',
+        'Tus-Resumable': '1.0.0'
+    }
+    resp = api.requests.post('/files', headers=headers, data=b'abcd\nefgh\n')
+
+    assert resp.status_code == 460
+    assert api.requests.head(resp.headers['Location']).headers['Upload-Offset'] == '0'
+
+
+def test_creation_with_upload_response_400_for_final_upload(api):
+    partial = request_upload(b'abcd', api, upload_concat='partial')
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Concat': f'final;{partial}',
+        'Tus-Resumable': '1.0.0'
+    }
+    resp = api.requests.post('/files', headers=headers, data=b'efgh')
+
+    assert resp.status_code == 400
+
+
 def test_head_request_response_upload_offset_when_resource_exists(api):
     """
     HEAD request responses Upload-Offset header, if resource exists.
@@ -203,6 +267,82 @@ def test_head_request_response_upload_offset_when_resource_exists(api):
     assert resp.headers['Cache-Control'] == 'no-store'
 
 
+def test_upload_is_resumed_after_restart(api, monkeypatch):
+    """
+    An upload of an earlier process is recovered from its sidecar on first access.
+    """
+    resource_path = request_creation(10, api).headers['Location']
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': '0',
+        'Tus-Resumable': '1.0.0'
+    }
+    api.requests.patch(resource_path, headers=headers, data=b'abcd\n')
+    rejected = api.requests.patch(resource_path, data=b'efgh\n', headers={
+        **headers,
+        'Upload-Offset': '5',
+        'Upload-Checksum': f'sha1 {base64.b64encode(hashlib.sha1(b"other").digest()).decode()}'
+    })
+    assert rejected.status_code == 460
+    monkeypatch.setattr(service, 'db', Database(create_backend('compact'), service.journal))
+    monkeypatch.setattr(service.journal, 'complete', False)
+
+    resp = api.requests.head(resource_path)
+
+    assert resp.status_code == 200
+    assert resp.headers['Upload-Offset'] == '5'
+    assert resp.headers['Upload-Length'] == '10'
+
+    resp = api.requests.patch(resource_path, headers={**headers, 'Upload-Offset': '5'}, data=b'efgh\n')
+
+    assert resp.status_code == 204
+    assert resp.headers['Upload-Offset'] == '10'
+
+
+def record_calls(calls, method):
+    """
+    Wrap method to append its name to calls, with whether it was called on the event loop or in the executor.
+    """
+    def call(*args, **kwargs):
+        try:
+            asyncio.get_running_loop()
+            calls.append((method.__name__, 'loop'))
+        except RuntimeError:
+            calls.append((method.__name__, 'executor'))
+        return method(*args, **kwargs)
+    return call
+
+
+def test_sidecars_are_not_read_or_written_on_the_event_loop(api, monkeypatch):
+    """
+    Sidecars are written at creation and read on recovery in the file I/O executor.
+    """
+    calls = []
+    monkeypatch.setattr(service.upload_storage, 'write_info', record_calls(calls, service.upload_storage.write_info))
+    monkeypatch.setattr(service.upload_storage, 'read_info', record_calls(calls, service.upload_storage.read_info))
+    resource_path = request_creation(10, api).headers['Location']
+    monkeypatch.setattr(service, 'db', Database(create_backend('compact'), service.journal))
+    monkeypatch.setattr(service.journal, 'complete', False)
+
+    assert api.requests.head(resource_path).status_code == 200
+    assert calls == [('write_info', 'executor'), ('read_info', 'executor')]
+
+
+def test_sqlite_is_not_written_on_the_event_loop(api, monkeypatch, tmp_path):
+    """
+    With SQLite, whose writes wait for other processes, uploads are created and patched in the file I/O executor.
+    """
+    backend = SQLiteBackend(str(tmp_path / 'tus.sqlite3'))
+    calls = []
+    for name in ['insert', 'compare_and_set_offset']:
+        monkeypatch.setattr(backend, name, record_calls(calls, getattr(backend, name)))
+    monkeypatch.setattr(service, 'db', Database(backend))
+
+    request_upload(b'abcd\n', api)
+
+    assert calls == [('insert', 'executor'), ('compare_and_set_offset', 'executor')]
+
+
 def test_head_request_response_404_when_resource_does_not_exists(api):
     """
     HEAD request responses 404 Not found, if resource does not exists.
@@ -266,6 +406,255 @@ def test_patch_request_response_400_when_upload_length_exceeded(api):
             assert resp.status_code == 400
 
 
+def test_patch_request_writes_streamed_body_in_bounded_pieces(api, monkeypatch):
+    """
+    PATCH request writes streamed body in pieces no larger than the configured buffer.
+    """
+    monkeypatch.setattr(service.config, 'PATCH_BUFFER_SIZE', 3)
+    data = b'abcd\nefgh\nijkl\nmnop\n'
+    resp = request_creation(len(data), api)
+    resource_path = resp.headers['Location']
+
+    def body():
+        for i in range(0, 4):
+            yield data[i*5:(i+1)*5]
+
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': '0',
+        'Tus-Resumable': '1.0.0'
+    }
+    resp = api.requests.patch(resource_path, headers=headers, data=body())
+
+    assert resp.status_code == 204
+    assert resp.headers['Upload-Offset'] == str(len(data))
+
+    resp = api.requests.get(resource_path)
+
+    assert resp.content == data
+
+
+@pytest.mark.parametrize('durability', ['none', 'chunk', 'group'])
+def test_patch_request_keeps_received_bytes_when_upload_length_exceeded_while_streaming(api, monkeypatch, durability):
+    """
+    PATCH request keeps bytes received before upload length was exceeded.
+    """
+    monkeypatch.setattr(service.config, 'PATCH_BUFFER_SIZE', 5)
+    monkeypatch.setattr(service.config, 'DURABILITY', durability)
+    data = b'abcd\nefgh\nijkl\nmnop\n'
+    resp = request_creation(12, api)
+    resource_path = resp.headers['Location']
+
+    def body():
+        for i in range(0, 4):
+            yield data[i*5:(i+1)*5]
+
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': '0',
+        'Tus-Resumable': '1.0.0'
+    }
+    resp = api.requests.patch(resource_path, headers=headers, data=body())
+
+    assert resp.status_code == 400
+
+    resp = api.requests.head(resource_path)
+
+    assert resp.headers['Upload-Offset'] == '10'
+
+
+@pytest.mark.parametrize('durability', ['chunk', 'group'])
+def test_patch_request_acknowledges_offset_once_data_is_durable(api, monkeypatch, durability):
+    """
+    With durability 'chunk' or 'group', the offset moves only after the written data was synced.
+    """
+    monkeypatch.setattr(service.config, 'DURABILITY', durability)
+    resource_path = request_creation(10, api).headers['Location']
+    file_id = uuid.UUID(resource_path.split('/')[-1])
+    synced_offsets = []
+    sync = service.upload_storage.sync
+
+    def recording_sync(file_ids):
+        sync(file_ids)
+        if file_id in file_ids:
+            synced_offsets.append(service.db.get_by_id(file_id).upload_offset)
+
+    monkeypatch.setattr(service.upload_storage, 'sync', recording_sync)
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': '0',
+        'Tus-Resumable': '1.0.0'
+    }
+    resp = api.requests.patch(resource_path, headers=headers, data=b'abcd\nefgh\n')
+
+    assert resp.status_code == 204
+    assert resp.headers['Upload-Offset'] == '10'
+    assert synced_offsets == [0]
+
+
+@pytest.mark.parametrize('algorithm, digest', [
+    ('sha1', lambda data: hashlib.sha1(data).digest()),
+    ('md5', lambda data: hashlib.md5(data).digest()),
+    ('crc32', lambda data: zlib.crc32(data).to_bytes(4, 'big')),
+])
+def test_patch_request_accepts_chunk_matching_upload_checksum(api, algorithm, digest):
+    """
+    PATCH request applies the chunk, when it matches Upload-Checksum.
+    """
+    data = b'abcd\nefgh\nijkl\nmnop\n'
+    resource_path = request_creation(len(data), api).headers['Location']
+
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': '0',
+        'Upload-Checksum': f'{algorithm} {base64.b64encode(digest(data)).decode()}',
+        'Tus-Resumable': '1.0.0'
+    }
+    resp = api.requests.patch(resource_path, headers=headers, data=data)
+
+    assert resp.status_code == 204
+    assert resp.headers['Upload-Offset'] == str(len(data))
+
+
+def test_patch_request_responds_460_and_discards_chunk_when_checksum_mismatches(api):
+    """
+    PATCH request responds 460 and keeps the offset, when the chunk does not match Upload-Checksum.
+    """
+    data = b'abcd\nefgh\nijkl\nmnop\n'
+    resource_path = request_creation(len(data), api).headers['Location']
+
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': '0',
+        'Upload-Checksum': f'sha1 {base64.b64encode(hashlib.sha1(b"other").digest()).decode()}',
+        'Tus-Resumable': '1.0.0'
+    }
+    resp = api.requests.patch(resource_path, headers=headers, data=data)
+
+    assert resp.status_code == 460
+    assert api.requests.head(resource_path).headers['Upload-Offset'] == '0'
+
+
+@pytest.mark.parametrize('checksum', ['sha256 YWJj', 'sha1 not-base64!', 'sha1'])
+def test_patch_request_responds_400_when_upload_checksum_is_not_supported(api, checksum):
+    """
+    PATCH request responds 400, when Upload-Checksum is invalid or uses an unsupported algorithm.
+    """
+    resource_path = request_creation(5, api).headers['Location']
+
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': '0',
+        'Upload-Checksum': checksum,
+        'Tus-Resumable': '1.0.0'
+    }
+    resp = api.requests.patch(resource_path, headers=headers, data=b'abcd\n')
+
+    assert resp.status_code == 400
+
+
+def test_get_request_responds_digest_of_finished_upload(api):
+    """
+    GET responds the whole-file digest computed while the upload was written.
+    """
+    data = b'abcd\nefgh\nijkl\nmnop\n'
+    resource_path = request_creation(len(data), api).headers['Location']
+
+    for i in range(0, 4):
+        headers = {
+            'Content-Type': 'application/offset+octet-stream',
+            'Upload-Offset': f'{i * 5}',
+            'Tus-Resumable': '1.0.0'
+        }
+        if i == 2:
+            headers['Upload-Checksum'] = f'md5 {base64.b64encode(hashlib.md5(data[i*5:(i+1)*5]).digest()).decode()}'
+        api.requests.patch(resource_path, headers=headers, data=data[i*5:(i+1)*5])
+
+    resp = api.requests.get(resource_path)
+
+    assert resp.headers['Digest'] == f'SHA-256={base64.b64encode(hashlib.sha256(data).digest()).decode()}'
+
+
+@pytest.mark.parametrize('algorithm', ['sha384', 'crc32'])
+def test_get_request_leaves_out_digest_without_a_name_for_its_algorithm(api, monkeypatch, algorithm):
+    """
+    A whole-file digest of an algorithm Digest has no name for is kept, but not sent.
+    """
+    monkeypatch.setattr(service.config, 'UPLOAD_DIGEST', algorithm)
+    monkeypatch.setattr(service, 'running_digests', RunningDigests(algorithm))
+    resource_path = request_upload(b'abcd\n', api)
+
+    resp = api.requests.get(resource_path)
+
+    assert resp.status_code == 200
+    assert resp.content == b'abcd\n'
+    assert 'Digest' not in resp.headers
+    assert service.db.get_by_id(uuid.UUID(resource_path.split('/')[-1])).upload_digest is not None
+
+
+def request_deferred_creation(api):
+    headers = {
+        'Upload-Defer-Length': '1',
+        'Tus-Resumable': '1.0.0'
+    }
+    return api.requests.post('/files', headers=headers).headers['Location']
+
+
+def test_patch_request_resolves_deferred_upload_length(api):
+    """
+    Upload-Length of PATCH request sets the length of deferred upload, which is enforced from then on.
+    """
+    location = request_deferred_creation(api)
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': '0',
+        'Tus-Resumable': '1.0.0'
+    }
+    resp = api.requests.patch(location, headers=headers, data=b'abcd\n')
+    assert resp.status_code == 204
+    assert api.requests.head(location).headers['Upload-Defer-Length'] == '1'
+
+    resp = api.requests.patch(location, headers={**headers, 'Upload-Offset': '5', 'Upload-Length': '10'},
+                              data=b'efgh\n')
+    assert resp.status_code == 204
+
+    head = api.requests.head(location)
+    assert head.headers['Upload-Length'] == '10'
+    assert head.headers['Upload-Offset'] == '10'
+    assert 'Upload-Defer-Length' not in head.headers
+    assert api.requests.get(location).content == b'abcd\nefgh\n'
+
+    resp = api.requests.patch(location, headers={**headers, 'Upload-Offset': '10'}, data=b'ijkl\n')
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize('upload_length, status_code', [('3', 400), ('x', 400), (str(1024 ** 3 + 1), 413)])
+def test_patch_request_rejects_invalid_deferred_upload_length(api, upload_length, status_code):
+    location = request_deferred_creation(api)
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Tus-Resumable': '1.0.0'
+    }
+    api.requests.patch(location, headers={**headers, 'Upload-Offset': '0'}, data=b'abcd\n')
+
+    resp = api.requests.patch(location, headers={**headers, 'Upload-Offset': '5', 'Upload-Length': upload_length})
+
+    assert resp.status_code == status_code
+    assert api.requests.head(location).headers['Upload-Defer-Length'] == '1'
+
+
+def test_patch_request_response_400_when_upload_length_changes(api):
+    location = request_creation(10, api).headers['Location']
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': '0',
+        'Upload-Length': '20',
+        'Tus-Resumable': '1.0.0'
+    }
+
+    assert api.requests.patch(location, headers=headers, data=b'abcd\n').status_code == 400
+
+
 def test_patch_request_response_404_when_resource_does_not_exists(api):
     """
     PATCH request responses 404 when specified resource does not exists.
@@ -285,6 +674,77 @@ def test_patch_request_response_404_when_resource_does_not_exists(api):
     assert resp.status_code == 404
 
 
+def test_creation_and_patch_respond_upload_expires(api, monkeypatch):
+    """
+    Creation and PATCH of an unfinished upload respond when the upload expires.
+    """
+    monkeypatch.setattr(service.config, 'UPLOAD_EXPIRATION', 3600)
+    resp = request_creation(10, api)
+
+    expires = parsedate_to_datetime(resp.headers['Upload-Expires']).timestamp()
+    assert abs(expires - (time.time() + 3600)) < 5
+
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': '0',
+        'Tus-Resumable': '1.0.0'
+    }
+    resource_path = resp.headers['Location']
+    resp = api.requests.patch(resource_path, headers=headers, data=b'abcd\n')
+
+    assert resp.headers['Upload-Expires'] is not None
+
+    headers['Upload-Offset'] = '5'
+    resp = api.requests.patch(resource_path, headers=headers, data=b'efgh\n')
+
+    assert resp.headers.get('Upload-Expires') is None
+
+
+def test_expired_upload_is_not_found(api, monkeypatch):
+    """
+    Expired upload responds 404 before the reaper removes it.
+    """
+    monkeypatch.setattr(service.config, 'UPLOAD_EXPIRATION', 60)
+    resource_path = request_creation(10, api).headers['Location']
+    now = time.time()
+    monkeypatch.setattr(service.time, 'time', lambda: now + 61)
+
+    resp = api.requests.head(resource_path)
+
+    assert resp.status_code == 404
+
+
+def test_delete_request_terminates_upload(api):
+    """
+    DELETE request terminates the upload and its data is removed in the background.
+    """
+    resource_path = request_upload(b'abcd\n', api)
+    file_id = uuid.UUID(Path(resource_path).name)
+
+    resp = api.requests.delete(resource_path)
+
+    assert resp.status_code == 204
+    assert resp.headers['Tus-Resumable'] == '1.0.0'
+    assert api.requests.head(resource_path).status_code == 404
+
+    deadline = time.time() + 5
+    while service.upload_deleter.is_pending(file_id) and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert service.db.get_by_id(file_id) is None
+    with pytest.raises(FileNotFoundError):
+        service.upload_storage.read(file_id, 0, 10)
+
+
+def test_delete_request_responds_404_when_resource_does_not_exists(api):
+    """
+    DELETE request responds 404, when the upload does not exist.
+    """
+    resp = api.requests.delete(f'/files/{uuid.uuid4()}')
+
+    assert resp.status_code == 404
+
+
 def test_options_request_response_servers_current_configuration_about_tus(api):
     """
     OPTIONS request responses Servers current configuration about Tus.
@@ -295,7 +755,10 @@ def test_options_request_response_servers_current_configuration_about_tus(api):
     assert resp.headers['Tus-Resumable'] == '1.0.0'
     assert resp.headers['Tus-Version'] == '1.0.0'
     assert resp.headers['Tus-Max-Size'] == str(1024 ** 3)
-    assert resp.headers['Tus-Extension'] == 'creation,creation-defer-length'
+    assert resp.headers['Tus-Extension'] == \
+        'creation,creation-defer-length,creation-with-upload,concatenation,concatenation-unfinished,checksum,' \
+        'expiration,termination'
+    assert resp.headers['Tus-Checksum-Algorithm'] == 'sha1,md5,crc32'
 
 
 def test_get_request_response_uploaded_file(api):
@@ -319,12 +782,392 @@ def test_get_request_response_uploaded_file(api):
     assert resp.content == data
 
 
-def request_creation(upload_length, api):
+def test_get_request_streams_uploaded_file_in_chunks(api, monkeypatch):
+    """
+    GET streams uploaded file in chunks of the configured size.
+    """
+    monkeypatch.setattr(service.config, 'DOWNLOAD_CHUNK_SIZE', 3)
+    data = b'abcd\nefgh\nijkl\nmnop\n'
+    resource_path = request_upload(data, api)
+
+    resp = api.requests.get(resource_path)
+
+    assert resp.status_code == 200
+    assert resp.content == data
+    assert resp.headers['Content-Length'] == str(len(data))
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+    assert resp.headers.get('Content-Encoding') is None
+
+
+@pytest.mark.parametrize('data, range_header, status_code, content_range, content', [
+    (b'abcd\nefgh\nijkl\nmnop\n', 'bytes=5-9', 206, 'bytes 5-9/20', b'efgh\n'),
+    (b'abcd\nefgh\nijkl\nmnop\n', 'bytes=15-', 206, 'bytes 15-19/20', b'mnop\n'),
+    (b'abcd\nefgh\nijkl\nmnop\n', 'bytes=-3', 206, 'bytes 17-19/20', b'op\n'),
+    (b'abcd\nefgh\nijkl\nmnop\n', 'bytes=10-100', 206, 'bytes 10-19/20', b'ijkl\nmnop\n'),
+    (b'abcd\nefgh\nijkl\nmnop\n', 'bytes=20-', 416, 'bytes */20', b''),
+    (b'abcd\nefgh\nijkl\nmnop\n', 'bytes=0-1,5-6', 200, None, b'abcd\nefgh\nijkl\nmnop\n'),
+    (b'abcd\nefgh\nijkl\nmnop\n', 'items=0-1', 200, None, b'abcd\nefgh\nijkl\nmnop\n'),
+    (b'', 'bytes=-5', 416, 'bytes */0', b''),
+    (b'', 'bytes=0-', 416, 'bytes */0', b''),
+])
+def test_get_request_responds_requested_range(api, data, range_header, status_code, content_range, content):
+    """
+    GET responds the requested byte range of uploaded file.
+    """
+    resource_path = request_upload(data, api)
+
+    resp = api.requests.get(resource_path, headers={'Range': range_header})
+
+    assert resp.status_code == status_code
+    assert resp.headers.get('Content-Range') == content_range
+    assert resp.content == content
+
+
+def test_get_request_ignores_range_when_if_range_does_not_match(api):
+    """
+    GET responds whole file when If-Range does not match current ETag.
+    """
+    data = b'abcd\nefgh\nijkl\nmnop\n'
+    resource_path = request_upload(data, api)
+    etag = api.requests.get(resource_path).headers['ETag']
+
+    resp = api.requests.get(resource_path, headers={'Range': 'bytes=5-9', 'If-Range': etag})
+
+    assert resp.status_code == 206
+    assert resp.content == b'efgh\n'
+
+    resp = api.requests.get(resource_path, headers={'Range': 'bytes=5-9', 'If-Range': '"stale"'})
+
+    assert resp.status_code == 200
+    assert resp.content == data
+
+
+def test_concatenation_accepts_final_upload_before_partial_uploads_are_finished(api):
+    """
+    Upload-Concat final can be created before its partial uploads are finished
+    and is served from the partial uploads once they are.
+    """
+    data = [b'abcd\nefgh\n', b'ijkl\nmnop\n']
+    finished = request_upload(data[0], api, upload_concat='partial')
+    unfinished = request_creation(len(data[1]), api, upload_concat='partial').headers['Location']
+
+    headers = {
+        'Upload-Concat': f'final;{finished} {unfinished}',
+        'Tus-Resumable': '1.0.0'
+    }
+    resp = api.requests.post('/files', headers=headers)
+
+    assert resp.status_code == 201
+    final = resp.headers['Location']
+
+    resp = api.requests.head(final)
+
+    assert resp.headers['Upload-Length'] == '20'
+    assert resp.headers.get('Upload-Offset') is None
+    assert api.requests.get(final).status_code == 409
+
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': '0',
+        'Tus-Resumable': '1.0.0'
+    }
+    assert api.requests.patch(final, headers=headers, data=data[1]).status_code == 403
+    api.requests.patch(unfinished, headers=headers, data=data[1])
+
+    resp = api.requests.head(final)
+
+    assert resp.headers['Upload-Offset'] == '20'
+
+    resp = api.requests.get(final, headers={'Range': 'bytes=8-12'})
+
+    assert resp.status_code == 206
+    assert resp.content == b''.join(data)[8:13]
+
+
+def request_upload(data, api, upload_concat=None):
+    resp = request_creation(len(data), api, upload_concat)
+    resource_path = resp.headers['Location']
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': '0',
+        'Tus-Resumable': '1.0.0'
+    }
+    api.requests.patch(resource_path, headers=headers, data=data)
+    return resource_path
+
+
+def test_finished_uploads_of_the_same_content_share_one_copy(api, monkeypatch):
+    """
+    With dedup, a finished upload with the content of an earlier one is a link to the same file.
+    """
+    monkeypatch.setattr(service.config, 'DEDUP', True)
+    data = uuid.uuid4().bytes
+    paths = [request_upload(data, api) for _ in range(2)]
+    files = [service.upload_storage.path(uuid.UUID(path.split('/')[-1])) for path in paths]
+
+    assert files[0].stat().st_ino == files[1].stat().st_ino
+
+    api.requests.delete(paths[0], headers={'Tus-Resumable': '1.0.0'})
+    service.upload_deleter.flush()
+
+    assert api.requests.get(paths[1]).content == data
+    # the remaining upload and the blob.
+    assert files[1].stat().st_nlink == 2
+
+
+@pytest.mark.parametrize('concat_mode', ['virtual', 'copy'])
+def test_concatenation_creates_final_upload_from_partial_uploads(api, monkeypatch, concat_mode):
+    """
+    Upload-Concat final creates an upload containing the partial uploads in order.
+    """
+    monkeypatch.setattr(service.config, 'CONCAT_MODE', concat_mode)
+    data = [b'abcd\nefgh\n', b'ijkl\nmnop\n']
+    partials = [request_upload(d, api, upload_concat='partial') for d in data]
+
+    headers = {
+        'Upload-Concat': 'final;' + ' '.join(partials),
+        'Tus-Resumable': '1.0.0'
+    }
+    resp = api.requests.post('/files', headers=headers)
+
+    assert resp.status_code == 201
+    resource_path = resp.headers['Location']
+
+    resp = api.requests.head(resource_path)
+
+    assert resp.headers['Upload-Offset'] == '20'
+    assert resp.headers['Upload-Length'] == '20'
+    assert resp.headers['Upload-Concat'] == headers['Upload-Concat']
+
+    resp = api.requests.get(resource_path)
+
+    assert resp.content == b''.join(data)
+
+
+def test_concatenation_fills_large_final_upload_in_background(api, monkeypatch):
+    """
+    Upload-Concat final responds at once for large finals and fills them in the background.
+    """
+    monkeypatch.setattr(service.config, 'CONCAT_MODE', 'copy')
+    monkeypatch.setattr(service.config, 'CONCAT_BACKGROUND_SIZE', 0)
+    data = [b'abcd\nefgh\n', b'ijkl\nmnop\n']
+    partials = [request_upload(d, api, upload_concat='partial') for d in data]
+
+    headers = {
+        'Upload-Concat': 'final;' + ' '.join(partials),
+        'Tus-Resumable': '1.0.0'
+    }
+    resp = api.requests.post('/files', headers=headers)
+
+    assert resp.status_code == 201
+    api.background.results[-1].result()
+
+    resp = api.requests.get(resp.headers['Location'])
+
+    assert resp.content == b''.join(data)
+
+
+@pytest.mark.parametrize('partial_headers', [
+    {'Upload-Concat': 'partial'},
+    {},
+])
+def test_concatenation_responds_400_when_upload_is_not_finished_partial(api, monkeypatch, partial_headers):
+    """
+    Upload-Concat final in copy mode responds 400, when any upload is not a finished partial upload.
+    """
+    monkeypatch.setattr(service.config, 'CONCAT_MODE', 'copy')
+    finished = request_upload(b'abcd\n', api, upload_concat='partial')
+    headers = {
+        'Upload-Length': '100',
+        'Tus-Resumable': '1.0.0',
+        **partial_headers
+    }
+    unfinished = api.requests.post('/files', headers=headers).headers['Location']
+
+    headers = {
+        'Upload-Concat': f'final;{finished} {unfinished}',
+        'Tus-Resumable': '1.0.0'
+    }
+    resp = api.requests.post('/files', headers=headers)
+
+    assert resp.status_code == 400
+
+
+def test_batch_creation_creates_uploads_in_order(api):
+    """
+    Batch creation creates every upload of the request and responds their Locations in order.
+    """
+    uploads = [
+        {'length': 10},
+        {'defer_length': True, 'metadata': f'filename {base64_encode("world.txt")}'},
+        {'length': 5, 'concat': 'partial'}
+    ]
+    resp = api.requests.post('/files/batch', json={'uploads': uploads}, headers={'Tus-Resumable': '1.0.0'})
+
+    assert resp.status_code == 201
+    locations = resp.json()['locations']
+    assert len(locations) == 3
+
+    heads = [api.requests.head(location) for location in locations]
+    assert [head.status_code for head in heads] == [200, 200, 200]
+    assert heads[0].headers['Upload-Length'] == '10'
+    assert heads[1].headers['Upload-Defer-Length'] == '1'
+    assert heads[1].headers['Upload-Metadata'] == f'filename {base64_encode("world.txt")}'
+    assert heads[2].headers['Upload-Concat'] == 'partial'
+
+
+@pytest.mark.parametrize('uploads, status_code', [
+    ([{'length': 10}, {'length': -1}], 400),
+    ([{'length': 10}, {}], 400),
+    ([{'length': 10, 'defer_length': True}], 400),
+    ([{'length': 10, 'concat': 'final;/files/x'}], 400),
+    ([{'length': 10, 'metadata': 5}], 400),
+    ([], 400),
+    ([{'length': 1024 ** 3 + 1}], 413),
+])
+def test_batch_creation_creates_nothing_when_an_upload_is_invalid(api, uploads, status_code):
+    """
+    Batch creation responds 400 or 413 for the whole batch when one of its uploads is invalid.
+    """
+    count = service.db.count()
+
+    resp = api.requests.post('/files/batch', json={'uploads': uploads}, headers={'Tus-Resumable': '1.0.0'})
+
+    assert resp.status_code == status_code
+    assert service.db.count() == count
+
+
+def test_batch_creation_response_413_when_batch_is_too_large(api, monkeypatch):
+    monkeypatch.setattr(service.config, 'BATCH_MAX_UPLOADS', 2)
+
+    resp = api.requests.post('/files/batch', json={'uploads': [{'length': 1}] * 3}, headers={'Tus-Resumable': '1.0.0'})
+
+    assert resp.status_code == 413
+
+
+def test_batch_creation_response_413_when_body_is_too_large(api, monkeypatch):
+    """
+    A batch body over the limit is refused from its Content-Length, or once the limit is read without one.
+    """
+    monkeypatch.setattr(service.config, 'BATCH_MAX_BODY_BYTES', 100)
+    monkeypatch.setattr(service.config, 'PATCH_BUFFER_SIZE', 16)
+    body = json.dumps({'uploads': [{'length': 1}] * 20}).encode()
+    count = service.db.count()
+
+    sized = api.requests.post('/files/batch', data=body, headers={'Tus-Resumable': '1.0.0'})
+    unsized = api.requests.prepare_request(requests.Request('POST', 'http://;/files/batch', data=body,
+                                                            headers={'Tus-Resumable': '1.0.0'}))
+    del unsized.headers['Content-Length']
+    unsized = api.requests.send(unsized)
+
+    assert sized.status_code == 413
+    assert unsized.status_code == 413
+    assert service.db.count() == count
+
+
+def test_patch_request_response_429_when_client_has_too_many_requests_in_flight(api, monkeypatch):
+    """
+    Upload requests over the limit of their client are answered at once with 429 and Retry-After.
+    """
+    resource_path = request_creation(10, api).headers['Location']
+    monkeypatch.setattr(service.admission, 'max_client_requests', 1)
+    monkeypatch.setitem(service.admission.clients, 'testclient', 1)
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': '0',
+        'Tus-Resumable': '1.0.0'
+    }
+
+    resp = api.requests.patch(resource_path, headers=headers, data=b'abcd\n')
+
+    assert resp.status_code == 429
+    assert resp.headers['Retry-After'] == '1'
+    assert resp.headers['Tus-Resumable'] == '1.0.0'
+    assert api.requests.head(resource_path).headers['Upload-Offset'] == '0'
+    assert 'tus_admission_rejected_total{reason="client"}' in api.requests.get('/metrics').text
+
+
+@pytest.mark.parametrize('limit, value', [('max_requests', 'requests'), ('max_bytes', 'bytes')])
+def test_creation_request_response_503_when_server_is_over_a_limit(api, monkeypatch, limit, value):
+    """
+    Upload requests over a limit of the server are answered at once with 503 and Retry-After.
+    """
+    monkeypatch.setattr(service.admission, limit, 10)
+    monkeypatch.setattr(service.admission, value, 10)
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Length': '10',
+        'Tus-Resumable': '1.0.0'
+    }
+
+    resp = api.requests.post('/files', headers=headers, data=b'abcd\n')
+
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After'] == '1'
+    assert resp.headers.get('Location') is None
+
+
+def test_admitted_requests_are_released(api):
+    request_upload(b'abcd\nefgh\n', api)
+
+    assert (service.admission.requests, service.admission.bytes, service.admission.clients) == (0, 0, {})
+
+
+def test_patch_request_body_is_received_at_the_shaped_rate(api, monkeypatch):
+    """
+    With a bandwidth limit, the body is read piece by piece as the rate allows.
+    """
+    monkeypatch.setattr(service.config, 'PATCH_BUFFER_SIZE', 5)
+    monkeypatch.setattr(service, 'shaper', BandwidthShaper(upload_rate=100, burst=5))
+    resource_path = request_creation(10, api).headers['Location']
+    headers = {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': '0',
+        'Tus-Resumable': '1.0.0'
+    }
+
+    resp = api.requests.patch(resource_path, headers=headers, data=b'abcd\nefgh\n')
+
+    assert resp.status_code == 204
+    assert resp.headers['Upload-Offset'] == '10'
+    assert service.shaper.throttled_seconds >= 0.005
+    assert service.shaper.writers == 0
+
+
+def test_metrics_count_requests_and_bytes(api):
+    """
+    /metrics exposes handler latencies and transferred bytes in the Prometheus text format.
+    """
+
+    def sample(text, name):
+        match = re.search(rf'^{re.escape(name)} (\S+)$', text, re.MULTILINE)
+        return float(match.group(1))
+
+    before = api.requests.get('/metrics').text
+    resource_path = request_upload(b'abcd\nefgh\n', api)
+    api.requests.get(resource_path)
+    resp = api.requests.get('/metrics')
+
+    assert resp.status_code == 200
+    assert resp.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    after = resp.text
+    assert sample(after, 'tus_received_bytes_total') - sample(before, 'tus_received_bytes_total') == 10
+    assert sample(after, 'tus_sent_bytes_total') - sample(before, 'tus_sent_bytes_total') == 10
+    assert sample(after, 'tus_handler_seconds_count{handler="patch"}') - \
+        sample(before, 'tus_handler_seconds_count{handler="patch"}') == 1
+    assert sample(after, 'tus_patch_phase_seconds_count{phase="write"}') > 0
+    assert sample(after, 'tus_patches_in_flight') == 0
+    assert sample(after, 'tus_uploads') >= 1
+
+
+def request_creation(upload_length, api, upload_concat=None):
     headers = {
         'Content-Length': '0',
         'Upload-Length': str(upload_length),
         'Tus-Resumable': '1.0.0'
     }
+    if upload_concat is not None:
+        headers['Upload-Concat'] = upload_concat
     return api.requests.post("/files", headers=headers)
 
 
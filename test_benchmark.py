@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+import pytest
+
+import api as service
+import benchmark
+
+
+@pytest.mark.parametrize('scenario', list(benchmark.SCENARIOS))
+def test_scenarios_run_without_errors(scenario):
+    options = benchmark.parse_args(['--scenarios', scenario, '--requests', '4', '--concurrency', '2',
+                                    '--large-chunk', '65536'])
+    client = benchmark.InProcessClient(service.api)
+
+    results = asyncio.run(benchmark.run_benchmark(client, options))
+
+    assert results[scenario]['requests'] == 4
+    assert results[scenario]['errors'] == 0
+    assert results[scenario]['p50_ms'] <= results[scenario]['p99_ms']
+
+
+def test_durability_modes_are_benchmarked_apart(tmp_path):
+    output = tmp_path / 'results.json'
+
+    assert benchmark.main(['--scenarios', 'patch_small', '--requests', '4', '--durability', 'none,group',
+                           '--output', str(output)]) == 0
+
+    results = json.loads(output.read_text())
+    assert set(results['scenarios']) == {'patch_small[none]', 'patch_small[group]'}
+    assert service.config.DURABILITY == 'none'
+
+
+def test_index_benchmark_measures_memory_backends():
+    results = benchmark.benchmark_index(1000)
+
+    assert set(results) == {'memory', 'compact'}
+    assert results['compact']['bytes_per_upload'] < results['memory']['bytes_per_upload']
+
+
+def test_compare_reports_regressions():
+    baseline = {'scenarios': {'head': {'throughput_ops': 1000.0, 'p99_ms': 2.0}}}
+    slower = {'scenarios': {'head': {'throughput_ops': 800.0, 'p99_ms': 2.1}}}
+    faster = {'scenarios': {'head': {'throughput_ops': 1200.0, 'p99_ms': 1.0}, 'download': {}}}
+
+    assert len(benchmark.compare(slower, baseline, 0.1)) == 1
+    assert benchmark.compare(faster, baseline, 0.1) == []
+
+
+def test_compare_reports_scenarios_with_errors():
+    baseline = {'scenarios': {'head': {'throughput_ops': 1000.0, 'p99_ms': 2.0, 'errors': 0}}}
+    failing = {'scenarios': {'head': {'throughput_ops': 1200.0, 'p99_ms': 1.0, 'errors': 3},
+                             'patch': {'throughput_ops': 10.0, 'p99_ms': 1.0, 'errors': 1}}}
+
+    assert benchmark.compare(failing, baseline, 0.1) == ['head: 3 errors, 0 in the baseline',
+                                                         'patch: 1 errors, 0 in the baseline']
+
+
+def test_percentile():
+    values = list(range(100))
+
+    assert benchmark.percentile(values, 0.5) == 50
+    assert benchmark.percentile(values, 0.99) == 99
+    assert benchmark.percentile([], 0.5) == 0.0
@@ -0,0 +1,47 @@
+import base64
+import hashlib
+import zlib
+
+import pytest
+
+from checksum import Crc32, digest_header, parse_checksum, RunningDigests
+
+
+def test_crc32_matches_zlib_in_pieces():
+    crc = Crc32()
+    crc.update(b'abcd\n')
+    copied = crc.copy()
+    crc.update(b'efgh\n')
+
+    assert crc.digest() == zlib.crc32(b'abcd\nefgh\n').to_bytes(4, 'big')
+    assert copied.digest() == zlib.crc32(b'abcd\n').to_bytes(4, 'big')
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('sha1 ' + base64.b64encode(b'digest').decode(), ('sha1', b'digest')),
+    ('crc32 AAAAAA==', ('crc32', b'\0\0\0\0')),
+    ('sha256 ' + base64.b64encode(b'digest').decode(), None),
+    ('md5 ###', None),
+    ('md5', None),
+])
+def test_parse_checksum(header, expected):
+    assert parse_checksum(header) == expected
+
+
+def test_digest_header():
+    digest = hashlib.sha256(b'data')
+
+    assert digest_header('sha256', digest.hexdigest()) == f'SHA-256={base64.b64encode(digest.digest()).decode()}'
+    assert digest_header('sha384', hashlib.sha384(b'abcd').hexdigest()) is None
+    assert digest_header('crc32', Crc32().hexdigest()) is None
+
+
+def test_running_digests_continue_only_from_known_offset():
+    digests = RunningDigests('sha256')
+    hasher = digests.get('upload', 0)
+    hasher.update(b'abcd\n')
+    digests.put('upload', 5, hasher)
+
+    assert digests.get('upload', 5) is hasher
+    assert digests.get('upload', 10) is None
+    assert digests.get('upload', 5) is None
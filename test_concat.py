@@ -0,0 +1,54 @@
+import errno
+import os
+
+import pytest
+
+import concat
+
+
+@pytest.fixture
+def sources(tmp_path):
+    paths = []
+    for i, size in enumerate([3 * 1024 * 1024 + 7, 0, 1024 * 1024 + 1]):
+        path = tmp_path / f'partial{i}'
+        path.write_bytes(bytes([i + 1]) * size)
+        paths.append(path)
+    return paths
+
+
+def expected_content(sources):
+    return b''.join(path.read_bytes() for path in sources)
+
+
+def test_concatenate_copies_whole_files(sources, tmp_path):
+    target = tmp_path / 'final'
+    copied = []
+
+    concat.concatenate(sources, target, progress=copied.append, step_size=1024 * 1024)
+
+    assert target.read_bytes() == expected_content(sources)
+    assert sum(copied) == len(expected_content(sources))
+
+
+@pytest.mark.parametrize('unsupported', [['copy_file_range'], ['copy_file_range', 'sendfile']])
+def test_concatenate_falls_back_when_kernel_copy_is_unsupported(sources, tmp_path, monkeypatch, unsupported):
+    def refuse(*args):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    for name in unsupported:
+        monkeypatch.setattr(concat.os, name, refuse, raising=False)
+    target = tmp_path / 'final'
+
+    concat.concatenate(sources, target)
+
+    assert target.read_bytes() == expected_content(sources)
+
+
+def test_copy_file_raises_errors_other_than_unsupported(sources, tmp_path, monkeypatch):
+    def fail(*args):
+        raise OSError(errno.EIO, os.strerror(errno.EIO))
+
+    monkeypatch.setattr(concat.os, 'copy_file_range', fail, raising=False)
+
+    with pytest.raises(OSError):
+        concat.concatenate(sources, tmp_path / 'final')
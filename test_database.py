@@ -1,11 +1,11 @@
 import pytest
 
-from database import Database
+from database import CompactBackend, create_backend, Database, SQLiteBackend
 
 
-@pytest.fixture
-def database():
-    return Database()
+@pytest.fixture(params=['memory', 'compact', 'sqlite'])
+def database(request, tmp_path):
+    return Database(create_backend(request.param, str(tmp_path / 'uploads.db')))
 
 
 def test_add_uploads_save_new_upload_data(database):
@@ -61,3 +61,134 @@ def test_set_upload_length(database):
 
     assert data.upload_length == upload_length
     assert data.upload_defer_length is None
+
+
+def test_set_upload_offset_updates_offset_when_expected_offset_matches(database):
+    data = database.add_uploads(upload_length=100)
+
+    assert database.set_upload_offset(data.id, 10, expected=0)
+    assert database.set_upload_offset(data.id, 30, expected=10)
+
+    assert database.get_by_id(data.id).upload_offset == 30
+
+
+def test_set_upload_offset_rejects_stale_expected_offset(database):
+    data = database.add_uploads(upload_length=100)
+    database.set_upload_offset(data.id, 10, expected=0)
+
+    assert not database.set_upload_offset(data.id, 20, expected=0)
+
+    assert database.get_by_id(data.id).upload_offset == 10
+
+
+def test_sqlite_backend_shares_uploads_between_databases(tmp_path):
+    path = str(tmp_path / 'uploads.db')
+    first = Database(SQLiteBackend(path))
+    second = Database(SQLiteBackend(path))
+    parts = [data.id for data in [first.add_uploads(upload_length=5, upload_concat='partial')]]
+
+    data = first.add_uploads(upload_defer_length=1, metadata={'key': 'value'}, upload_concat='final;',
+                             upload_parts=parts)
+    second.set_upload_length(data.id, 10)
+    second.set_upload_offset(data.id, 5, expected=0)
+
+    retrieved = first.get_by_id(data.id)
+
+    assert retrieved.upload_length == 10
+    assert retrieved.upload_defer_length is None
+    assert retrieved.upload_offset == 5
+    assert retrieved.upload_metadata == {'key': 'value'}
+    assert retrieved.upload_parts == parts
+
+
+def test_set_upload_digest(database):
+    data = database.add_uploads(upload_length=100)
+
+    database.set_upload_digest(data.id, 'abcdef')
+
+    assert database.get_by_id(data.id).upload_digest == 'abcdef'
+
+
+def test_get_expired_returns_expired_uploads_earliest_first(database):
+    late = database.add_uploads(upload_length=100, upload_expires=20)
+    early = database.add_uploads(upload_length=100, upload_expires=10)
+    database.add_uploads(upload_length=100, upload_expires=40)
+    database.add_uploads(upload_length=100)
+
+    assert database.get_expired(now=30, limit=10) == [early.id, late.id]
+    assert database.get_expired(now=30, limit=1) == [early.id]
+
+
+def test_get_expired_follows_changed_expiration(database):
+    data = database.add_uploads(upload_length=100, upload_expires=10)
+
+    database.set_upload_expires(data.id, 50)
+    assert database.get_expired(now=30, limit=10) == []
+
+    database.set_upload_expires(data.id, None)
+    assert database.get_expired(now=60, limit=10) == []
+
+
+def test_delete_uploads(database):
+    deleted = [database.add_uploads(upload_length=100) for _ in range(0, 3)]
+    kept = database.add_uploads(upload_length=100)
+
+    database.delete_uploads([data.id for data in deleted])
+
+    assert all(database.get_by_id(data.id) is None for data in deleted)
+    assert database.get_by_id(kept.id) is not None
+
+
+def test_count(database):
+    uploads = [database.add_uploads(upload_length=1) for _ in range(3)]
+    assert database.count() == 3
+
+    database.delete_uploads([uploads[0].id])
+    assert database.count() == 2
+
+
+def test_add_uploads_many(database):
+    uploads = database.add_uploads_many([
+        {'upload_length': 10, 'metadata': {'filename': 'a.txt'}},
+        {'upload_defer_length': 1, 'upload_concat': 'partial', 'upload_expires': 100.0}
+    ])
+
+    first, second = [database.get_by_id(upload.id) for upload in uploads]
+    assert first.upload_length == 10
+    assert first.upload_metadata == {'filename': 'a.txt'}
+    assert second.upload_defer_length == 1
+    assert second.upload_concat == 'partial'
+    assert database.get_expired(100.0, 10) == [second.id]
+
+
+def test_upload_metadata_is_kept_in_header_form(database):
+    data = database.add_uploads(upload_length=1, metadata={'filename': 'world.txt'})
+
+    retrieved = database.get_by_id(data.id)
+    assert retrieved.upload_metadata_header == 'filename d29ybGQudHh0'
+    assert retrieved.upload_metadata == {'filename': 'world.txt'}
+
+
+def test_compact_backend_grows_and_reuses_records():
+    backend = CompactBackend()
+    database = Database(backend)
+    uploads = [database.add_uploads(upload_length=i, upload_concat='partial') for i in range(5000)]
+    database.delete_uploads([data.id for data in uploads[::2]])
+    uploads = uploads[1::2] + [database.add_uploads(upload_length=i) for i in range(2000)]
+
+    assert database.count() == 4500
+    assert len(backend._records) == 5000 * backend.RECORD.size
+    assert all(database.get_by_id(data.id).upload_length == data.upload_length for data in uploads)
+    assert database.get_by_id(uploads[0].id).upload_concat == 'partial'
+
+
+def test_compact_backend_drops_stale_expirations():
+    backend = CompactBackend()
+    database = Database(backend)
+    data = database.add_uploads(upload_length=1, upload_expires=1.0)
+    for i in range(2 * backend.MIN_SLOTS):
+        database.set_upload_expires(data.id, 2.0 + i)
+
+    assert database.get_expired(1.5, 10) == []
+    assert len(backend._expirations) == 1
+    assert database.get_expired(2.0 + 2 * backend.MIN_SLOTS, 10) == [data.id]
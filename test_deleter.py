@@ -0,0 +1,89 @@
+import time
+
+from database import Database
+from deleter import Deleter
+from locks import LockManager
+from storage import LocalStorage
+
+
+def wait_until_removed(deleter, ids):
+    deadline = time.time() + 5
+    while any(deleter.is_pending(id) for id in ids) and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_delete_returns_at_once_and_removes_uploads_in_background(tmp_path):
+    database = Database()
+    storage = LocalStorage([(tmp_path, 1)])
+    uploads = [database.add_uploads(upload_length=5) for _ in range(0, 3)]
+    for data in uploads:
+        storage.write(data.id, 0, b'abcd\n')
+    deleter = Deleter(database, storage, batch_size=2)
+
+    for data in uploads:
+        deleter.delete(data.id)
+        assert deleter.is_pending(data.id)
+    wait_until_removed(deleter, [data.id for data in uploads])
+
+    assert all(database.get_by_id(data.id) is None for data in uploads)
+    assert all(not storage.path(data.id).exists() for data in uploads)
+    assert (deleter.deleted_uploads, deleter.deleted_bytes) == (3, 15)
+
+
+def test_delete_batch_removes_at_most_batch_size_uploads(tmp_path):
+    database = Database()
+    deleter = Deleter(database, LocalStorage([(tmp_path, 1)]), batch_size=2, linger=60)
+    uploads = [database.add_uploads(upload_length=5) for _ in range(0, 3)]
+    for data in uploads:
+        deleter.delete(data.id)
+
+    assert deleter.delete_batch() == 2
+    assert deleter.queue_depth == 1
+    assert [deleter.is_pending(data.id) for data in uploads] == [False, False, True]
+
+
+def test_queued_uploads_expire_for_other_processes(tmp_path):
+    database = Database()
+    deleter = Deleter(database, LocalStorage([(tmp_path, 1)]), linger=60)
+    data = database.add_uploads(upload_length=5)
+
+    deleter.delete(data.id)
+
+    assert database.get_expired(time.time(), 10) == [data.id]
+
+
+def test_delete_batch_limits_removed_bytes_per_second(tmp_path):
+    database = Database()
+    storage = LocalStorage([(tmp_path, 1)])
+    deleter = Deleter(database, storage, max_bytes_per_second=1000, linger=60)
+    data = database.add_uploads(upload_length=100)
+    storage.write(data.id, 0, b'a' * 100)
+    deleter.delete(data.id)
+
+    started = time.monotonic()
+    deleter.flush()
+
+    assert time.monotonic() - started >= 0.09
+
+
+def test_delete_batch_puts_back_uploads_being_written(tmp_path):
+    database = Database()
+    storage = LocalStorage([(tmp_path, 1)])
+    locks = LockManager()
+    uploads = [database.add_uploads(upload_length=5) for _ in range(0, 2)]
+    for data in uploads:
+        storage.write(data.id, 0, b'abcd\n')
+    deleter = Deleter(database, storage, linger=60, locks=locks)
+    for data in uploads:
+        deleter.delete(data.id)
+
+    locks.try_lock(uploads[0].id)
+    assert deleter.delete_batch() == 1
+    assert storage.path(uploads[0].id).exists()
+    assert deleter.is_pending(uploads[0].id)
+    assert not deleter.is_pending(uploads[1].id)
+
+    locks.unlock(uploads[0].id)
+    assert deleter.delete_batch() == 1
+    assert not storage.path(uploads[0].id).exists()
+    assert locks._claimed == {}
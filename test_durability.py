@@ -0,0 +1,38 @@
+import asyncio
+
+from durability import GroupCommitter
+from executor import InlineIOExecutor
+
+
+class RecordingStorage:
+    def __init__(self):
+        self.synced = []
+
+    def sync(self, file_ids):
+        self.synced.append(sorted(file_ids))
+
+
+def test_uploads_waiting_together_are_synced_in_one_batch():
+    storage = RecordingStorage()
+    committer = GroupCommitter(storage, InlineIOExecutor(8), interval=0.01, max_bytes=1024)
+
+    async def main():
+        await asyncio.gather(*[committer.sync(i, 10) for i in range(5)])
+
+    asyncio.run(main())
+
+    assert storage.synced == [[0, 1, 2, 3, 4]]
+    assert (committer.batches, committer.synced_uploads) == (1, 5)
+
+
+def test_batch_is_synced_at_once_when_max_bytes_were_written():
+    storage = RecordingStorage()
+    committer = GroupCommitter(storage, InlineIOExecutor(8), interval=60, max_bytes=100)
+
+    async def main():
+        await asyncio.wait_for(asyncio.gather(committer.sync(1, 60), committer.sync(2, 60)), timeout=5)
+        await asyncio.wait_for(committer.sync(3, 100), timeout=5)
+
+    asyncio.run(main())
+
+    assert storage.synced == [[1, 2], [3]]
@@ -0,0 +1,43 @@
+import asyncio
+import threading
+
+import pytest
+
+from executor import create_executor, InlineIOExecutor, ThreadPoolIOExecutor
+
+
+def test_thread_pool_executor_runs_operation_in_worker_thread():
+    executor = ThreadPoolIOExecutor(max_concurrency=2, max_workers=2)
+
+    thread = asyncio.run(executor.run(threading.current_thread))
+
+    assert thread is not threading.main_thread()
+    executor.shutdown()
+
+
+def test_executor_limits_concurrency_and_reports_queue_depth():
+    executor = ThreadPoolIOExecutor(max_concurrency=1, max_workers=4)
+    release = threading.Event()
+    depths = []
+
+    async def main():
+        first = asyncio.ensure_future(executor.run(release.wait))
+        second = asyncio.ensure_future(executor.run(lambda: None))
+        await asyncio.sleep(0.05)
+        depths.append((executor.active, executor.queue_depth))
+        release.set()
+        await asyncio.gather(first, second)
+        depths.append((executor.active, executor.queue_depth))
+
+    asyncio.run(main())
+
+    assert depths == [(1, 1), (0, 0)]
+    executor.shutdown()
+
+
+def test_create_executor_returns_configured_kind():
+    assert isinstance(create_executor('inline', 1, 1), InlineIOExecutor)
+    assert isinstance(create_executor('thread', 1, 1), ThreadPoolIOExecutor)
+
+    with pytest.raises(ValueError):
+        create_executor('unknown', 1, 1)
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from locks import create_lock_manager, FileLockManager, LockManager, LockTimeout
+
+
+@pytest.fixture(params=['memory', 'file'])
+def manager(request, tmp_path):
+    return create_lock_manager(request.param, str(tmp_path))
+
+
+def test_lock_serializes_holders_of_the_same_upload(manager):
+    events = []
+
+    async def write(name):
+        async with manager.lock('upload'):
+            events.append(f'{name} start')
+            await asyncio.sleep(0.01)
+            events.append(f'{name} end')
+
+    async def main():
+        await asyncio.gather(write('first'), write('second'))
+
+    asyncio.run(main())
+
+    assert events == ['first start', 'first end', 'second start', 'second end']
+    assert manager.contended == 1
+    assert manager.wait_seconds > 0
+
+
+def test_lock_does_not_block_other_uploads(manager):
+    async def main():
+        async with manager.lock('first'):
+            async with manager.lock('second', timeout=0.1):
+                return True
+
+    assert asyncio.run(main())
+    assert manager.contended == 0
+
+
+def test_lock_raises_lock_timeout_when_held_too_long(manager):
+    async def main():
+        async with manager.lock('upload'):
+            async with manager.lock('upload', timeout=0.01):
+                pass
+
+    with pytest.raises(LockTimeout):
+        asyncio.run(main())
+
+    assert manager.timeouts == 1
+
+
+def test_lock_entries_are_removed_after_release():
+    manager = LockManager()
+
+    async def main():
+        async with manager.lock('upload'):
+            pass
+
+    asyncio.run(main())
+
+    assert manager._locks == {}
+
+
+def test_file_lock_is_shared_between_managers(tmp_path):
+    first = FileLockManager(str(tmp_path))
+    second = FileLockManager(str(tmp_path))
+
+    async def main():
+        async with first.lock('upload'):
+            async with second.lock('upload', timeout=0.05):
+                pass
+
+    with pytest.raises(LockTimeout):
+        asyncio.run(main())
+
+    assert second.contended == 1
+
+
+def test_try_lock_fails_while_the_lock_is_held(manager):
+    async def main():
+        async with manager.lock('upload'):
+            return manager.try_lock('upload')
+
+    assert not asyncio.run(main())
+    assert manager.try_lock('upload')
+    assert not manager.try_lock('upload')
+    manager.unlock('upload')
+
+
+def test_lock_waits_for_try_lock_to_be_unlocked(manager):
+    async def main():
+        assert manager.try_lock('upload')
+        asyncio.get_event_loop().call_later(0.02, manager.unlock, 'upload')
+        started = asyncio.get_event_loop().time()
+        async with manager.lock('upload', timeout=1):
+            return asyncio.get_event_loop().time() - started
+
+    assert asyncio.run(main()) >= 0.02
+    assert manager._claimed == {}
+
+
+def test_try_lock_is_shared_between_file_managers(tmp_path):
+    first = FileLockManager(str(tmp_path))
+    second = FileLockManager(str(tmp_path))
+
+    assert first.try_lock('upload')
+    assert not second.try_lock('upload')
+    first.unlock('upload')
+    assert second.try_lock('upload')
+    second.unlock('upload')
+
+
+def test_lock_files_are_sharded_and_removed_with_their_upload(tmp_path):
+    manager = FileLockManager(str(tmp_path))
+
+    async def main():
+        async with manager.lock('upload'):
+            pass
+
+    asyncio.run(main())
+    assert (tmp_path / 'up' / 'upload.lock').exists()
+
+    assert manager.try_lock('upload')
+    manager.unlock('upload', remove=True)
+    assert not (tmp_path / 'up' / 'upload.lock').exists()
+
+
+def test_lock_waiting_on_a_removed_file_is_taken_on_its_replacement(tmp_path):
+    first = FileLockManager(str(tmp_path))
+    second = FileLockManager(str(tmp_path))
+    third = FileLockManager(str(tmp_path))
+
+    async def main():
+        assert first.try_lock('upload')
+        asyncio.get_event_loop().call_later(0.02, first.unlock, 'upload', True)
+        async with second.lock('upload', timeout=1):
+            assert not third.try_lock('upload')
+
+    asyncio.run(main())
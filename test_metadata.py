@@ -0,0 +1,26 @@
+import base64
+
+from metadata import to_metadata_dict, to_metadata_header
+
+
+def encode(value):
+    return base64.standard_b64encode(value).decode()
+
+
+def test_metadata_round_trip():
+    metadata = {'filename': 'world.txt', 'type': 'text/plain', 'empty': ''}
+
+    assert to_metadata_dict(to_metadata_header(metadata)) == metadata
+
+
+def test_invalid_pairs_are_ignored():
+    header = ','.join([
+        f'filename {encode(b"world.txt")}',
+        'key-only',
+        'not-base64 !!!',
+        f'not-utf8 {encode(bytes([0xff, 0xfe]))}',
+        f'too many {encode(b"x")}',
+        f' spaced {encode(b"value")}'
+    ])
+
+    assert to_metadata_dict(header) == {'filename': 'world.txt', 'spaced': 'value'}
@@ -0,0 +1,80 @@
+import asyncio
+
+from metrics import PhaseTimer, Registry
+
+
+def test_counter_and_gauge_are_rendered():
+    registry = Registry()
+    counter = registry.counter('requests_total', 'Requests.')
+    gauge = registry.gauge('in_flight', 'In flight.')
+    registry.gauge('answer', 'Read on render.', function=lambda: 42)
+
+    counter.inc()
+    counter.inc(2)
+    gauge.inc()
+    gauge.dec()
+    gauge.inc(5)
+
+    assert registry.render() == (
+        '# HELP requests_total Requests.\n'
+        '# TYPE requests_total counter\n'
+        'requests_total 3\n'
+        '# HELP in_flight In flight.\n'
+        '# TYPE in_flight gauge\n'
+        'in_flight 5\n'
+        '# HELP answer Read on render.\n'
+        '# TYPE answer gauge\n'
+        'answer 42\n'
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram('latency_seconds', 'Latency.', ['handler'], buckets=[0.1, 1.0])
+
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        histogram.labels('get').observe(value)
+
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{handler="get",le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{handler="get",le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{handler="get",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{handler="get"} 2.65' in lines
+    assert 'latency_seconds_count{handler="get"} 4' in lines
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter('errors_total', 'Errors.', ['message']).labels('a "b"\n').inc()
+
+    assert 'errors_total{message="a \\"b\\"\\n"} 1' in registry.render().splitlines()
+
+
+def test_time_keeps_coroutine_functions_awaitable():
+    histogram = Registry().histogram('seconds', 'Seconds.')
+
+    @histogram.time()
+    async def handler():
+        return 'async'
+
+    @histogram.time()
+    def sync_handler():
+        return 'sync'
+
+    assert asyncio.iscoroutinefunction(handler)
+    assert asyncio.run(handler()) == 'async'
+    assert sync_handler() == 'sync'
+    assert histogram.labels().count == 2
+
+
+def test_phase_timer_observes_each_phase_once():
+    histogram = Registry().histogram('phase_seconds', 'Phases.', ['phase'])
+    timer = PhaseTimer(histogram)
+
+    for _ in range(3):
+        timer.mark('read')
+        timer.mark('write')
+    timer.observe()
+
+    assert histogram.labels('read').count == 1
+    assert histogram.labels('write').count == 1
@@ -0,0 +1,59 @@
+import pytest
+
+from database import Database, SQLiteBackend
+from locks import LockManager
+from reaper import Reaper
+from storage import LocalStorage
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def database(request, tmp_path):
+    if request.param == 'sqlite':
+        return Database(SQLiteBackend(str(tmp_path / 'uploads.db')))
+    return Database()
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorage([(tmp_path / 'uploads', 1)])
+
+
+def test_reap_deletes_expired_uploads_and_reports_reclaimed_bytes(database, storage):
+    expired = [database.add_uploads(upload_length=100, upload_expires=10 + i) for i in range(0, 5)]
+    alive = database.add_uploads(upload_length=100, upload_expires=100)
+    for data in expired + [alive]:
+        storage.write(data.id, 0, b'abcd\n')
+    deleted = []
+    reaper = Reaper(database, storage, batch_size=2, on_delete=deleted.append)
+
+    assert reaper.reap(now=50) == (5, 25)
+
+    assert all(database.get_by_id(data.id) is None for data in expired)
+    assert all(not storage.path(data.id).exists() for data in expired)
+    assert database.get_by_id(alive.id) is not None
+    assert storage.path(alive.id).exists()
+    assert deleted == [data.id for data in expired]
+    assert (reaper.reaped_uploads, reaper.reclaimed_bytes) == (5, 25)
+
+
+def test_reap_removes_metadata_of_uploads_without_data(database, storage):
+    data = database.add_uploads(upload_length=100, upload_expires=10)
+
+    assert Reaper(database, storage).reap(now=50) == (1, 0)
+    assert database.get_by_id(data.id) is None
+
+
+def test_reap_leaves_uploads_being_written_for_a_later_run(database, storage):
+    locks = LockManager()
+    expired = [database.add_uploads(upload_length=100, upload_expires=10) for _ in range(0, 3)]
+    for data in expired:
+        storage.write(data.id, 0, b'abcd\n')
+    reaper = Reaper(database, storage, batch_size=2, locks=locks)
+
+    locks.try_lock(expired[0].id)
+    assert reaper.reap(now=50) == (2, 10)
+    assert database.get_by_id(expired[0].id) is not None
+    assert storage.path(expired[0].id).exists()
+
+    locks.unlock(expired[0].id)
+    assert reaper.reap(now=50) == (1, 5)
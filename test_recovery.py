@@ -0,0 +1,104 @@
+import time
+import uuid
+
+import pytest
+
+import storage as storages
+from database import create_backend, Database
+from recovery import UploadJournal
+
+
+@pytest.fixture(params=['local', 'object'])
+def storage(request, tmp_path):
+    return storages.create_storage(request.param, str(tmp_path))
+
+
+def restart(storage, expiration=0):
+    """
+    A database of a new process, recovering from the sidecars of the storage.
+    """
+    return Database(create_backend('compact'), UploadJournal(storage, expiration, workers=2, batch_size=3))
+
+
+def test_upload_is_recovered_with_offset_from_its_data(storage):
+    db = restart(storage)
+    upload = db.add_uploads(upload_length=10, metadata={'filename': 'a.txt'}, upload_concat='partial',
+                            upload_expires=time.time() + 60)
+    storage.write(upload.id, 0, b'abcd\n')
+    db.set_upload_offset(upload.id, 5, expected=0)
+
+    recovered = restart(storage).get_by_id(upload.id)
+
+    assert recovered.upload_offset == 5
+    assert recovered.upload_length == 10
+    assert recovered.upload_metadata == {'filename': 'a.txt'}
+    assert recovered.upload_concat == 'partial'
+    assert recovered.upload_expires == upload.upload_expires
+
+
+def test_changes_other_than_offset_are_journaled(storage):
+    db = restart(storage)
+    upload = db.add_uploads(upload_defer_length='1', upload_expires=time.time() + 60)
+    storage.write(upload.id, 0, b'abcd\n')
+    db.set_upload_length(upload.id, 5)
+    db.set_upload_digest(upload.id, 'digest')
+    db.set_upload_expires(upload.id, None)
+    final = db.add_uploads(5, upload_concat=f'final;/files/{upload.id}', upload_parts=[upload.id])
+
+    recovered_db = restart(storage)
+    recovered = recovered_db.get_by_id(upload.id)
+
+    assert (recovered.upload_length, recovered.upload_defer_length) == (5, None)
+    assert recovered.upload_digest == 'digest'
+    assert recovered.upload_expires is None
+    assert recovered_db.get_by_id(final.id).upload_parts == [upload.id]
+
+
+def test_expiration_is_extended_from_the_last_write(storage):
+    db = restart(storage, expiration=100)
+    upload = db.add_uploads(upload_length=10, upload_expires=time.time() + 10)
+    storage.write(upload.id, 0, b'abcd\n')
+
+    recovered = restart(storage, expiration=100).get_by_id(upload.id)
+
+    assert recovered.upload_expires >= time.time() + 90
+
+
+def test_recover_loads_every_upload_and_keeps_those_recovered_on_access(storage):
+    db = restart(storage)
+    uploads = [db.add_uploads(upload_length=10) for _ in range(10)]
+    storage.write(uploads[0].id, 0, b'abcd\n')
+    recovered_db = restart(storage)
+    accessed = recovered_db.get_by_id(uploads[0].id)
+    recovered_db.set_upload_offset(accessed.id, 7, expected=5)
+
+    assert recovered_db.recover() == 9
+
+    assert recovered_db.count() == 10
+    assert recovered_db.journal.complete
+    assert recovered_db.journal.recovered_uploads == 10
+    assert recovered_db.get_by_id(uploads[0].id).upload_offset == 7
+
+
+def test_deleted_upload_is_not_recovered(storage):
+    db = restart(storage)
+    upload = db.add_uploads(upload_length=10)
+    storage.write(upload.id, 0, b'abcd\n')
+
+    storage.delete(upload.id)
+    db.delete_uploads([upload.id])
+
+    recovered_db = restart(storage)
+    assert recovered_db.get_by_id(upload.id) is None
+    assert recovered_db.recover() == 0
+
+
+def test_missing_upload_is_not_looked_up_once_recovery_is_complete(storage, monkeypatch):
+    db = restart(storage)
+    upload = db.add_uploads(upload_length=10)
+    recovered_db = restart(storage)
+    recovered_db.recover()
+    monkeypatch.setattr(storage, 'read_info', lambda file_id: pytest.fail('sidecar read'))
+
+    assert recovered_db.get_by_id(upload.id) is not None
+    assert recovered_db.get_by_id(uuid.uuid4()) is None
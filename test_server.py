@@ -0,0 +1,190 @@
+import http.client
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+from uvicorn.config import Config
+
+from server import WorkerServer
+
+
+@pytest.fixture
+def server(tmp_path):
+    env = {
+        **os.environ,
+        'TUS_SERVER_PORT': '0',
+        'TUS_SERVER_WORKERS': '2',
+        'TUS_DATABASE_PATH': str(tmp_path / 'tus.sqlite3'),
+        'TUS_LOCK_MANAGER': 'file',
+        'TUS_LOCK_DIRECTORY': str(tmp_path / 'locks'),
+        'TUS_STORAGE_ROOTS': str(tmp_path / 'uploads'),
+    }
+    # a session of its own, so its process group can be signalled like a terminal or a service manager does.
+    process = subprocess.Popen([sys.executable, 'server.py'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               env=env, stderr=subprocess.PIPE, text=True, start_new_session=True)
+    port = None
+    for line in process.stderr:
+        matched = re.search(r'serving on [^:]+:(\d+)', line)
+        if matched:
+            port = int(matched[1])
+            break
+
+    assert port is not None
+    wait_for_port(port)
+    yield process, port
+
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+
+
+def wait_for_port(port):
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('OPTIONS', '/files')
+            connection.getresponse().read()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def request(port, method, path, headers, body=None):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    connection.request(method, path, body=body, headers=headers)
+    resp = connection.getresponse()
+    resp.read()
+    connection.close()
+    return resp
+
+
+def test_workers_share_uploads(server):
+    _, port = server
+    resp = request(port, 'POST', '/files', {'Upload-Length': '10', 'Tus-Resumable': '1.0.0'})
+    location = resp.getheader('Location')
+
+    # every request has its own connection, so requests reach both workers.
+    for offset in range(0, 10, 2):
+        headers = {
+            'Content-Type': 'application/offset+octet-stream',
+            'Upload-Offset': str(offset),
+            'Tus-Resumable': '1.0.0'
+        }
+        assert request(port, 'PATCH', location, headers, b'ab').status == 204
+        assert request(port, 'HEAD', location, {'Tus-Resumable': '1.0.0'}).getheader('Upload-Offset') == \
+            str(offset + 2)
+
+
+def descendants(pid):
+    """
+    Pids of the processes started by pid, and by those.
+    """
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as stat:
+                    ppid = int(stat.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+
+    found = []
+    parents = [pid]
+    while parents:
+        pids = children.get(parents.pop(), [])
+        found += pids
+        parents += pids
+    return found
+
+
+def start_patch(port):
+    """
+    A PATCH of 10 bytes, of which 5 are sent.
+    """
+    location = request(port, 'POST', '/files', {'Upload-Length': '10', 'Tus-Resumable': '1.0.0'}) \
+        .getheader('Location')
+
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    connection.putrequest('PATCH', location)
+    for name, value in [('Content-Type', 'application/offset+octet-stream'), ('Upload-Offset', '0'),
+                        ('Content-Length', '10'), ('Tus-Resumable', '1.0.0')]:
+        connection.putheader(name, value)
+    connection.endheaders(b'abcde')
+    time.sleep(0.5)
+    return connection
+
+
+@pytest.mark.parametrize('stop', ['group', 'every process'])
+def test_shutdown_by_signals_to_every_worker_lets_in_flight_patch_finish(server, stop):
+    """
+    Ctrl+C signals the process group of the terminal, and a service manager every process of the service,
+    besides the signals the supervisor sends to the workers.
+    """
+    process, port = server
+    connection = start_patch(port)
+
+    if stop == 'group':
+        os.killpg(process.pid, signal.SIGINT)
+    else:
+        for pid in [process.pid] + descendants(process.pid):
+            os.kill(pid, signal.SIGTERM)
+    time.sleep(0.5)
+    connection.send(b'fghij')
+
+    assert connection.getresponse().status == 204
+    assert process.wait(timeout=10) == 0
+
+
+def test_worker_server_is_not_forced_to_exit_by_a_second_signal():
+    server = WorkerServer(Config(lambda scope: None))
+
+    server.handle_exit(signal.SIGTERM, None)
+    server.handle_exit(signal.SIGINT, None)
+
+    assert server.should_exit
+    assert not server.force_exit
+
+
+def test_shutdown_lets_in_flight_patch_finish(server):
+    process, port = server
+    connection = start_patch(port)
+
+    process.send_signal(signal.SIGTERM)
+    time.sleep(0.5)
+    connection.send(b'fghij')
+
+    assert connection.getresponse().status == 204
+    assert process.wait(timeout=10) == 0
+
+
+@pytest.mark.parametrize('settings, workers', [
+    ({}, 1),
+    ({'TUS_DATABASE_PATH': 'tus.sqlite3'}, 1),
+    ({'TUS_DATABASE_PATH': 'tus.sqlite3', 'TUS_LOCK_MANAGER': 'file'}, 8),
+])
+def test_default_workers_run_only_with_shared_state(settings, workers):
+    env = {key: value for key, value in os.environ.items() if not key.startswith('TUS_')}
+    output = subprocess.run([sys.executable, '-c', 'import os; os.cpu_count = lambda: 8; import config; '
+                             'print(config.SERVER_WORKERS)'],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env={**env, **settings},
+                            stdout=subprocess.PIPE, text=True, check=True).stdout
+
+    assert int(output) == workers
+
+
+def test_dedup_refuses_to_start_without_a_collision_resistant_digest():
+    env = {key: value for key, value in os.environ.items() if not key.startswith('TUS_')}
+    result = subprocess.run([sys.executable, 'server.py'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            env={**env, 'TUS_DEDUP': '1', 'TUS_UPLOAD_DIGEST': 'crc32'},
+                            stderr=subprocess.PIPE, text=True, timeout=30)
+
+    assert result.returncode == 1
+    assert 'collision resistant' in result.stderr
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+from shaping import BandwidthShaper, FairScheduler, TokenBucket
+
+
+def test_token_bucket_lets_bursts_through_and_delays_the_rest():
+    bucket = TokenBucket(rate=1000, burst=500)
+    now = bucket.updated
+
+    assert bucket.take(500, now) == 0
+    assert bucket.delay(100, now) == 0.1
+    assert bucket.take(100, now) == 0.1
+    assert bucket.delay(100, now + 0.5) == 0
+
+
+def test_token_bucket_lets_pieces_larger_than_burst_through_a_full_bucket():
+    bucket = TokenBucket(rate=1000, burst=500)
+    now = bucket.updated
+
+    assert bucket.delay(2000, now) == 0
+    assert bucket.take(2000, now) == 1.5
+
+
+def test_upload_rate_slows_down_its_writer():
+    shaper = BandwidthShaper(upload_rate=100000, burst=10000)
+
+    async def receive():
+        writer = shaper.writer('upload', 'client')
+        for _ in range(5):
+            await writer.throttle(10000)
+        writer.close()
+
+    started = time.monotonic()
+    asyncio.run(receive())
+
+    assert time.monotonic() - started >= 0.35
+    assert shaper.throttled_seconds > 0
+    assert (shaper.writers, shaper._uploads, shaper._clients) == (0, {}, {})
+
+
+def test_uploads_of_a_client_share_its_rate():
+    shaper = BandwidthShaper(client_rate=100000, burst=10000)
+    first = shaper.writer('first', 'client')
+    second = shaper.writer('second', 'client')
+
+    assert first.buckets == second.buckets
+    first.close()
+    assert len(shaper._clients) == 1
+    second.close()
+    assert shaper._clients == {}
+
+
+def test_fair_scheduler_does_not_keep_small_pieces_behind_large_ones():
+    scheduler = FairScheduler(TokenBucket(rate=1000000, burst=100000))
+    seconds = {}
+
+    async def send(flow, pieces, size):
+        started = time.monotonic()
+        for _ in range(pieces):
+            await scheduler.acquire(flow, size)
+        seconds[flow] = time.monotonic() - started
+
+    async def main():
+        large = asyncio.ensure_future(send('large', 5, 100000))
+        await asyncio.sleep(0.01)
+        await send('small', 4, 1000)
+        await large
+
+    asyncio.run(main())
+
+    assert seconds['small'] < 0.05
+    assert seconds['large'] >= 0.35
@@ -0,0 +1,230 @@
+import os
+import shutil
+import uuid
+from collections import namedtuple
+
+import pytest
+
+import storage as storages
+from storage import FileDescriptorCache, LocalStorage, MockObjectStorage
+
+
+@pytest.fixture(params=['local', 'object'])
+def storage(request, tmp_path):
+    return storages.create_storage(request.param, str(tmp_path))
+
+
+def test_write_puts_data_at_offset_and_returns_next_offset(storage):
+    assert storage.write('upload', 0, b'abcd\n') == 5
+    assert storage.write('upload', 5, b'efgh\n') == 10
+    assert storage.write('upload', 5, b'EFGH\n') == 10
+
+    assert storage.read('upload', 0, 100) == b'abcd\nEFGH\n'
+    assert storage.read('upload', 3, 4) == b'd\nEF'
+
+
+def test_delete_removes_data_and_returns_freed_bytes(storage):
+    storage.write('upload', 0, b'abcd\n')
+
+    assert storage.delete('upload') == 5
+    assert storage.delete('upload') == 0
+    with pytest.raises(FileNotFoundError):
+        storage.read('upload', 0, 100)
+
+
+def test_concatenate_writes_sources_in_order(storage):
+    storage.write('first', 0, b'abcd\n')
+    storage.write('second', 0, b'efgh\n')
+    copied = []
+
+    storage.concatenate(['first', 'second'], 'final', copied.append)
+
+    assert storage.read('final', 0, 100) == b'abcd\nefgh\n'
+    assert sum(copied) == 10
+
+
+def test_local_storage_shards_files_by_upload_id(tmp_path):
+    storage = LocalStorage([(tmp_path, 1)], shard_depth=2)
+    file_id = uuid.uuid4()
+
+    storage.write(file_id, 0, b'a')
+
+    assert storage.path(file_id) == tmp_path / str(file_id)[0:2] / str(file_id)[2:4] / str(file_id)
+    assert storage.path(file_id).read_bytes() == b'a'
+
+
+def test_local_storage_spreads_uploads_by_weight(tmp_path):
+    roots = [(tmp_path / 'heavy', 3), (tmp_path / 'light', 1)]
+    storage = LocalStorage(roots)
+
+    placed = [storage.path(uuid.uuid4()).parts[-4] for _ in range(2000)]
+
+    assert 0.7 < placed.count('heavy') / len(placed) < 0.8
+    file_id = uuid.uuid4()
+    assert storage.path(file_id) == LocalStorage(roots).path(file_id)
+
+
+def test_local_storage_keeps_uploads_on_their_root_when_a_root_is_added(tmp_path):
+    roots = [(tmp_path / 'first', 1), (tmp_path / 'second', 1)]
+    storage = LocalStorage(roots)
+    file_ids = [uuid.uuid4() for _ in range(100)]
+    for file_id in file_ids:
+        storage.write(file_id, 0, b'a')
+    storage.write_info(file_ids[0], b'{}')
+    storage.path(file_ids[0]).unlink()
+
+    grown = LocalStorage(roots + [(tmp_path / 'third', 1)])
+
+    assert [grown.path(file_id) for file_id in file_ids] == [storage.path(file_id) for file_id in file_ids]
+    assert any(grown.path(uuid.uuid4()).parts[-4] == 'third' for _ in range(100))
+
+
+def test_local_storage_places_new_uploads_on_root_with_most_free_space(tmp_path, monkeypatch):
+    roots = [(tmp_path / 'full', 1), (tmp_path / 'empty', 1)]
+    usage = namedtuple('usage', 'total used free')
+    monkeypatch.setattr(shutil, 'disk_usage',
+                        lambda path: usage(100, 100, 0) if path.name == 'full' else usage(100, 0, 100))
+    storage = LocalStorage(roots, placement='free-space')
+    file_id = uuid.uuid4()
+
+    storage.write(file_id, 0, b'a')
+
+    assert storage.path(file_id).parts[-4] == 'empty'
+    assert LocalStorage(roots, placement='free-space').path(file_id) == storage.path(file_id)
+
+
+def test_object_storage_keeps_each_write_as_a_part(tmp_path):
+    storage = MockObjectStorage(tmp_path)
+    storage.write('upload', 0, b'abcd\n')
+    storage.write('upload', 5, b'efgh\n')
+
+    assert len(list((tmp_path / 'upload').iterdir())) == 2
+    assert storage.path('upload') is None
+    assert MockObjectStorage(tmp_path).read('upload', 0, 100) == b'abcd\nefgh\n'
+
+    with pytest.raises(ValueError):
+        storage.write('upload', 20, b'ijkl\n')
+
+
+def test_write_reuses_cached_file_descriptor(tmp_path):
+    storage = LocalStorage([(tmp_path, 1)])
+
+    for i in range(0, 4):
+        storage.write('upload', i, b'a')
+
+    assert storage.fds.misses == 1
+    assert storage.fds.hits == 3
+
+
+def test_fd_cache_closes_least_recently_used_over_capacity(tmp_path):
+    cache = FileDescriptorCache(capacity=2, idle_timeout=60)
+
+    for name in ['first', 'second', 'third']:
+        fd = cache.acquire(tmp_path / name, create=True)
+        cache.release(tmp_path / name, fd)
+
+    assert len(cache) == 2
+    assert tmp_path / 'first' not in cache._entries
+
+
+def test_fd_cache_closes_idle_descriptors_not_in_use(tmp_path):
+    cache = FileDescriptorCache(capacity=10, idle_timeout=0)
+    fd = cache.acquire(tmp_path / 'idle', create=True)
+    cache.release(tmp_path / 'idle', fd)
+    in_use = cache.acquire(tmp_path / 'in_use', create=True)
+
+    cache.evict_idle()
+
+    assert list(cache._entries) == [tmp_path / 'in_use']
+    assert os.write(in_use, b'a') == 1
+
+
+def test_fd_cache_closes_descriptors_in_use_once_released(tmp_path):
+    cache = FileDescriptorCache(capacity=10, idle_timeout=60)
+    path = tmp_path / 'upload'
+    fd = cache.acquire(path, create=True)
+
+    cache.close(path)
+    assert os.write(fd, b'a') == 1
+    reopened = cache.acquire(path)
+    cache.release(path, reopened)
+    cache.release(path, fd)
+
+    assert cache._closing == {}
+    with pytest.raises(OSError):
+        os.fstat(fd)
+    cache.release(path, fd)
+
+
+def test_local_storage_creates_files_only_when_writing_at_offset_zero(tmp_path):
+    storage = LocalStorage([(tmp_path, 1)])
+
+    with pytest.raises(FileNotFoundError):
+        storage.read('upload', 0, 5)
+    with pytest.raises(FileNotFoundError):
+        storage.write('upload', 5, b'abcd\n')
+    storage.sync(['upload'])
+    assert not storage.path('upload').exists()
+
+    storage.write('upload', 0, b'abcd\n')
+    assert storage.read('upload', 0, 5) == b'abcd\n'
+
+
+def test_local_storage_syncs_files_and_new_directories_once(tmp_path, monkeypatch):
+    storage = LocalStorage([(tmp_path, 1)])
+    storage.write('upload', 0, b'abcd\n')
+    synced = []
+    monkeypatch.setattr(os, 'fdatasync', lambda fd: synced.append('file'))
+    monkeypatch.setattr(os, 'fsync', lambda fd: synced.append('directory'))
+
+    storage.sync(['upload', 'missing'])
+    storage.sync(['upload'])
+
+    assert synced == ['file', 'directory', 'file']
+
+
+def test_truncate_drops_data_after_size(storage):
+    storage.write('upload', 0, b'abcd\n')
+    storage.write('upload', 5, b'efgh\n')
+
+    storage.truncate('upload', 3)
+
+    assert storage.read('upload', 0, 100) == b'abc'
+    assert storage.stat('upload')[0] == 3
+
+
+def test_uploads_of_the_same_content_share_a_blob_until_deleted(tmp_path):
+    storage = LocalStorage([(tmp_path, 1)])
+    for file_id in ['first', 'second', 'other']:
+        storage.write(file_id, 0, b'other\n' if file_id == 'other' else b'abcd\n')
+
+    assert storage.deduplicate('first', 'abcd') is False
+    assert storage.deduplicate('second', 'abcd') is True
+    assert storage.deduplicate('other', 'other') is False
+
+    blob = tmp_path / 'blobs' / 'ab' / 'abcd'
+    assert storage.path('first').stat().st_ino == storage.path('second').stat().st_ino == blob.stat().st_ino
+    assert storage.read('second', 0, 100) == b'abcd\n'
+    assert (storage.deduplicated_uploads, storage.deduplicated_bytes) == (1, 5)
+
+    assert storage.delete('first') == 0
+    storage.release_blob('abcd')
+    assert blob.exists()
+
+    storage.delete('second')
+    storage.release_blob('abcd')
+    assert not blob.exists()
+
+
+@pytest.mark.parametrize('contents', [[b'abcd\n', b'efgh\n'], [b'abcd\n', b'abcdefgh\n']])
+def test_uploads_of_different_content_under_the_same_key_keep_their_data(tmp_path, contents):
+    storage = LocalStorage([(tmp_path, 1)])
+    for file_id, content in zip(['first', 'second'], contents):
+        storage.write(file_id, 0, content)
+
+    assert storage.deduplicate('first', 'collision') is False
+    assert storage.deduplicate('second', 'collision') is False
+
+    assert storage.read('second', 0, 100) == contents[1]
+    assert storage.path('second').stat().st_nlink == 1
+    assert list(storage.path('second').parent.iterdir()) == [storage.path('second')]